@@ -15,4 +15,9 @@ from .forcing import xmlParser
 from .forcing import enviForce
 from .simulation import coralGLV
 from .simulation import coreData
+from .simulation import coreIndex
+from .simulation import faciesRuns
+from .simulation import gridData
 from .simulation import modelPlot
+from .simulation import outputH5
+from .planner import plan
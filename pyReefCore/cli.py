@@ -0,0 +1,214 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore headless batch runner.
+
+   Runs one or several XmL configurations without plotting and prints one summary per run
+   (wall time, steps per second, final core thickness, drowning time, number of facies
+   transitions). JSON summaries also hold the run-length encoded dominant facies of the core
+   (faciesRuns binary form in base64) as their compact core representation. Importing this
+   module loads the pyReefCore package modules (see pyReefCore/__init__) but neither the
+   Model class, which is imported when a simulation is run, nor the plotting libraries.
+   Example:
+
+       pyreefcore input1.xml input2.xml --workers 2 --format csv
+       python -m pyReefCore.cli input.xml --tend -2000 --profile prof
+"""
+import os
+import sys
+import json
+import base64
+import time
+import argparse
+
+# Summary fields in output order
+SUMMARY_FIELDS = ('xml', 'status', 'seed', 'tEnd', 'steps', 'load', 'wall', 'stepsPerSecond',
+                  'thickness', 'drowningTime', 'faciesTransitions', 'stopReason', 'outDir', 'profile', 'error')
+
+
+def runSummary(xml, tEnd=None, seed=None, profile=None, quiet=False, log=None, records=False):
+    """
+    Run a simulation headlessly and return its summary.
+
+    Parameters
+    ----------
+    variable : xml
+        XmL input file name.
+
+    variable : tEnd
+        Simulation end time (default is the end time of the XmL input file).
+
+    variable : seed
+        Random number generator seed.
+
+    variable : profile
+        Folder where the cProfile statistics of the run are written (optional).
+
+    variable : quiet
+        Discard the model messages instead of writing them on the standard error.
+
+    class : log
+        Progress log attached to the model during the run (optional).
+
+    variable : records
+        Add the core layer records to the summary as lists.
+    """
+
+    summary = {'xml': xml, 'status': 'error', 'seed': seed}
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w') if quiet else sys.stderr
+    try:
+        from pyReefCore.model import Model
+        from pyReefCore.simulation.faciesRuns import faciesRuns
+
+        t0 = time.time()
+        model = Model()
+        model.load_xml(xml, seed=seed)
+        summary['seed'] = int(model.seed)
+        summary['outDir'] = model.input.outDir
+        summary['load'] = time.time()-t0
+
+        drowning = []
+        if model.drownDepth is not None:
+            model.subscribe('drown', lambda m, event, t: drowning.append(float(t)))
+
+        if profile is not None:
+            import cProfile
+            prof = cProfile.Profile()
+            prof.enable()
+        if log is not None:
+            log.attach(model)
+        t0 = time.time()
+        iter0 = model.iter
+        try:
+            model.run_to_time(model.input.tEnd if tEnd is None else tEnd, showtime=1.e20)
+        finally:
+            if log is not None:
+                log.detach(model)
+        wall = time.time()-t0
+        if profile is not None:
+            prof.disable()
+            if not os.path.exists(profile):
+                os.makedirs(profile)
+            name = os.path.splitext(os.path.basename(xml))[0]
+            summary['profile'] = os.path.join(profile, '%s-%d.prof' %(name, os.getpid()))
+            prof.dump_stats(summary['profile'])
+
+        steps = model.iter-iter0
+        summary['status'] = 'ok'
+        summary['tEnd'] = float(model.tNow)
+        summary['steps'] = steps
+        summary['wall'] = wall
+        summary['stepsPerSecond'] = steps/wall if wall > 0. else None
+        summary['thickness'] = float(model.core.thickness.sum())
+        summary['drowningTime'] = drowning[0] if len(drowning) > 0 else None
+        summary['stopReason'] = model.stopReason
+        if model.metrics is not None:
+            summary['metrics'] = model.metrics.summary(model)
+            runs = model.metrics.facies.snapshot(model.core, model.layID)
+        else:
+            runs = faciesRuns.fromCore(model.core)
+        summary['faciesTransitions'] = runs.transitions()
+        summary['facies'] = base64.b64encode(runs.encode())
+        if records:
+            from pyReefCore.simulation.coreData import LAYER_RECORDS
+            summary['records'] = {}
+            for name in LAYER_RECORDS:
+                summary['records'][name] = getattr(model.core, name).tolist()
+    except Exception as err:
+        summary['error'] = '%s: %s' %(type(err).__name__, err)
+    finally:
+        if quiet:
+            sys.stdout.close()
+        sys.stdout = stdout
+
+    return summary
+
+
+def _runJob(job):
+    """
+    Pool worker running one simulation.
+    """
+
+    return runSummary(*job)
+
+
+def _write(stream, summary, format, first):
+    """
+    Write a run summary in the requested format.
+    """
+
+    if format == 'csv':
+        if first:
+            stream.write(','.join(SUMMARY_FIELDS)+'\n')
+        values = []
+        for field in SUMMARY_FIELDS:
+            value = summary.get(field)
+            values.append('' if value is None else str(value).replace(',', ';'))
+        stream.write(','.join(values)+'\n')
+    elif format == 'pretty':
+        stream.write(json.dumps(summary, indent=2, sort_keys=True)+'\n')
+    else:
+        stream.write(json.dumps(summary, sort_keys=True)+'\n')
+    stream.flush()
+
+    return
+
+
+def main(args=None):
+    """
+    Command line entry point.
+    """
+
+    parser = argparse.ArgumentParser(prog='pyreefcore',
+                                     description='Run pyReefCore simulations headlessly and '
+                                                 'print a summary of each run.')
+    parser.add_argument('xml', nargs='+', help='XmL input files')
+    parser.add_argument('--tend', type=float, default=None,
+                        help='simulation end time (default is the XmL end time)')
+    parser.add_argument('--seed', type=int, default=None, help='random number generator seed')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of simulations run in parallel (default 1)')
+    parser.add_argument('-f', '--format', choices=('json', 'pretty', 'csv'), default='json',
+                        help='summary format: one JSON line per run, indented JSON or CSV')
+    parser.add_argument('-o', '--output', default=None,
+                        help='summary file (default is the standard output)')
+    parser.add_argument('--profile', default=None, metavar='FOLDER',
+                        help='write the cProfile statistics of each run in FOLDER')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='discard the model messages (default is the standard error)')
+    opts = parser.parse_args(args)
+
+    jobs = [(xml, opts.tend, opts.seed, opts.profile, opts.quiet) for xml in opts.xml]
+    stream = sys.stdout if opts.output is None else open(opts.output, 'w')
+
+    failed = 0
+    if opts.workers > 1 and len(jobs) > 1:
+        import multiprocessing as mp
+        pool = mp.Pool(min(opts.workers, len(jobs)))
+        results = pool.imap(_runJob, jobs)
+    else:
+        pool = None
+        results = (_runJob(job) for job in jobs)
+    for k, summary in enumerate(results):
+        _write(stream, summary, opts.format, k == 0)
+        if summary['status'] != 'ok':
+            failed += 1
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    if opts.output is not None:
+        stream.close()
+
+    return 1 if failed > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
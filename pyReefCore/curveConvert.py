@@ -0,0 +1,46 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore forcing curve converter.
+
+   Converts forcing curves between the text format and the binary formats read by the
+   enviForce class. Binary curves are written uncompressed so they can be memory-mapped when
+   the simulation starts. Example:
+
+       python -m pyReefCore.curveConvert data/sealevel.csv data/sealevel.npy
+       python -m pyReefCore.curveConvert data/sealevel.csv data/forcing.h5 --dataset sea
+"""
+import sys
+import argparse
+
+from pyReefCore.forcing.enviForce import (readCurve, writeCurve)
+
+
+def main(args=None):
+    """
+    Command line entry point.
+    """
+
+    parser = argparse.ArgumentParser(description='Convert pyReefCore forcing curves between text, '
+                                                 'numpy (.npy, .npz) and HDF5 formats.')
+    parser.add_argument('input', help='input forcing curve file')
+    parser.add_argument('output', help='output forcing curve file, format defined by its extension')
+    parser.add_argument('--dataset', default=None, help='HDF5 dataset name of the output curve')
+    parser.add_argument('--input-dataset', default=None, help='dataset name of the input curve')
+    opts = parser.parse_args(args)
+
+    time, value = readCurve(opts.input, opts.input_dataset)
+    writeCurve(opts.output, time, value, opts.dataset)
+    print 'Forcing curve %s (%d records) converted to %s' %(opts.input, len(time), opts.output)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,337 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore ensemble result store.
+
+   The store gathers the parameters, summary metrics and layer arrays of many simulations in
+   a single folder. Each variable is kept in its own binary column file where row i holds the
+   values of the i-th appended run, array-valued variables (community matrix, layer arrays)
+   store the whole array in each row. Columns are memory-mapped when read, so filtering on
+   parameters or metrics only touches the required columns and rows.
+"""
+import os
+import json
+import fcntl
+import numpy as np
+
+
+def runParameters(input):
+    """
+    Numerical parameters of a parsed XmL input file. The community matrix is kept as a single
+    array-valued parameter.
+
+    Parameters
+    ----------
+    class: input
+        Input parameter class.
+    """
+
+    params = {}
+    for name in ('depth0', 'facOpt', 'karstRate', 'maxpop', 'prodscale', 'tStart', 'tEnd',
+                 'tCarb', 'laytime', 'seaval', 'tecval', 'sedval', 'flowval'):
+        params[name] = float(getattr(input, name))
+    for s in range(input.speciesNb):
+        params['malthus%d'%s] = input.malthusParam[s]
+        params['production%d'%s] = input.speciesProduction[s]
+        params['population%d'%s] = input.speciesPopulation[s]
+    params['communityMatrix'] = np.asarray(input.communityMatrix, dtype=np.float64)
+
+    return params
+
+
+def runSummary(model):
+    """
+    Summary metrics of a completed simulation.
+
+    Parameters
+    ----------
+    class: model
+        Simulated pyReefCore model.
+    """
+
+    core = model.core
+    coralh = core.coralH[:-1,:].sum(axis=0)
+
+    # First time the core top is deeper than the deepest species habitat (see Model)
+    drown = np.nan
+    if model.drowningTime is not None:
+        drown = model.drowningTime
+
+    summary = {'thickness': core.thickness.sum(),
+               'carbonate': coralh.sum(),
+               'siliciclastic': core.coralH[-1,:].sum(),
+               'karstero': core.karstero.sum(),
+               'surface': float(core.topH),
+               'drownTime': drown}
+    for s in range(len(core.names)):
+        summary['thick%d'%s] = core.coralH[s,:].sum()
+
+    return summary
+
+
+class ensembleStore(object):
+    """
+    Columnar store for the results of an ensemble of pyReefCore simulations.
+    """
+
+    def __init__(self, folder):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : folder
+            Folder containing the ensemble store.
+        """
+
+        self.folder = folder
+        self.schemafile = os.path.join(folder, 'schema.json')
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.schema = None
+        self._load_schema()
+
+        return
+
+    def _load_schema(self):
+        """
+        Read the store schema describing the columns.
+        """
+
+        if os.path.isfile(self.schemafile):
+            with open(self.schemafile) as f:
+                self.schema = json.load(f)
+
+        return
+
+    def _column_file(self, kind, name):
+
+        return os.path.join(self.folder, '%s_%s.f8' %(kind, name))
+
+    def _shape(self, kind, name):
+        """
+        Shape of the values of a column in each row.
+        """
+
+        if kind == 'param':
+            return self.schema.get('shapes', {}).get(name, [])
+        if kind == 'layer':
+            return self.schema['layers'][name]
+
+        return []
+
+    def __len__(self):
+
+        if self.schema is None:
+            return 0
+
+        return self.schema['runs']
+
+    def append(self, params, metrics, layers=None, runID=None):
+        """
+        Append the results of a simulation to the store.
+
+        Parameters
+        ----------
+        variable : params
+            Dictionary of the run parameter values.
+
+        variable : metrics
+            Dictionary of the run summary metrics.
+
+        variable : layers
+            Dictionary of the run layer arrays (optional).
+
+        variable : runID
+            Run identifier (default is the run index in the store).
+        """
+
+        if layers is None:
+            layers = {}
+
+        with open(os.path.join(self.folder, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._load_schema()
+
+            if self.schema is None:
+                self.schema = {'runs': 0,
+                               'params': sorted(params),
+                               'shapes': dict((k, list(np.shape(v))) for k, v in params.items()
+                                              if np.ndim(v) > 0),
+                               'metrics': sorted(metrics),
+                               'layers': dict((k, list(np.shape(v))) for k, v in layers.items())}
+            else:
+                if sorted(params) != self.schema['params']:
+                    raise ValueError('Run parameters do not match the ensemble store columns.')
+                for k in params:
+                    if list(np.shape(params[k])) != self._shape('param', k):
+                        raise ValueError('Run parameter %s does not match the ensemble store columns.'%k)
+                if sorted(metrics) != self.schema['metrics']:
+                    raise ValueError('Run metrics do not match the ensemble store columns.')
+                for k in self.schema['layers']:
+                    if k not in layers or list(np.shape(layers[k])) != self.schema['layers'][k]:
+                        raise ValueError('Run layer array %s does not match the ensemble store columns.'%k)
+
+            if runID is None:
+                runID = self.schema['runs']
+
+            columns = [('run', 'id', runID)]
+            columns += [('param', k, params[k]) for k in self.schema['params']]
+            columns += [('metric', k, metrics[k]) for k in self.schema['metrics']]
+            columns += [('layer', k, layers[k]) for k in self.schema['layers']]
+            # Rows are written at the position given by the schema, so the partial rows of an
+            # interrupted append are overwritten
+            for kind, name, value in columns:
+                fname = self._column_file(kind, name)
+                data = np.asarray(value, dtype=np.float64).tobytes()
+                with open(fname, 'r+b' if os.path.isfile(fname) else 'wb') as f:
+                    f.seek(self.schema['runs']*len(data))
+                    f.truncate()
+                    f.write(data)
+
+            self.schema['runs'] += 1
+            tmpfile = self.schemafile+'.tmp'
+            with open(tmpfile, 'w') as f:
+                json.dump(self.schema, f)
+            os.rename(tmpfile, self.schemafile)
+
+        return runID
+
+    def append_model(self, model, runID=None, layers=('thickness', 'coralH', 'karstero')):
+        """
+        Append a completed simulation to the store.
+
+        Parameters
+        ----------
+        class: model
+            Simulated pyReefCore model.
+
+        variable : runID
+            Run identifier (default is the run index in the store).
+
+        variable : layers
+            Names of the core layer arrays to store.
+        """
+
+        data = {}
+        for name in layers:
+            data[name] = getattr(model.core, name)
+
+        return self.append(runParameters(model.input), runSummary(model), data, runID)
+
+    def column(self, name, kind=None):
+        """
+        Memory-mapped column of the store.
+
+        Parameters
+        ----------
+        variable : name
+            Name of a parameter, metric or layer array column, or 'run' for the run identifiers.
+
+        variable : kind
+            Column kind ('param', 'metric' or 'layer') for names used by several kinds, such as
+            the thickness metric and layer array (default is the first match in this order).
+        """
+
+        self._load_schema()
+        if self.schema is None or self.schema['runs'] == 0:
+            raise ValueError('The ensemble store is empty.')
+
+        shape = (self.schema['runs'],)
+        if name == 'run':
+            fname = self._column_file('run', 'id')
+        elif name in self.schema['params'] and kind in (None, 'param'):
+            fname = self._column_file('param', name)
+            shape += tuple(self._shape('param', name))
+        elif name in self.schema['metrics'] and kind in (None, 'metric'):
+            fname = self._column_file('metric', name)
+        elif name in self.schema['layers'] and kind in (None, 'layer'):
+            fname = self._column_file('layer', name)
+            shape += tuple(self._shape('layer', name))
+        else:
+            raise ValueError('Unknown ensemble store column: %s' %name)
+
+        return np.memmap(fname, dtype=np.float64, mode='r', shape=shape)
+
+    def query(self, **conditions):
+        """
+        Select runs from conditions on parameter or metric columns. Each condition is either a
+        (min, max) tuple, where None leaves the bound open, or a function returning a boolean
+        mask for the column values. Returns the matching row indices.
+
+        Example: store.query(drownTime=(None, -5000.), facOpt=lambda v: v > 0.3)
+        """
+
+        mask = np.ones(len(self), dtype=bool)
+        for name, cond in conditions.items():
+            values = self.column(name)
+            if callable(cond):
+                mask &= cond(values)
+            else:
+                if cond[0] is not None:
+                    mask &= values >= cond[0]
+                if cond[1] is not None:
+                    mask &= values <= cond[1]
+
+        return np.where(mask)[0]
+
+    def runs(self, rows):
+        """
+        Run identifiers for given rows.
+        """
+
+        return np.asarray(self.column('run')[rows], dtype=np.int64)
+
+    def rows(self, runIDs):
+        """
+        Rows holding given run identifiers. Raises a KeyError for unknown identifiers.
+        """
+
+        ids = self.column('run')
+        order = np.argsort(ids)
+        runIDs = np.asarray(runIDs)
+        pos = np.minimum(np.searchsorted(ids[order], runIDs), len(ids)-1)
+        found = ids[order][pos] == runIDs
+        if not np.all(found):
+            raise KeyError('Unknown ensemble store runs: %s' %np.atleast_1d(runIDs)[~np.atleast_1d(found)].tolist())
+
+        return order[pos]
+
+    def coreIndex(self, rows):
+        """
+        Depth index of the cores of given rows (requires the thickness and coralH layer
+        columns).
+
+        Parameters
+        ----------
+        variable : rows
+            Row indices of the cores.
+        """
+
+        from pyReefCore.simulation.coreIndex import CoreIndex
+
+        return CoreIndex(self.get('thickness', rows, 'layer'), self.get('coralH', rows, 'layer'))
+
+    def get(self, name, rows, kind=None):
+        """
+        Read a column for given rows only.
+
+        Parameters
+        ----------
+        variable : name
+            Column name.
+
+        variable : rows
+            Row indices to read.
+
+        variable : kind
+            Column kind ('param', 'metric' or 'layer', optional).
+        """
+
+        return np.array(self.column(name, kind)[rows])
@@ -0,0 +1,330 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore numerical equivalence harness.
+
+   Golden outputs of the reference Model.run_to_time loop are frozen for a set of XmL
+   configurations (typically Tests/case1, Tests/case2 and synthetic variants of them).
+   Any other simulation engine is then compared against them with per-variable tolerances,
+   and its error norms are reported alongside its speedup. An engine is a function called as
+   engine(xml, tEnd, seed) returning a dictionary of the GOLDEN_VARIABLES arrays. Example:
+
+       python -m pyReefCore.equivalence freeze golden Tests/case1/input-case1.xml \\
+              Tests/case2/input-case2.xml --synthetic 8
+       python -m pyReefCore.equivalence compare golden --engine mypackage.engines:fastEngine
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import xml.etree.ElementTree as ET
+
+from pyReefCore.forcing.xmlParser import xmlVariant
+
+# Compared variables: model component holding the array and (rtol, atol) tolerances
+GOLDEN_VARIABLES = (('coralH', 'core'), ('thickness', 'core'), ('karstero', 'core'),
+                    ('population', 'coral'), ('accspace', 'coral'))
+TOLERANCES = {'coralH': (1.e-6, 1.e-9), 'thickness': (1.e-6, 1.e-9), 'karstero': (1.e-6, 1.e-9),
+              'population': (1.e-4, 1.e-6), 'accspace': (1.e-6, 1.e-9)}
+
+# Parameters perturbed in the synthetic configurations: XmL path and range of scale factors
+SYNTHETIC_FACTORS = (('habitats/depth', 0.5, 1.5), ('habitats/facOpt', 0.5, 1.5),
+                     ('habitats/karstRate', 0.5, 2.), ('habitats/community/malthus', 0.8, 1.2),
+                     ('habitats/community/production', 0.8, 1.2),
+                     ('habitats/communityMatrix/value', 0.8, 1.2))
+
+INDEX = 'golden.json'
+
+
+class _workingFolder(object):
+    """
+    Run a simulation from the folder of its XmL file, as the notebooks do, and discard the
+    model messages.
+    """
+
+    def __init__(self, xml):
+
+        self.folder = os.path.dirname(os.path.abspath(xml))
+
+        return
+
+    def __enter__(self):
+
+        self.cwd = os.getcwd()
+        self.stdout = sys.stdout
+        os.chdir(self.folder)
+        sys.stdout = open(os.devnull, 'w')
+
+        return self
+
+    def __exit__(self, *args):
+
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        os.chdir(self.cwd)
+
+        return False
+
+
+def referenceEngine(xml, tEnd=None, seed=0):
+    """
+    Reference engine: the Model.run_to_time simulation loop.
+
+    Parameters
+    ----------
+    variable : xml
+        XmL input file name.
+
+    variable : tEnd
+        Simulation end time (default is the end time of the XmL input file).
+
+    variable : seed
+        Random number generator seed.
+    """
+
+    from pyReefCore.model import Model
+
+    model = Model()
+    model.load_xml(xml, seed=seed)
+    model.run_to_time(model.input.tEnd if tEnd is None else tEnd)
+    outputs = {}
+    for name, component in GOLDEN_VARIABLES:
+        outputs[name] = np.array(getattr(getattr(model, component), name), dtype=float)
+
+    return outputs
+
+
+def syntheticConfigs(template, folder, nb=8, seed=0, factors=SYNTHETIC_FACTORS):
+    """
+    Write synthetic variants of an XmL configuration where each perturbed parameter value is
+    scaled by a random factor drawn uniformly in its range. Returns the variant file names.
+
+    Parameters
+    ----------
+    variable : template
+        XmL input file name.
+
+    variable : folder
+        Folder where the variants are written.
+
+    variable : nb
+        Number of variants.
+
+    variable : seed
+        Random number generator seed of the scale factors.
+
+    variable : factors
+        Perturbed parameters XmL paths and ranges of scale factors.
+    """
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    root = ET.parse(template).getroot()
+    base = {}
+    for path, fmin, fmax in factors:
+        base[path] = np.array([float(e.text) for e in root.findall(path)])
+
+    rng = np.random.RandomState(seed)
+    name = os.path.splitext(os.path.basename(template))[0]
+    files = []
+    for k in range(nb):
+        values = {}
+        for path, fmin, fmax in factors:
+            if len(base[path]) > 0:
+                values[path] = list(base[path]*rng.uniform(fmin, fmax, len(base[path])))
+        fname = os.path.join(folder, '%s-synth%03d.xml' %(name, k))
+        xmlVariant(template, values, fname)
+        files.append(fname)
+
+    return files
+
+
+def freezeGolden(xmls, folder, tEnd=None, seed=0, synthetic=0):
+    """
+    Run the reference engine on a set of configurations and store their outputs as golden
+    data in a folder (one npz file per configuration and a JSON index).
+
+    Parameters
+    ----------
+    variable : xmls
+        XmL input file names.
+
+    variable : folder
+        Golden data folder.
+
+    variable : tEnd
+        Simulation end time (default is the end time of each XmL input file).
+
+    variable : seed
+        Random number generator seed.
+
+    variable : synthetic
+        Number of synthetic variants generated for each XmL input file.
+    """
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    configs = []
+    for xml in xmls:
+        configs.append(os.path.abspath(xml))
+        if synthetic > 0:
+            configs += syntheticConfigs(xml, os.path.join(folder, 'synthetic'), synthetic, seed)
+
+    index = []
+    for xml in configs:
+        name = os.path.splitext(os.path.basename(xml))[0]
+        with _workingFolder(xml):
+            t0 = time.time()
+            outputs = referenceEngine(xml, tEnd, seed)
+            wall = time.time()-t0
+        np.savez(os.path.join(folder, name+'.npz'), **outputs)
+        index.append({'name': name, 'xml': os.path.abspath(xml), 'tEnd': tEnd, 'seed': seed,
+                      'wall': wall})
+        print 'Golden outputs of %s frozen in %.2f s' %(name, wall)
+
+    with open(os.path.join(folder, INDEX), 'w') as f:
+        json.dump(index, f, indent=1)
+
+    return index
+
+
+def errorNorms(result, golden, rtol, atol):
+    """
+    Maximum absolute error, maximum relative error, relative L2 error norm and tolerance check
+    of an engine output against its golden value.
+    """
+
+    result = np.asarray(result, dtype=float)
+    if result.shape != golden.shape:
+        return {'maxAbs': None, 'maxRel': None, 'l2': None, 'passed': False}
+    error = np.abs(result-golden)
+    norm = np.linalg.norm(golden)
+
+    return {'maxAbs': float(error.max()) if error.size > 0 else 0.,
+            'maxRel': float((error/(np.abs(golden)+atol)).max()) if error.size > 0 else 0.,
+            'l2': float(np.linalg.norm(error)/norm) if norm > 0. else float(np.linalg.norm(error)),
+            'passed': bool(np.allclose(result, golden, rtol=rtol, atol=atol))}
+
+
+def compareEngine(engine, folder, tolerances=None, reference=False):
+    """
+    Compare an engine against the golden data of a folder. Returns one row per configuration
+    and variable with the error norms, the tolerance check and the engine speedup.
+
+    Parameters
+    ----------
+    variable : engine
+        Function called as engine(xml, tEnd, seed) returning the GOLDEN_VARIABLES arrays.
+
+    variable : folder
+        Golden data folder.
+
+    variable : tolerances
+        Dictionary of (rtol, atol) tolerances per variable overriding the default ones.
+
+    variable : reference
+        Time the reference engine again on this machine instead of using the frozen time.
+    """
+
+    tol = dict(TOLERANCES)
+    if tolerances is not None:
+        tol.update(tolerances)
+    with open(os.path.join(folder, INDEX)) as f:
+        index = json.load(f)
+
+    rows = []
+    for config in index:
+        golden = np.load(os.path.join(folder, config['name']+'.npz'))
+        with _workingFolder(config['xml']):
+            refWall = config['wall']
+            if reference:
+                t0 = time.time()
+                referenceEngine(config['xml'], config['tEnd'], config['seed'])
+                refWall = time.time()-t0
+            t0 = time.time()
+            outputs = engine(config['xml'], config['tEnd'], config['seed'])
+            wall = time.time()-t0
+        for name, component in GOLDEN_VARIABLES:
+            row = {'config': config['name'], 'variable': name, 'wall': wall,
+                   'speedup': refWall/wall if wall > 0. else None}
+            if name in outputs:
+                row.update(errorNorms(outputs[name], golden[name], *tol[name]))
+            else:
+                row.update({'maxAbs': None, 'maxRel': None, 'l2': None, 'passed': False})
+            rows.append(row)
+
+    return rows
+
+
+def formatTable(rows):
+    """
+    Format the comparison rows as a text table.
+    """
+
+    def number(value):
+        return '-' if value is None else '%.3e' %value
+
+    lines = ['%-28s %-11s %10s %10s %10s %8s %8s %6s' %('config', 'variable', 'max abs',
+             'max rel', 'L2 rel', 'wall', 'speedup', 'pass')]
+    for row in rows:
+        speedup = '-' if row['speedup'] is None else '%.2f' %row['speedup']
+        lines.append('%-28s %-11s %10s %10s %10s %8.2f %8s %6s' %(row['config'][:28], row['variable'],
+                     number(row['maxAbs']), number(row['maxRel']), number(row['l2']),
+                     row['wall'], speedup, 'yes' if row['passed'] else 'NO'))
+
+    return '\n'.join(lines)
+
+
+def _loadEngine(name):
+    """
+    Import an engine function given as module:function.
+    """
+
+    module, function = name.split(':')
+    __import__(module)
+
+    return getattr(sys.modules[module], function)
+
+
+def main(args=None):
+    """
+    Command line entry point.
+    """
+
+    parser = argparse.ArgumentParser(description='pyReefCore numerical equivalence harness.')
+    sub = parser.add_subparsers(dest='command')
+    freeze = sub.add_parser('freeze', help='freeze golden outputs of the reference engine')
+    freeze.add_argument('folder', help='golden data folder')
+    freeze.add_argument('xml', nargs='+', help='XmL input files')
+    freeze.add_argument('--synthetic', type=int, default=0,
+                        help='number of synthetic variants per XmL input file')
+    freeze.add_argument('--tend', type=float, default=None, help='simulation end time')
+    freeze.add_argument('--seed', type=int, default=0, help='random number generator seed')
+    compare = sub.add_parser('compare', help='compare an engine against golden outputs')
+    compare.add_argument('folder', help='golden data folder')
+    compare.add_argument('--engine', default='pyReefCore.equivalence:referenceEngine',
+                         help='engine function given as module:function')
+    compare.add_argument('--reference', action='store_true',
+                         help='time the reference engine again on this machine')
+    opts = parser.parse_args(args)
+
+    if opts.command == 'freeze':
+        freezeGolden(opts.xml, opts.folder, opts.tend, opts.seed, opts.synthetic)
+        return 0
+
+    rows = compareEngine(_loadEngine(opts.engine), opts.folder, reference=opts.reference)
+    print formatTable(rows)
+
+    return 0 if all(row['passed'] for row in rows) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,12 +14,274 @@ import warnings
 
 import os
 import numpy
-import pandas
 import skfuzzy as fuzz
 from scipy import interpolate
 from scipy.optimize import curve_fit
 from scipy.optimize import OptimizeWarning
 
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# Extensions of the binary forcing curve formats
+NPY_EXT = ('.npy',)
+NPZ_EXT = ('.npz',)
+HDF5_EXT = ('.h5', '.hdf5', '.he5')
+
+# Number of nodes of the elevation dependent sediment and flow lookup tables
+ELEV_TABLE_NB = 10001
+
+# Exponential decay fits of the sediment and flow functions per input dataset
+_decayFits = {}
+
+# Forcing curves read by long-lived processes, None when caching is disabled
+_curveCache = None
+
+def _curveColumns(data, filename):
+    """
+    Split a forcing curve array in its time and value columns.
+    """
+
+    if data.ndim != 2 or data.shape[1] < 2:
+        raise ValueError('Forcing curve %s needs to be defined as a 2 columns array.' %filename)
+
+    return data[:,0], data[:,1]
+
+def _sortedCurve(curve, filename):
+    """
+    Ensure the time column of a binary forcing curve is in increasing order, binary curves
+    are memory-mapped and are not sorted as text curves.
+    """
+
+    if (numpy.diff(curve[0]) < 0.).any():
+        raise ValueError('Forcing curve %s needs to be defined in increasing time order.' %filename)
+
+    return curve
+
+def readCurve(filename, dataset=None):
+    """
+    Read a forcing curve made of 2 columns: the time in year (increasing order) and the forcing
+    value for the considered time. Curves are either whitespace separated text files, numpy
+    files (.npy, or .npz with time and value arrays) or HDF5 datasets. Numpy and uncompressed
+    contiguous HDF5 datasets are memory-mapped instead of being loaded in memory. Text curves
+    are sorted in increasing time order while unsorted binary curves raise a ValueError.
+
+    Parameters
+    ----------
+    variable : filename
+        Name of the forcing curve file.
+
+    variable : dataset
+        Name of the dataset containing the curve in a HDF5 or npz file (optional).
+    """
+
+    if _curveCache is None:
+        return _readCurve(filename, dataset)
+
+    # Cached curves are identified by their file modification time and size
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), dataset, stat.st_mtime, stat.st_size)
+    if key not in _curveCache:
+        time, value = _readCurve(filename, dataset)
+        time.flags.writeable = False
+        value.flags.writeable = False
+        _curveCache[key] = (time, value)
+
+    return _curveCache[key]
+
+def cacheCurves(enable=True):
+    """
+    Keep the forcing curves read in memory so that the following simulations of a process
+    reuse them. Modified files are read again.
+
+    Parameters
+    ----------
+    variable : enable
+        Enable or disable (and clear) the forcing curve cache.
+    """
+
+    global _curveCache
+    _curveCache = {} if enable else None
+
+    return
+
+def _readCurve(filename, dataset):
+    """
+    Read a forcing curve file (see readCurve).
+    """
+
+    ext = os.path.splitext(filename)[1].lower()
+
+    if ext in NPY_EXT:
+        data = numpy.load(filename, mmap_mode='r')
+        return _sortedCurve(_curveColumns(data, filename), filename)
+
+    if ext in NPZ_EXT:
+        with numpy.load(filename) as data:
+            if dataset is not None:
+                curve = _curveColumns(data[dataset], filename)
+            elif 'time' in data.files and 'value' in data.files:
+                curve = (data['time'], data['value'])
+            else:
+                curve = _curveColumns(data[data.files[0]], filename)
+        return _sortedCurve(curve, filename)
+
+    if ext in HDF5_EXT:
+        if h5py is None:
+            raise ImportError('The h5py library is required to read HDF5 forcing curves.')
+        with h5py.File(filename, 'r') as f:
+            if dataset is None:
+                dataset = list(f.keys())[0]
+            ds = f[dataset]
+            offset = ds.id.get_offset()
+            if ds.chunks is None and ds.compression is None and offset is not None:
+                data = numpy.memmap(filename, dtype=ds.dtype, mode='r', offset=offset,
+                                    shape=ds.shape)
+            else:
+                data = ds[...]
+        return _sortedCurve(_curveColumns(data, filename), filename)
+
+    # Text curves need pandas, imported here to keep binary forcing runs light
+    import pandas
+    data = pandas.read_csv(filename, sep=r'\s+', engine='c',
+                           header=None, na_filter=False,
+                           dtype=numpy.float, low_memory=False).values
+    # Text curves are sorted in increasing time order
+    if (numpy.diff(data[:,0]) < 0.).any():
+        data = data[numpy.argsort(data[:,0], kind='mergesort')]
+
+    return _curveColumns(data, filename)
+
+def writeCurve(filename, time, value, dataset=None):
+    """
+    Write a forcing curve in a numpy (.npy, .npz), HDF5 or text file.
+
+    Parameters
+    ----------
+    variable : filename
+        Name of the forcing curve file.
+
+    variable : time
+        Time in year (increasing order).
+
+    variable : value
+        Forcing value for the considered time.
+
+    variable : dataset
+        Name of the dataset in a HDF5 file (default is curve).
+    """
+
+    data = numpy.column_stack((time, value)).astype(numpy.float64)
+    ext = os.path.splitext(filename)[1].lower()
+
+    if ext in NPY_EXT:
+        numpy.save(filename, data)
+    elif ext in NPZ_EXT:
+        numpy.savez(filename, time=data[:,0], value=data[:,1])
+    elif ext in HDF5_EXT:
+        if h5py is None:
+            raise ImportError('The h5py library is required to write HDF5 forcing curves.')
+        if dataset is None:
+            dataset = 'curve'
+        with h5py.File(filename, 'a') as f:
+            if dataset in f:
+                del f[dataset]
+            # Contiguous uncompressed layout allows memory-mapping
+            f.create_dataset(dataset, data=data)
+    else:
+        numpy.savetxt(filename, data, fmt='%.17g')
+
+    return
+
+def _expdecay(x, a, b, c):
+
+    return a*numpy.exp(-b*x) + c
+
+def decayFit(x, y):
+    """
+    Exponential decay parameters fitted to an elevation dependent dataset. The fit is cached
+    per dataset so that repeated model loads do not call curve_fit again.
+
+    Parameters
+    ----------
+    variable : x
+        Elevations of the dataset.
+
+    variable : y
+        Environmental values of the dataset.
+    """
+
+    x = numpy.ascontiguousarray(x, dtype=float)
+    y = numpy.ascontiguousarray(y, dtype=float)
+    key = (x.tostring(), y.tostring())
+    if key not in _decayFits:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', OptimizeWarning)
+            popt, pcov = curve_fit(_expdecay, x, y)
+        _decayFits[key] = popt
+
+    return numpy.copy(_decayFits[key])
+
+class elevTable(object):
+    """
+    Uniform spacing lookup table of an elevation dependent environmental function. Values are
+    linearly interpolated between the table nodes with a direct index computation and are null
+    outside of the table elevation range.
+    """
+
+    def __init__(self, zmin, zmax, func, nb=ELEV_TABLE_NB):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : zmin, zmax
+            Elevation range of the function.
+
+        variable : func
+            Function evaluated on an array of elevations.
+
+        variable : nb
+            Number of table nodes.
+        """
+
+        self.zmin = float(zmin)
+        self.zmax = float(zmax)
+        if self.zmax > self.zmin:
+            self.last = nb-1
+            self.scale = self.last/(self.zmax-self.zmin)
+        else:
+            # Function defined at a single elevation: one node table only matching zmin
+            self.last = 0
+            self.scale = 1.
+        self.values = numpy.atleast_1d(func(numpy.linspace(self.zmin, self.zmax, self.last+1)))
+        self.values[self.values<0.] = 0.
+        self.slopes = numpy.append(numpy.diff(self.values), 0.)
+
+        return
+
+    def __call__(self, elev):
+        """
+        Evaluate the table for a bed elevation or an array of bed elevations.
+        """
+
+        if numpy.ndim(elev) == 0:
+            pos = (elev-self.zmin)*self.scale
+            if pos < 0. or pos > self.last:
+                return 0.
+            i = int(pos)
+            return self.values[i]+(pos-i)*self.slopes[i]
+
+        pos = (numpy.asarray(elev, dtype=float)-self.zmin)*self.scale
+        out = numpy.logical_or(pos<0., pos>self.last)
+        i = pos.astype(int)
+        i[out] = 0
+        level = self.values.take(i)+(pos-i)*self.slopes.take(i)
+        level[out] = 0.
+
+        return level
+
 class enviForce:
     """
     This class defines external forcing parameters.
@@ -35,6 +297,8 @@ class enviForce:
             Input parameter class.
         """
 
+        self.curveDataset = input.curveDataset
+
         self.sea0 = input.seaval
         self.seafile = input.seafile
         self.sealevel = None
@@ -70,6 +334,7 @@ class enviForce:
         self.sedopt = None
         self.sedlin = None
         self.sedfct = False
+        self.sedTable = None
         self.plotsedx = None
         self.plotsedy = None
 
@@ -81,6 +346,7 @@ class enviForce:
         self.flowopt = None
         self.flowlin = None
         self.flowfct = False
+        self.flowTable = None
         self.plotflowx = None
         self.plotflowy = None
 
@@ -106,14 +372,14 @@ class enviForce:
                 xf = input.flowdecay[1,:]
                 self.xflow = xf
                 self.yflow = yf
-                warnings.filterwarnings('ignore', category=OptimizeWarning)
-                popt, pcov = curve_fit(self._expdecay_func, xf, yf)
-                self.flowopt = popt
+                self.flowopt = decayFit(xf, yf)
+                self.flowTable = elevTable(0., xf.max(), lambda z: _expdecay(z, *self.flowopt))
                 self.plotflowx = numpy.linspace(0., xf.max(), 100)
-                self.plotflowy = self._expdecay_func(self.plotflowx, *popt)
+                self.plotflowy = self._expdecay_func(self.plotflowx, *self.flowopt)
                 self.plotflowy[self.plotflowy<0]=0.
             else:
                 self.flowlin = [input.flowlina,input.flowlinb]
+                self.flowTable = elevTable(0., input.flowdepth, lambda z: self.flowlin[0]*z+self.flowlin[1])
                 self.plotflowx = numpy.linspace(0, input.flowdepth, 100)
                 self.plotflowy = self.flowlin[0]*self.plotflowx+self.flowlin[1]  #(self.plotflowx-self.flowlin[1])/self.flowlin[0]
                 self.plotflowy[self.plotflowy<0]=0.
@@ -123,14 +389,14 @@ class enviForce:
             if input.seddecay is not None:
                 y = input.seddecay[0,:]
                 x = input.seddecay[1,:]
-                warnings.filterwarnings('ignore', category=OptimizeWarning)
-                popt, pcov = curve_fit(self._expdecay_func, x, y)
-                self.sedopt = popt
+                self.sedopt = decayFit(x, y)
+                self.sedTable = elevTable(0., x.max(), lambda z: _expdecay(z, *self.sedopt))
                 self.plotsedx = numpy.linspace(0, x.max(), 100)
-                self.plotsedy = self._expdecay_func(self.plotsedx, *popt)
+                self.plotsedy = self._expdecay_func(self.plotsedx, *self.sedopt)
                 self.plotsedy[self.plotsedy<0]=0.
             else:
                 self.sedlin = [input.sedlina,input.sedlinb]
+                self.sedTable = elevTable(0., input.seddepth, lambda z: self.sedlin[0]*z+self.sedlin[1])
                 self.plotsedx = numpy.linspace(0, input.seddepth, 100)
                 self.plotsedy = input.sedlina*self.plotsedx+input.sedlinb #(self.plotsedx-self.sedlin[1])/self.sedlin[0]
                 self.plotsedy[self.plotsedy<0]=0.
@@ -177,7 +443,7 @@ class enviForce:
 
     def _expdecay_func(self, x, a, b, c):
 
-        return a*numpy.exp(-b*x) + c
+        return _expdecay(x, a, b, c)
 
     def _extract_enviParam(self, x, xmf, xx):
         """
@@ -204,161 +470,290 @@ class enviForce:
 
     def _build_Sea_function(self):
         """
-        Using Pandas library to read the sea level file and define sea level interpolation
+        Read the sea level file and define sea level interpolation
         function based on Scipy 1D cubic function.
         """
 
-        # Read sea level file
-        seadata = pandas.read_csv(self.seafile, sep=r'\s+', engine='c',
-                               header=None, na_filter=False,
-                               dtype=numpy.float, low_memory=False)
-
-        self.seatime = seadata.values[:,0]
-        tmp = seadata.values[:,1]
-        self.seaFunc = interpolate.interp1d(self.seatime, tmp, kind='linear')
+        self.seatime, tmp = readCurve(self.seafile, self.curveDataset.get('seafile'))
+        self.seaFunc = interpolate.interp1d(self.seatime, tmp, kind='linear',
+                                            copy=False, assume_sorted=True)
 
         return
 
     def _build_Temp_function(self):
         """
-        Using Pandas library to read the temperature file and define temperature interpolation
+        Read the temperature file and define temperature interpolation
         function based on Scipy 1D cubic function.
         """
 
-        # Read temperature file
-        tempdata = pandas.read_csv(self.tempfile, sep=r'\s+', engine='c',
-                               header=None, na_filter=False,
-                               dtype=numpy.float, low_memory=False)
-
-        self.temptime = tempdata.values[:,0]
-        tmp = tempdata.values[:,1]
+        self.temptime, tmp = readCurve(self.tempfile, self.curveDataset.get('tempfile'))
         if tmp.max()>1.:
             raise ValueError('Error the temperature function should have value between 0 and 1.')
         if tmp.min()<0.:
             raise ValueError('Error the temperature function should have value between 0 and 1.')
-        self.tempFunc = interpolate.interp1d(self.temptime, tmp, kind='linear')
+        self.tempFunc = interpolate.interp1d(self.temptime, tmp, kind='linear',
+                                             copy=False, assume_sorted=True)
 
         return
 
     def _build_pH_function(self):
         """
-        Using Pandas library to read the pH file and define pH interpolation
+        Read the pH file and define pH interpolation
         function based on Scipy 1D cubic function.
         """
 
-        # Read pH file
-        pHdata = pandas.read_csv(self.pHfile, sep=r'\s+', engine='c',
-                               header=None, na_filter=False,
-                               dtype=numpy.float, low_memory=False)
-
-        self.pHtime = pHdata.values[:,0]
-        tmp = pHdata.values[:,1]
+        self.pHtime, tmp = readCurve(self.pHfile, self.curveDataset.get('pHfile'))
         if tmp.max()>1.:
             raise ValueError('Error the pH function should have value between 0 and 1.')
         if tmp.min()<0.:
             raise ValueError('Error the pH function should have value between 0 and 1.')
-        self.pHFunc = interpolate.interp1d(self.pHtime, tmp, kind='linear')
+        self.pHFunc = interpolate.interp1d(self.pHtime, tmp, kind='linear',
+                                           copy=False, assume_sorted=True)
 
         return
 
     def _build_nu_function(self):
         """
-        Using Pandas library to read the nutrients file and define nutrients interpolation
+        Read the nutrients file and define nutrients interpolation
         function based on Scipy 1D cubic function.
         """
 
-        # Read nutrients file
-        nudata = pandas.read_csv(self.nufile, sep=r'\s+', engine='c',
-                               header=None, na_filter=False,
-                               dtype=numpy.float, low_memory=False)
-
-        self.nutime = nudata.values[:,0]
-        tmp = nudata.values[:,1]
+        self.nutime, tmp = readCurve(self.nufile, self.curveDataset.get('nufile'))
         if tmp.max()>1.:
             raise ValueError('Error the nutrient function should have value between 0 and 1.')
         if tmp.min()<0.:
             raise ValueError('Error the nutrient function should have value between 0 and 1.')
-        self.nuFunc = interpolate.interp1d(self.nutime, tmp, kind='linear')
+        self.nuFunc = interpolate.interp1d(self.nutime, tmp, kind='linear',
+                                           copy=False, assume_sorted=True)
 
         return
 
     def _build_Tec_function(self):
         """
-        Using Pandas library to read the tectonic file and define tectonic interpolation
+        Read the tectonic file and define tectonic interpolation
         function based on Scipy 1D cubic function.
         """
 
-        # Read tectonic file
-        tecdata = pandas.read_csv(self.tecfile, sep=r'\s+', engine='c',
-                               header=None, na_filter=False,
-                               dtype=numpy.float, low_memory=False)
-
-        self.tectime = tecdata.values[:,0]
-        tmp = tecdata.values[:,1]
-        self.tecFunc = interpolate.interp1d(self.tectime, tmp, kind='linear')
+        self.tectime, tmp = readCurve(self.tecfile, self.curveDataset.get('tecfile'))
+        self.tecFunc = interpolate.interp1d(self.tectime, tmp, kind='linear',
+                                            copy=False, assume_sorted=True)
 
         return
 
     def _build_Sed_function(self):
         """
-        Using Pandas library to read the sediment input file and define interpolation
+        Read the sediment input file and define interpolation
         function based on Scipy 1D cubic function.
         """
 
-        # Read sea level file
-        seddata = pandas.read_csv(self.sedfile, sep=r'\s+', engine='c',
-                               header=None, na_filter=False,
-                               dtype=numpy.float, low_memory=False)
-
-        self.sedtime = seddata.values[:,0]
-        tmp = seddata.values[:,1]
-        self.sedFunc = interpolate.interp1d(self.sedtime, tmp, kind='linear')
+        self.sedtime, tmp = readCurve(self.sedfile, self.curveDataset.get('sedfile'))
+        self.sedFunc = interpolate.interp1d(self.sedtime, tmp, kind='linear',
+                                            copy=False, assume_sorted=True)
 
         return
 
     def _build_Flow_function(self):
         """
-        Using Pandas library to read the flow velocity file and define interpolation
+        Read the flow velocity file and define interpolation
         function based on Scipy 1D cubic function.
         """
 
-        # Read sea level file
-        flowdata = pandas.read_csv(self.flowfile, sep=r'\s+', engine='c',
-                               header=None, na_filter=False,
-                               dtype=numpy.float, low_memory=False)
-
-        self.flowtime = flowdata.values[:,0]
-        tmp = flowdata.values[:,1]
-        self.flowFunc = interpolate.interp1d(self.flowtime, tmp, kind='cubic')
+        self.flowtime, tmp = readCurve(self.flowfile, self.curveDataset.get('flowfile'))
+        self.flowFunc = interpolate.interp1d(self.flowtime, tmp, kind='cubic',
+                                             copy=False, assume_sorted=True)
 
         return
 
-    def getSea(self, time, top):
+    def _trapFactors(self, val, x, trap, shape):
         """
-        Computes for a given time the sea level according to input file parameters.
+        Find the degree of membership of each species trapezoidal shape function for an array
+        of environmental values.
+
+        Parameters
+        ----------
+        variable : val
+            Environmental values for which to compute the species factors.
+
+        variable : x
+            Discretised environmental range of the shape functions.
+
+        variable : trap
+            Species trapezoidal shape functions.
+
+        variable : shape
+            Species trapezoidal shape parameters.
+        """
+
+        val = numpy.atleast_1d(val)
+        factors = numpy.empty((self.speciesNb,len(val)),dtype=float)
+        low = val<x[0]
+        high = val>x[-1]
+        for s in range(self.speciesNb):
+            factors[s,:] = numpy.interp(val, x, trap[s])
+            factors[s,low] = float(shape[s,1] == shape[s,0])
+            factors[s,high] = float(shape[s,2] == shape[s,3])
+
+        return factors
+
+    def seaShift(self, time):
+        """
+        Computes for a given time the sea level according to input file parameters and returns
+        the sea level change since previous call.
 
         Parameters
         ----------
         float : time
             Requested time for which to compute sea level elevation.
-
-        float : top
-            Elevation of the core.
         """
 
         oldsea = self.sealevel
         if self.seafile is None:
             self.sealevel = self.sea0
         else:
-            if time < self.seatime.min():
-                time = self.seatime.min()
-            if time > self.seatime.max():
-                time = self.seatime.max()
+            if time < self.seatime[0]:
+                time = self.seatime[0]
+            if time > self.seatime[-1]:
+                time = self.seatime[-1]
             self.sealevel = self.seaFunc(time)
         if oldsea == None:
-            depth = top
+            return 0.
+
+        return self.sealevel-oldsea
+
+    def tecShift(self, time, otime):
+        """
+        Computes for a given time the tectonic rate according to input file parameters and
+        returns the induced change in water depth since previous time.
+
+        Parameters
+        ----------
+        float : time
+            Requested time for which to compute tectonic rate.
+
+        float : otime
+            Previous time used to compute tectonic rate.
+        """
+
+        if self.tecfile is None:
+            self.tecrate = self.tec0
+        else:
+            if time < self.tectime[0]:
+                time = self.tectime[0]
+            if time > self.tectime[-1]:
+                time = self.tectime[-1]
+            self.tecrate = self.tecFunc(time)
+        if otime == time:
+            return 0.
+
+        return -(self.tecrate*(time-otime))
+
+    def depthFactors(self, depth):
+        """
+        Computes species water depth factors for an array of core elevations.
+
+        Parameters
+        ----------
+        variable : depth
+            Water depth of each core.
+        """
+
+        if self.xd is None:
+            return numpy.ones((self.speciesNb,len(numpy.atleast_1d(depth))),dtype=float)
+
+        return self._trapFactors(depth, self.xd, self.dtrap, self.edepth)
+
+    def sedFactors(self, sedlevel):
+        """
+        Computes species sediment input factors for an array of sediment input values.
+
+        Parameters
+        ----------
+        variable : sedlevel
+            Sediment input of each core.
+        """
+
+        return self._trapFactors(sedlevel, self.xs, self.strap, self.esed)
+
+    def flowFactors(self, flowlevel):
+        """
+        Computes species flow velocity factors for an array of flow velocity values.
+
+        Parameters
+        ----------
+        variable : flowlevel
+            Flow velocity of each core.
+        """
+
+        return self._trapFactors(flowlevel, self.xf, self.ftrap, self.eflow)
+
+    def getSedLevel(self, time, elev):
+        """
+        Computes for a given time the sediment input for an array of bed elevations.
+
+        Parameters
+        ----------
+        float : time
+            Requested time for which to compute sediment input.
+
+        variable : elev
+            Elevation of each bed.
+        """
+
+        if self.sedfct:
+            return self.sedTable(numpy.atleast_1d(elev))
+
+        if self.sedfile == None:
+            level = self.sed0
+        else:
+            if time < self.sedtime[0]:
+                time = self.sedtime[0]
+            if time > self.sedtime[-1]:
+                time = self.sedtime[-1]
+            level = self.sedFunc(time)
+
+        return numpy.full(len(numpy.atleast_1d(elev)),level,dtype=float)
+
+    def getFlowLevel(self, time, elev):
+        """
+        Computes for a given time the flow velocity for an array of bed elevations.
+
+        Parameters
+        ----------
+        float : time
+            Requested time for which to compute flow velocity value.
+
+        variable : elev
+            Elevation of each bed.
+        """
+
+        if self.flowfct:
+            return self.flowTable(numpy.atleast_1d(elev))
+
+        if self.flowfile == None:
+            level = self.flow0
         else:
-            depth = top+(self.sealevel-oldsea)
+            if time < self.flowtime[0]:
+                time = self.flowtime[0]
+            if time > self.flowtime[-1]:
+                time = self.flowtime[-1]
+            level = self.flowFunc(time)
+
+        return numpy.full(len(numpy.atleast_1d(elev)),level,dtype=float)
+
+    def getSea(self, time, top):
+        """
+        Computes for a given time the sea level according to input file parameters.
+
+        Parameters
+        ----------
+        float : time
+            Requested time for which to compute sea level elevation.
+
+        float : top
+            Elevation of the core.
+        """
+
+        depth = top+self.seaShift(time)
 
         factors = numpy.ones(self.speciesNb,dtype=float)
 
@@ -390,10 +785,10 @@ class enviForce:
         if self.tempfile is None:
             self.templevel = 1.
         else:
-            if time < self.temptime.min():
-                time = self.temptime.min()
-            if time > self.temptime.max():
-                time = self.temptime.max()
+            if time < self.temptime[0]:
+                time = self.temptime[0]
+            if time > self.temptime[-1]:
+                time = self.temptime[-1]
             self.templevel = self.tempFunc(time)
             for s in range(self.speciesNb):
                 factors[s] = self.templevel
@@ -414,10 +809,10 @@ class enviForce:
         if self.pHfile is None:
             self.pHlevel = 1.
         else:
-            if time < self.pHtime.min():
-                time = self.pHtime.min()
-            if time > self.pHtime.max():
-                time = self.pHtime.max()
+            if time < self.pHtime[0]:
+                time = self.pHtime[0]
+            if time > self.pHtime[-1]:
+                time = self.pHtime[-1]
             self.pHlevel = self.pHFunc(time)
             for s in range(self.speciesNb):
                 factors[s] = self.pHlevel
@@ -438,10 +833,10 @@ class enviForce:
         if self.nufile is None:
             self.nulevel = 1.
         else:
-            if time < self.nutime.min():
-                time = self.nutime.min()
-            if time > self.nutime.max():
-                time = self.nutime.max()
+            if time < self.nutime[0]:
+                time = self.nutime[0]
+            if time > self.nutime[-1]:
+                time = self.nutime[-1]
             self.nulevel = self.nuFunc(time)
             for s in range(self.speciesNb):
                 factors[s] = self.nulevel
@@ -464,18 +859,7 @@ class enviForce:
             Elevation of the core.
         """
 
-        if self.tecfile is None:
-            self.tecrate = self.tec0
-        else:
-            if time < self.tectime.min():
-                time = self.tectime.min()
-            if time > self.tectime.max():
-                time = self.tectime.max()
-            self.tecrate = self.tecFunc(time)
-        if otime == time:
-            depth = top
-        else:
-            depth = top-(self.tecrate*(time-otime))
+        depth = top+self.tecShift(time, otime)
 
         factors = numpy.ones(self.speciesNb,dtype=float)
 
@@ -507,23 +891,14 @@ class enviForce:
         """
 
         if self.sedfct:
-            if self.plotsedx.max()<elev:
-                self.sedlevel = 0.
-            elif self.plotsedx.min()>elev:
-                self.sedlevel = 0.
-            elif self.sedlin is None:
-                self.sedlevel = self._expdecay_func(elev,*self.sedopt)
-            else:
-                self.sedlevel = self.sedlin[0]*elev+self.sedlin[1]
-            if self.sedlevel<0:
-                self.sedlevel = 0.
+            self.sedlevel = self.sedTable(elev)
         elif self.sedfile == None:
             self.sedlevel = self.sed0
         else:
-            if time < self.sedtime.min():
-                time = self.sedtime.min()
-            if time > self.sedtime.max():
-                time = self.sedtime.max()
+            if time < self.sedtime[0]:
+                time = self.sedtime[0]
+            if time > self.sedtime[-1]:
+                time = self.sedtime[-1]
             self.sedlevel = self.sedFunc(time)
 
         factors = numpy.ones(self.speciesNb,dtype=float)
@@ -555,23 +930,14 @@ class enviForce:
         """
 
         if self.flowfct:
-            if self.plotflowx.max()<elev:
-                self.flowlevel = 0.
-            elif self.plotflowx.min()>elev:
-                self.flowlevel = 0.
-            elif self.flowlin is None:
-                self.flowlevel = self._expdecay_func(elev,*self.flowopt)
-            else:
-                self.flowlevel = self.flowlin[0]*elev+self.flowlin[1]
-            if self.flowlevel<0.:
-                self.flowlevel = 0.
+            self.flowlevel = self.flowTable(elev)
         elif self.flowfile == None:
             self.flowlevel = self.flow0
         else:
-            if time < self.flowtime.min():
-                time = self.flowtime.min()
-            if time > self.flowtime.max():
-                time = self.flowtime.max()
+            if time < self.flowtime[0]:
+                time = self.flowtime[0]
+            if time > self.flowtime[-1]:
+                time = self.flowtime[-1]
             self.flowlevel = self.flowFunc(time)
 
         factors = numpy.ones(self.speciesNb,dtype=float)
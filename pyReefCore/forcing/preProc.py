@@ -11,11 +11,9 @@ Functions used to create environmental forcing conditions for pyReefCore simulat
 """
 
 import errno
-import matplotlib
 import numpy as np
-import pandas as pd
 from scipy import interpolate
-import matplotlib.pyplot as plt
+from enviForce import (readCurve, writeCurve)
 
 import warnings
 warnings.simplefilter(action = "ignore", category = FutureWarning)
@@ -37,15 +35,19 @@ class preProc:
             The file is defined with 2 columns:
                 + Column 1 = Time (a)
                 + Column 2 = Curve value for the considered time [m or m/d]
+            Text, numpy and HDF5 curve files are supported.
         """
 
         self.df = None
         self.time = None
         self.func = None
+        self.funcs = None
 
         if curve != None:
+            import pandas as pd
             self.build = False
-            self.df = pd.read_csv(curve1, sep=r'\s+', header=None, names=['h','t'])
+            time, func = readCurve(curve)
+            self.df = pd.DataFrame({'t':time, 'h':func}, columns=['t','h'])
         else:
             self.build = True
             self.func = None
@@ -77,22 +79,58 @@ class preProc:
             Period of the nvironmental factor wave for starting and ending times (in years)
         """
 
+        self.buildCurves(1, timeExt, timeStep, funcExt, ampExt, periodExt)
+        self.func = self.funcs[0]
+
+        return
+
+    def buildCurves(self, curveNb, timeExt = None, timeStep = None, funcExt = None,
+                    ampExt = None, periodExt = None, resample = 10):
+        """
+        Batch of curves created which interpolate linearly the averaged values of the
+        environmental parameter trends over the specified time period. The curves are computed
+        in a single vectorised pass and stored in the funcs array of shape (curveNb, timeNb).
+
+        Parameters
+        ----------
+        variable: curveNb
+            Number of curves to create.
+
+        variable: timeExt
+            Extent of the simulation time: start/end time (in years)
+
+        variable: timeStep
+            Discretisation step for time range (in years).
+
+        variable: funcExt
+            Environmental factor values for starting and ending times (in metres). Either a
+            start/end pair shared by all curves or an array of shape (curveNb,2).
+
+        variable: ampExt
+            Amplitude of the environmental factor wave for starting and ending times (in metres),
+            shared pair or (curveNb,2) array.
+
+        variable: periodExt
+            Period of the environmental factor wave for starting and ending times (in years),
+            shared pair or (curveNb,2) array.
+
+        variable: resample
+            Number of cubic spline resampled points per time step, None to keep the time step.
+        """
+
         dt = float(timeStep)
-        so = float(funcExt[0])
-        sm = float(funcExt[1])
         to = float(timeExt[0])
         tm = float(timeExt[1])
-        Ao = float(ampExt[0])
-        Am = float(ampExt[1])
-        Po = float(periodExt[0])
-        Pm = float(periodExt[1])
+        so, sm = self._curveParameters(funcExt, curveNb)
+        Ao, Am = self._curveParameters(ampExt, curveNb)
+        Po, Pm = self._curveParameters(periodExt, curveNb)
 
         self.time = np.arange(to,tm+dt,dt,dtype=np.float)
 
         # Environmental factor
         a0 = (sm - so)/(tm - to)
         b0 = so - a0 * to
-        self.func = a0 * self.time + b0
+        trend = a0 * self.time + b0
         # Amplitude
         a1 = (Am - Ao)/(tm - to)
         b1 = Ao - a1 * to
@@ -102,19 +140,75 @@ class preProc:
         b2 = Po - a2 * to
         P = a2 * self.time + b2
         # Enveloppe
-        self.env1 = a0 * self.time + b0 - 1.
-        self.env2 = a0 * self.time + b0 + 1.
+        self.env1 = trend - 1.
+        self.env2 = trend + 1.
 
-        for t in range(len(self.time)):
-            self.func[t] += A[t] * np.cos(2.* np.pi * (self.time[t] - to) / P[t])
+        self.funcs = trend + A * np.cos(2.* np.pi * (self.time - to) / P)
 
+        if resample is not None:
+            f = interpolate.interp1d(self.time, self.funcs, kind='cubic', axis=1)
+            tnew = np.arange(self.time.min(),timeExt[1]+dt/float(resample),dt/float(resample),dtype=np.float)
+            self.time = tnew
+            self.funcs = f(tnew)
 
-        f = interpolate.interp1d(self.time, self.func, kind='cubic')
-        tnew = np.arange(self.time.min(),timeExt[1]+dt/10.,dt/10.,dtype=np.float)
-        self.time = tnew
-        self.func = f(tnew)
+        if curveNb == 1:
+            self.env1 = self.env1[0]
+            self.env2 = self.env2[0]
 
-        return
+        return self.funcs
+
+    def randomCurves(self, curveNb, timeExt = None, timeStep = None, funcRange = None,
+                     ampRange = None, periodRange = None, resample = 10, seed = None):
+        """
+        Batch of curves with trend, amplitude and period drawn randomly from uniform
+        distributions for starting and ending times.
+
+        Parameters
+        ----------
+        variable: curveNb
+            Number of curves to create.
+
+        variable: timeExt
+            Extent of the simulation time: start/end time (in years)
+
+        variable: timeStep
+            Discretisation step for time range (in years).
+
+        variable: funcRange
+            Minimum and maximum environmental factor values (in metres).
+
+        variable: ampRange
+            Minimum and maximum amplitude of the environmental factor wave (in metres).
+
+        variable: periodRange
+            Minimum and maximum period of the environmental factor wave (in years).
+
+        variable: resample
+            Number of cubic spline resampled points per time step, None to keep the time step.
+
+        variable: seed
+            Random number generator seed.
+        """
+
+        rng = np.random.RandomState(seed)
+        funcExt = rng.uniform(funcRange[0], funcRange[1], (curveNb,2))
+        ampExt = rng.uniform(ampRange[0], ampRange[1], (curveNb,2))
+        periodExt = rng.uniform(periodRange[0], periodRange[1], (curveNb,2))
+
+        return self.buildCurves(curveNb, timeExt, timeStep, funcExt, ampExt, periodExt, resample)
+
+    def _curveParameters(self, ext, curveNb):
+        """
+        Starting and ending values of a curve parameter as column arrays of length curveNb.
+        """
+
+        ext = np.asarray(ext, dtype=np.float)
+        if ext.ndim == 1:
+            ext = np.tile(ext, (curveNb,1))
+        if ext.shape != (curveNb,2):
+            raise ValueError('Curve parameters need to be defined as a start/end pair or a (curveNb,2) array.')
+
+        return ext[:,0:1], ext[:,1:2]
 
     def readCurve(self, timeStart = None, timeEnd = None, dt = 10.):
         """
@@ -132,17 +226,15 @@ class preProc:
             Discretisation step for time range (in Ma).
         """
 
-        self.df.columns[1]
-        list1 = list(self.df)
-        time = self.df[list1[0:len(list1)-1]].values[:,0]
-        func = self.df[list1[len(list1)-1]].values
+        time = self.df['t'].values
+        func = self.df['h'].values
 
         if timeStart == None:
             timeStart = time.min()
         if timeEnd == None:
             timeEnd = time.max()
 
-        interpFn = interpolate.interp1d(self.time, self.func)
+        interpFn = interpolate.interp1d(time, func)
 
         self.time = np.arange(timeStart, timeEnd+dt, dt)
         self.func = interpFn(self.time)
@@ -177,6 +269,9 @@ class preProc:
             Name of the saved file.
         """
 
+        import matplotlib
+        import matplotlib.pyplot as plt
+
         matplotlib.rcParams.update({'font.size': font})
 
         # Define figure size
@@ -223,7 +318,38 @@ class preProc:
             Name of the saved CSV file.
         """
 
+        import pandas as pd
+
         df = pd.DataFrame({'X':np.around(self.time*factor, decimals=0),'Y':np.around(self.func, decimals=3)})
         df.to_csv(str(nameCSV),columns=['X', 'Y'], sep=' ', index=False ,header=0)
 
         return
+
+    def exportCurves(self, name, factor=1.):
+        """
+        Write the batch of curves in the binary forcing format read by pyReefCore, either as
+        one dataset per curve (curve00000, curve00001...) in a HDF5 file or as one numpy file per
+        curve named name_00000.npy, name_00001.npy...
+
+        Parameters
+        ----------
+        variable : name
+            Name of the HDF5 file (.h5) or prefix of the numpy files.
+
+        variable : factor
+            Factor to convert from given time unit to years (ex: Ma -> a).
+        """
+
+        funcs = self.funcs
+        if funcs is None:
+            funcs = self.func.reshape(1,-1)
+        time = self.time*factor
+
+        h5 = name.lower().endswith(('.h5', '.hdf5', '.he5'))
+        for c in range(len(funcs)):
+            if h5:
+                writeCurve(name, time, funcs[c], dataset='curve%05d'%c)
+            else:
+                writeCurve('%s_%05d.npy'%(name,c), time, funcs[c])
+
+        return
@@ -11,12 +11,149 @@ This module encapsulates parsing functions of pyReefCore XmL input file.
 """
 import os
 import glob
+import errno
 import numpy
+import base64
 import shutil
 import xml.etree.ElementTree as ET
 from collections import defaultdict
 from decimal import Decimal
 
+# Matrix entry tags of the community matrix and the environmental shape blocks
+MATRIX_ENTRIES = {'value': 'communityMatrix', 'dvalue': 'depthshape',
+                  'fvalue': 'flowshape', 'svalue': 'sedshape'}
+
+# Maximum number of output folder names tried when creating a unique output folder
+MAX_OUTDIR_ATTEMPTS = 1000
+
+def _readTree(inputfile):
+    """
+    Streaming parse of the XmL input file. Matrix entries are gathered in arrays as they are
+    read and removed from the element tree, so large community matrices are never held in
+    memory as XmL elements.
+
+    Parameters
+    ----------
+    string : inputfile
+        The XmL input file name.
+    """
+
+    root = None
+    stack = []
+    entries = defaultdict(lambda: ([], [], []))
+    for event, elem in ET.iterparse(inputfile, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            stack.append(elem)
+            continue
+        stack.pop()
+        if elem.tag in MATRIX_ENTRIES and stack and stack[-1].tag == MATRIX_ENTRIES[elem.tag]:
+            rows, cols, vals = entries[stack[-1].tag]
+            rows.append(int(elem.attrib['row']))
+            cols.append(int(elem.attrib['col']))
+            vals.append(float(elem.text))
+            stack[-1].remove(elem)
+
+    return root, entries
+
+def _matrixData(element, entries, shape):
+    """
+    Read a matrix block of the XmL input file. The matrix is either loaded from an external
+    numpy or CSV file (file attribute), decoded from an inline base64 array (encoding and
+    dtype attributes) or filled with its row/col entries. Undefined entries are set to zero.
+
+    Parameters
+    ----------
+    variable : element
+        XmL element of the matrix block.
+
+    variable : entries
+        Rows, columns and values of the matrix entries read for each block.
+
+    variable : shape
+        Shape of the matrix.
+    """
+
+    fname = element.get('file')
+    if fname is not None:
+        if not os.path.isfile(fname):
+            raise ValueError('The %s file is missing or the given path is incorrect.'%element.tag)
+        if fname.endswith('.npy'):
+            data = numpy.load(fname)
+        elif fname.endswith('.csv'):
+            data = numpy.loadtxt(fname, delimiter=',', ndmin=2)
+        else:
+            data = numpy.loadtxt(fname, ndmin=2)
+    elif element.get('encoding') is not None:
+        if element.get('encoding') != 'base64':
+            raise ValueError('The %s encoding needs to be base64.'%element.tag)
+        data = numpy.frombuffer(base64.b64decode(element.text), dtype=element.get('dtype', '<f8'))
+        if data.size != numpy.prod(shape):
+            raise ValueError('The %s array size does not match the number of communities.'%element.tag)
+        data = data.reshape(shape)
+    else:
+        data = numpy.zeros(shape, dtype=float)
+        rows, cols, vals = entries[element.tag]
+        if len(rows) > 0:
+            rows = numpy.array(rows)
+            cols = numpy.array(cols)
+            if rows.min() < 0 or cols.min() < 0 or rows.max() >= shape[0] or cols.max() >= shape[1]:
+                raise ValueError('The %s row or col indices exceed the matrix shape.'%element.tag)
+            data[rows, cols] = vals
+
+    if data.shape != shape:
+        raise ValueError('The %s matrix shape needs to be %dx%d.'%(element.tag, shape[0], shape[1]))
+
+    return numpy.array(data, dtype=float)
+
+def xmlVariant(template, values, filename):
+    """
+    Write a copy of an XmL input file with modified parameter values. Parameters are named by
+    their ElementTree path from the root element, for instance 'habitats/depth',
+    'habitats/community[2]/malthus' or 'habitats/communityMatrix/value[@row="0"][@col="1"]'.
+    Relative file names of the template are resolved from the template folder so that the
+    variant can be written anywhere.
+
+    Parameters
+    ----------
+    string : template
+        The XmL input file name.
+
+    variable : values
+        Dictionary of parameter values keyed by XmL path. A list of values sets each element
+        matching the path in document order.
+
+    string : filename
+        The XmL file name of the variant.
+    """
+
+    tree = ET.parse(template)
+    root = tree.getroot()
+    folder = os.path.dirname(os.path.abspath(template))
+    for element in root.iter():
+        if element.get('file') is not None and not os.path.isabs(element.get('file')):
+            element.set('file', os.path.join(folder, element.get('file')))
+        elif len(element) == 0 and element.text is not None and element.text.strip():
+            name = element.text.strip()
+            if not os.path.isabs(name) and os.path.isfile(os.path.join(folder, name)):
+                element.text = os.path.join(folder, name)
+
+    for path, value in values.items():
+        elements = root.findall(path)
+        if len(elements) == 0:
+            raise ValueError('XmL path %s is not defined in %s.' %(path, template))
+        if not isinstance(value, (list, tuple)):
+            value = [value]*len(elements)
+        elif len(value) != len(elements):
+            raise ValueError('XmL path %s matches %d elements for %d values.'
+                             %(path, len(elements), len(value)))
+        for element, v in zip(elements, value):
+            element.text = repr(float(v)) if isinstance(v, float) else str(v)
+    tree.write(filename)
+
+    return
+
 class xmlParser:
     """
     This class defines XmL input file variables.
@@ -43,6 +180,7 @@ class xmlParser:
         self.tEnd = None
         self.tCarb = None
         self.laytime = None
+        self.events = False
 
         self.depth0 = None
         self.speciesNb = None
@@ -52,6 +190,7 @@ class xmlParser:
         self.malthusParam = None
         self.speciesPopulation = None
         self.maxpop = 20.
+        self.minpop = 0.
         self.prodscale = 10.
         self.speciesProduction = None
         self.communityMatrix = None
@@ -95,6 +234,16 @@ class xmlParser:
         self.enviSed = None
         self.enviFlow = None
 
+        self.bathyfile = None
+
+        # Dataset names of forcing curves stored in HDF5 files
+        self.curveDataset = {}
+
+        self.storage = 'full'
+        self.storageStride = 1
+        self.storageType = numpy.float64
+        self.memmap = False
+
         self.makeUniqueOutputDir = makeUniqueOutputDir
         self.outDir = None
 
@@ -111,8 +260,7 @@ class xmlParser:
         """
 
         # Load XmL input file
-        tree = ET.parse(self.inputfile)
-        root = tree.getroot()
+        root, entries = _readTree(self.inputfile)
 
         # Extract time structure information
         time = None
@@ -144,6 +292,12 @@ class xmlParser:
                 self.laytime = float(element.text)
             else:
                 self.laytime = self.tCarb
+            element = None
+            element = time.find('events')
+            if element is not None:
+                self.events = int(element.text) > 0
+            else:
+                self.events = False
             if Decimal(self.laytime) % Decimal(self.tCarb) != 0.:
                 raise ValueError('Error in the XmL file: stratal layer interval needs to be an exact multiple of the carbonate interval!')
             if Decimal(self.tEnd-self.tStart) % Decimal(self.laytime) != 0.:
@@ -176,6 +330,14 @@ class xmlParser:
             else:
                 self.maxpop = 20
             element = None
+            element = litho.find('minPopulation')
+            if element is not None:
+                self.minpop = float(element.text)
+                if self.minpop<0:
+                    raise ValueError('Error the minimum population number needs to be positive!')
+            else:
+                self.minpop = 0.
+            element = None
             element = litho.find('prodFactor')
             if element is not None:
                 self.prodscale = int(element.text)
@@ -239,16 +401,7 @@ class xmlParser:
             element = None
             element = litho.find('communityMatrix')
             if element is not None:
-                data = defaultdict(list)
-                # Group into rows of (col, val) tuples
-                for val in litho.iter('value'):
-                    data[int(val.attrib['row'])].append((int(val.attrib['col']), val.text))
-                # Sort columns and format into a space separated string
-                rows = []
-                for row in data:
-                    rows.append(' '.join([cols[1] for cols in sorted(data[row])]))
-                # Build array from matrix string
-                self.communityMatrix = numpy.array(numpy.mat(';'.join(rows)))
+                self.communityMatrix = _matrixData(element, entries, (self.speciesNb,self.speciesNb))
             else:
                 raise ValueError('Error definition of the community matrix interaction is missing in the habitats structure!')
         else:
@@ -269,6 +422,7 @@ class xmlParser:
             element = sea.find('curve')
             if element is not None:
                 self.seafile = element.text
+                self.curveDataset['seafile'] = element.get('dataset')
                 if not os.path.isfile(self.seafile):
                     raise ValueError('Sea level file is missing or the given path is incorrect.')
             else:
@@ -286,6 +440,7 @@ class xmlParser:
             element = temp.find('curve')
             if element is not None:
                 self.tempfile = element.text
+                self.curveDataset['tempfile'] = element.get('dataset')
                 if not os.path.isfile(self.tempfile):
                     raise ValueError('Temperature file is missing or the given path is incorrect.')
             else:
@@ -302,6 +457,7 @@ class xmlParser:
             element = pH.find('curve')
             if element is not None:
                 self.pHfile = element.text
+                self.curveDataset['pHfile'] = element.get('dataset')
                 if not os.path.isfile(self.pHfile):
                     raise ValueError('pH file is missing or the given path is incorrect.')
             else:
@@ -312,12 +468,13 @@ class xmlParser:
         # Extract nutrients structure information
         Nu = None
         Nu = root.find('Nu')
-        if pH is not None:
+        if Nu is not None:
             self.nutrientOn = True
             element = None
             element = Nu.find('curve')
             if element is not None:
                 self.nufile = element.text
+                self.curveDataset['nufile'] = element.get('dataset')
                 if not os.path.isfile(self.nufile):
                     raise ValueError('Nutrients file is missing or the given path is incorrect.')
             else:
@@ -340,6 +497,7 @@ class xmlParser:
             element = tec.find('curve')
             if element is not None:
                 self.tecfile = element.text
+                self.curveDataset['tecfile'] = element.get('dataset')
                 if not os.path.isfile(self.tecfile):
                     raise ValueError('Tectonic file is missing or the given path is incorrect.')
             else:
@@ -364,6 +522,7 @@ class xmlParser:
             element = flow.find('curve')
             if element is not None:
                 self.flowfile = element.text
+                self.curveDataset['flowfile'] = element.get('dataset')
                 if not os.path.isfile(self.flowfile):
                     raise ValueError('Flow velocity file is missing or the given path is incorrect.')
             else:
@@ -423,6 +582,7 @@ class xmlParser:
             element = sed.find('curve')
             if element is not None:
                 self.sedfile = element.text
+                self.curveDataset['sedfile'] = element.get('dataset')
                 if not os.path.isfile(self.sedfile):
                     raise ValueError('Sediment input file is missing or the given path is incorrect.')
             else:
@@ -475,45 +635,62 @@ class xmlParser:
             element = None
             element = envi.find('depthshape')
             if element is not None:
-                self.enviDepth = numpy.zeros((self.speciesNb,4), dtype=float)
-                data = defaultdict(list)
-                # Group into rows of (col, val) tuples
-                for val in envi.iter('dvalue'):
-                    data[int(val.attrib['row'])].append((int(val.attrib['col']), val.text))
-                # Sort columns and format into a space separated string
-                rows = []
-                for row in data:
-                    rows.append(' '.join([cols[1] for cols in sorted(data[row])]))
-                # Build array from matrix string
-                self.enviDepth = numpy.array(numpy.mat(';'.join(rows)))
+                self.enviDepth = _matrixData(element, entries, (self.speciesNb,4))
             element = None
             element = envi.find('flowshape')
             if element is not None:
-                self.enviFlow = numpy.zeros((self.speciesNb,4), dtype=float)
-                data = defaultdict(list)
-                # Group into rows of (col, val) tuples
-                for val in envi.iter('fvalue'):
-                    data[int(val.attrib['row'])].append((int(val.attrib['col']), val.text))
-                # Sort columns and format into a space separated string
-                rows = []
-                for row in data:
-                    rows.append(' '.join([cols[1] for cols in sorted(data[row])]))
-                # Build array from matrix string
-                self.enviFlow = numpy.array(numpy.mat(';'.join(rows)))
+                self.enviFlow = _matrixData(element, entries, (self.speciesNb,4))
             element = None
             element = envi.find('sedshape')
             if element is not None:
-                self.enviSed = numpy.zeros((self.speciesNb,4), dtype=float)
-                data = defaultdict(list)
-                # Group into rows of (col, val) tuples
-                for val in envi.iter('svalue'):
-                    data[int(val.attrib['row'])].append((int(val.attrib['col']), val.text))
-                # Sort columns and format into a space separated string
-                rows = []
-                for row in data:
-                    rows.append(' '.join([cols[1] for cols in sorted(data[row])]))
-                # Build array from matrix string
-                self.enviSed = numpy.array(numpy.mat(';'.join(rows)))
+                self.enviSed = _matrixData(element, entries, (self.speciesNb,4))
+
+        # Extract platform grid information
+        platform = None
+        platform = root.find('platform')
+        if platform is not None:
+            element = None
+            element = platform.find('bathymetry')
+            if element is not None:
+                self.bathyfile = element.text
+                if not os.path.isfile(self.bathyfile):
+                    raise ValueError('Bathymetry file is missing or the given path is incorrect.')
+            else:
+                raise ValueError('Error in the definition of the platform grid: bathymetry file is required!')
+        else:
+            self.bathyfile = None
+
+        # Extract carbonate time step records storage information
+        storage = None
+        storage = root.find('storage')
+        if storage is not None:
+            element = None
+            element = storage.find('mode')
+            if element is not None:
+                self.storage = element.text.strip()
+                if self.storage not in ('full', 'stride', 'layer', 'metrics'):
+                    raise ValueError('Error in the definition of the storage: mode needs to be full, stride, layer or metrics!')
+            element = None
+            element = storage.find('stride')
+            if element is not None:
+                if self.storage != 'stride':
+                    raise ValueError('Error in the definition of the storage: stride is only used with stride mode!')
+                self.storageStride = int(element.text)
+                if self.storageStride < 1:
+                    raise ValueError('Error in the definition of the storage: stride needs to be a positive integer!')
+            if self.storage == 'stride' and element is None:
+                raise ValueError('Error in the definition of the storage: stride is required for stride mode!')
+            element = None
+            element = storage.find('precision')
+            if element is not None:
+                if element.text.strip() == 'float32':
+                    self.storageType = numpy.float32
+                elif element.text.strip() != 'float64':
+                    raise ValueError('Error in the definition of the storage: precision needs to be float32 or float64!')
+            element = None
+            element = storage.find('memmap')
+            if element is not None:
+                self.memmap = int(element.text) > 0
 
         # Get output directory
         out = None
@@ -524,10 +701,25 @@ class xmlParser:
             self.outDir = os.getcwd()+'/out'
 
         if self.makeUniqueOutputDir:
-            if os.path.exists(self.outDir):
-                self.outDir += '_'+str(len(glob.glob(self.outDir+str('*')))-1)
-
-            os.makedirs(self.outDir)
+            outDir = self.outDir
+            suffix = None
+            if os.path.exists(outDir):
+                suffix = len(glob.glob(outDir+str('*')))-1
+                self.outDir = outDir+'_'+str(suffix)
+
+            # Existing folders (created by concurrent simulations or leaving gaps in the
+            # numbering) are skipped by incrementing the suffix
+            attempts = 0
+            while True:
+                try:
+                    os.makedirs(self.outDir)
+                    break
+                except OSError as err:
+                    attempts += 1
+                    if err.errno != errno.EEXIST or attempts >= MAX_OUTDIR_ATTEMPTS:
+                        raise
+                    suffix = 0 if suffix is None else suffix+1
+                    self.outDir = outDir+'_'+str(suffix)
             shutil.copy(self.inputfile,self.outDir)
 
         return
@@ -0,0 +1,185 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore platform grid model entry file.
+"""
+import numpy as np
+
+from pyReefCore import (xmlParser, enviForce, gridData)
+
+
+class GridModel(object):
+    """State object for a pyReef platform grid made of many reef cores."""
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+
+        # Simulation state
+        self.tNow = 0.
+        self.layID = 0
+        self.simStarted = False
+
+    def load_xml(self, filename, bathymetry=None, verbose=False):
+        """
+        Load an XML configuration file and the platform initial bathymetry.
+
+        Parameters
+        ----------
+        variable : filename
+            XmL input file name.
+
+        variable : bathymetry
+            Initial water depth of each core as a 1D transect or 2D platform array. If not
+            provided the bathymetry file defined in the XmL platform structure is used.
+        """
+
+        self.input = xmlParser.xmlParser(filename)
+        self.tNow = self.input.tStart
+        self.tLayer = self.tNow + self.input.laytime
+        self.timetec = self.input.tStart
+        self.layID = 0
+
+        if bathymetry is None:
+            if self.input.bathyfile is None:
+                raise ValueError('Platform grid bathymetry needs to be defined either in the XmL file or as an argument.')
+            bathymetry = np.loadtxt(self.input.bathyfile, ndmin=2)
+            if bathymetry.shape[0] == 1:
+                bathymetry = bathymetry[0]
+        self.gridShape = np.shape(bathymetry)
+        self.depth0 = np.array(bathymetry, dtype=float).ravel()
+
+        # Initialise environmental forcing conditions
+        self.force = enviForce.enviForce(input=self.input)
+
+        # Initialise platform grid cores
+        self.grid = gridData.gridData(input=self.input, depth0=self.depth0)
+
+        # Time dependent forcing records
+        self.layTime = np.arange(self.input.tStart, self.input.tEnd+self.input.laytime, self.input.laytime)
+        self.sealevel = np.zeros(len(self.layTime),dtype=float)
+        self.tecrate = np.zeros(len(self.layTime),dtype=float)
+        self.temperature = np.zeros(len(self.layTime),dtype=float)
+        self.pH = np.zeros(len(self.layTime),dtype=float)
+        self.nutrient = np.zeros(len(self.layTime),dtype=float)
+
+        return
+
+    def _timeForcing(self):
+        """
+        Evaluate the time dependent forcing shared by all cores for the current time step.
+        """
+
+        frc = np.zeros(gridData.FRC_SIZE,dtype=float)
+        frc[gridData.FRC_TNOW] = self.tNow
+        frc[gridData.FRC_TCORAL] = self.tNow+self.input.tCarb
+        frc[gridData.FRC_TEMP:] = 1.
+
+        # Records are stored in the next layer once the simulation has started
+        lay = self.layID+1
+        if self.tNow == self.input.tStart:
+            lay = self.layID
+
+        # Get tectonic
+        if self.input.tecOn:
+            frc[gridData.FRC_TEC] = self.force.tecShift(self.tNow, self.timetec)
+            self.timetec = self.tNow
+            self.tecrate[lay] = self.force.tecrate
+
+        # Get sea-level
+        if self.input.seaOn:
+            frc[gridData.FRC_SEA] = self.force.seaShift(self.tNow)
+            self.sealevel[lay] = self.force.sealevel
+
+        # Get temperature control
+        if self.input.tempOn:
+            self.force.getTemp(self.tNow)
+            frc[gridData.FRC_TEMP] = self.force.templevel
+            self.temperature[self.layID] = self.force.templevel
+
+        # Get pH control
+        if self.input.pHOn:
+            self.force.getpH(self.tNow)
+            frc[gridData.FRC_PH] = self.force.pHlevel
+            self.pH[self.layID] = self.force.pHlevel
+
+        # Get nutrients control
+        if self.input.nutrientOn:
+            self.force.getNu(self.tNow)
+            frc[gridData.FRC_NU] = self.force.nulevel
+            self.nutrient[self.layID] = self.force.nulevel
+
+        return frc
+
+    def run_to_time(self, tEnd, showtime=10, verbose=False):
+        """
+        Run the platform grid simulation to a specified point in time (tEnd).
+        """
+
+        timeVerbose = self.tNow+showtime
+
+        print 'tNow = %s [yr]' %self.tNow
+
+        if tEnd > self.input.tEnd:
+            tEnd = self.input.tEnd
+            print 'Requested end time is longer than the one defined in your XmL input file'
+            print 'Your simulation will run for %s years.'%(tEnd)
+
+        # Perform main simulation loop
+        while self.tNow < tEnd:
+
+            # Advance all cores over the carbonate time step
+            frc = self._timeForcing()
+            self.grid.step(self.force, frc, self.layID)
+
+            # Update time step
+            self.tNow = frc[gridData.FRC_TCORAL]
+
+            # Update stratigraphic layer ID
+            if self.tLayer <= self.tNow :
+                self.tLayer += self.input.laytime
+                self.layID += 1
+
+            if self.tNow>=timeVerbose:
+                timeVerbose = self.tNow+showtime
+                print 'tNow = %s [yr]' %self.tNow
+
+        return
+
+    def write_cube(self, filename):
+        """
+        Write the platform stratigraphic cube to a compressed numpy file. Layer arrays are
+        reshaped to the platform grid with the layer index as first dimension.
+
+        Parameters
+        ----------
+        variable : filename
+            Name of the cube file saved in the output folder.
+        """
+
+        shape = self.gridShape
+        layNb = self.grid.layNb
+        name = self.input.outDir+'/'+filename
+        np.savez_compressed(name,
+                 layTime = self.layTime,
+                 bathymetry = self.depth0.reshape(shape),
+                 surface = self.grid.topH.reshape(shape),
+                 thickness = self.grid.thickness.reshape((layNb,)+shape),
+                 coralH = self.grid.coralH.reshape((layNb,self.input.speciesNb+1)+shape),
+                 karstero = self.grid.karstero.reshape((layNb,)+shape),
+                 sedinput = self.grid.sedinput.reshape((layNb,)+shape),
+                 waterflow = self.grid.waterflow.reshape((layNb,)+shape),
+                 population = self.grid.population.reshape((self.input.speciesNb,)+shape),
+                 sealevel = self.sealevel,
+                 tecrate = self.tecrate,
+                 names = self.input.speciesName)
+        print 'Platform stratigraphic cube has been saved in',name
+
+        return
@@ -0,0 +1,228 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore platform grid model running on several local processes.
+
+   Cores are partitioned across worker processes and their state lives in shared memory
+   arrays. The coordinator evaluates the time dependent forcing once per carbonate time step
+   and the workers synchronise at every stratigraphic layer boundary.
+"""
+import traceback
+import numpy as np
+import multiprocessing as mp
+from multiprocessing.sharedctypes import RawArray
+
+from pyReefCore import (enviForce, gridData)
+from pyReefCore.gridModel import GridModel
+
+
+def _sharedView(raw, shape):
+    """
+    Numpy view of a shared memory array.
+    """
+
+    return np.frombuffer(raw, dtype=float).reshape(shape)
+
+
+def _gridWorker(input, shared, shapes, start, end, conn):
+    """
+    Worker process advancing a contiguous range of cores of the platform grid.
+
+    Parameters
+    ----------
+    class: input
+        Input parameter class.
+
+    variable : shared
+        Dictionary of shared memory arrays.
+
+    variable : shapes
+        Shape of the shared memory arrays.
+
+    variable : start
+        Index of the first core handled by the worker.
+
+    variable : end
+        Index after the last core handled by the worker.
+
+    variable : conn
+        Pipe connection to the coordinator.
+    """
+
+    try:
+        buffers = {}
+        for name in gridData.gridData.arrayShapes(input, 0):
+            buffers[name] = _sharedView(shared[name], shapes[name])[...,start:end]
+        frcs = _sharedView(shared['forcing'], shapes['forcing'])
+        force = enviForce.enviForce(input=input)
+        grid = gridData.gridData(input=input, depth0=buffers['topH'], buffers=buffers)
+        conn.send(None)
+    except Exception:
+        conn.send(traceback.format_exc())
+        return
+
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        stepNb, layID = msg
+        try:
+            if end > start:
+                for k in range(stepNb):
+                    grid.step(force, frcs[k], layID)
+            conn.send(None)
+        except Exception:
+            conn.send(traceback.format_exc())
+
+    return
+
+
+class ParallelGridModel(GridModel):
+    """State object for a pyReef platform grid distributed over local processes."""
+
+    def __init__(self, nprocs=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : nprocs
+            Number of worker processes (default is the number of local CPUs).
+        """
+
+        super(ParallelGridModel, self).__init__()
+
+        if nprocs is None:
+            nprocs = mp.cpu_count()
+        self.nprocs = nprocs
+        self._workers = []
+
+    def load_xml(self, filename, bathymetry=None, verbose=False):
+        """
+        Load an XML configuration file and allocate the platform grid cores state in shared
+        memory.
+
+        Parameters
+        ----------
+        variable : filename
+            XmL input file name.
+
+        variable : bathymetry
+            Initial water depth of each core as a 1D transect or 2D platform array.
+        """
+
+        super(ParallelGridModel, self).load_xml(filename, bathymetry, verbose)
+
+        # Move cores state to shared memory arrays
+        self._shapes = gridData.gridData.arrayShapes(self.input, len(self.depth0))
+        stepNb = int(round(self.input.laytime/self.input.tCarb))+1
+        self._shapes['forcing'] = (stepNb, gridData.FRC_SIZE)
+        self._shared = {}
+        buffers = {}
+        for name, shape in self._shapes.items():
+            self._shared[name] = RawArray('d', int(np.prod(shape)))
+            buffers[name] = _sharedView(self._shared[name], shape)
+            if name in gridData.gridData.arrayShapes(self.input, 0):
+                buffers[name][:] = getattr(self.grid, name)
+        self.frcs = buffers.pop('forcing')
+        self.grid = gridData.gridData(input=self.input, depth0=self.depth0, buffers=buffers)
+
+        return
+
+    def _start_workers(self):
+        """
+        Start worker processes and partition the cores between them.
+        """
+
+        bounds = np.linspace(0, len(self.depth0), self.nprocs+1).astype(int)
+        for p in range(self.nprocs):
+            parent, child = mp.Pipe()
+            proc = mp.Process(target=_gridWorker, args=(self.input, self._shared, self._shapes,
+                                                        bounds[p], bounds[p+1], child))
+            proc.daemon = True
+            proc.start()
+            self._workers.append((proc, parent))
+        self._gather()
+
+        return
+
+    def _stop_workers(self):
+        """
+        Stop worker processes.
+        """
+
+        for proc, conn in self._workers:
+            conn.send(None)
+            proc.join()
+        self._workers = []
+
+        return
+
+    def _gather(self):
+        """
+        Wait for all workers to complete their task.
+        """
+
+        errors = [conn.recv() for proc, conn in self._workers]
+        for err in errors:
+            if err is not None:
+                self._stop_workers()
+                raise RuntimeError('Platform grid worker failed:\n%s' %err)
+
+        return
+
+    def run_to_time(self, tEnd, showtime=10, verbose=False):
+        """
+        Run the platform grid simulation to a specified point in time (tEnd).
+        """
+
+        timeVerbose = self.tNow+showtime
+
+        print 'tNow = %s [yr]' %self.tNow
+
+        if tEnd > self.input.tEnd:
+            tEnd = self.input.tEnd
+            print 'Requested end time is longer than the one defined in your XmL input file'
+            print 'Your simulation will run for %s years.'%(tEnd)
+
+        self._start_workers()
+
+        # Perform main simulation loop
+        while self.tNow < tEnd:
+
+            # Evaluate the time dependent forcing until the next layer boundary
+            layID = self.layID
+            stepNb = 0
+            while self.tNow < tEnd and self.layID == layID:
+                self.frcs[stepNb] = self._timeForcing()
+                self.tNow = self.frcs[stepNb,gridData.FRC_TCORAL]
+                stepNb += 1
+                if self.tLayer <= self.tNow :
+                    self.tLayer += self.input.laytime
+                    self.layID += 1
+
+            # Advance all cores and synchronise at the layer boundary
+            for proc, conn in self._workers:
+                conn.send((stepNb, layID))
+            self._gather()
+
+            if self.tNow>=timeVerbose:
+                timeVerbose = self.tNow+showtime
+                print 'tNow = %s [yr]' %self.tNow
+
+        self._stop_workers()
+
+        return
+
+    def ncpus(self):
+        """
+        Return the number of CPUs used to generate the results.
+        """
+
+        return self.nprocs
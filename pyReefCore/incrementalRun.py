@@ -0,0 +1,245 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore incremental re-simulation.
+
+   The model state is saved at regular time intervals during a simulation. When a new
+   configuration is run, the earliest time at which it differs from the previous one is found
+   by comparing the parsed parameters and the forcing curves. The simulation is then resumed
+   from the latest saved state preceding this time instead of restarting from tStart.
+"""
+import os
+import pickle
+import numpy as np
+
+from pyReefCore.model import Model
+from pyReefCore.runCache import (IGNORED_INPUTS, CORAL_RECORDS)
+
+# Time dependent forcing curves: activation flag and interpolation function names
+FORCING_CURVES = (('seaOn', 'seaFunc'), ('tecOn', 'tecFunc'), ('sedOn', 'sedFunc'),
+                  ('flowOn', 'flowFunc'), ('tempOn', 'tempFunc'), ('pHOn', 'pHFunc'),
+                  ('nutrientOn', 'nuFunc'))
+
+
+def _sameValue(val1, val2):
+    """
+    Check if two parsed input values are identical.
+    """
+
+    if isinstance(val1, np.ndarray) or isinstance(val2, np.ndarray):
+        return np.shape(val1) == np.shape(val2) and np.array_equal(val1, val2)
+
+    return val1 == val2
+
+
+def curveDivergence(func1, func2):
+    """
+    Earliest time from which two forcing interpolation functions differ. Returns None if the
+    functions are identical and -inf if they differ from the start.
+
+    Parameters
+    ----------
+    class : func1, func2
+        Scipy 1D interpolation functions.
+    """
+
+    if func1 is None or func2 is None:
+        if func1 is None and func2 is None:
+            return None
+        return -np.inf
+
+    if func1.x.shape == func2.x.shape and np.array_equal(func1.x, func2.x) \
+            and np.array_equal(func1.y, func2.y):
+        return None
+
+    # Cubic interpolations are global: any change affects the whole curve
+    if func1._kind != 'linear' or func2._kind != 'linear':
+        return -np.inf
+
+    # Linear interpolations with clamped ends are identical everywhere if they coincide on
+    # the union of their nodes, and are unchanged until the node preceding the first difference
+    times = np.union1d(func1.x, func2.x)
+    val1 = np.interp(times, func1.x, func1.y)
+    val2 = np.interp(times, func2.x, func2.y)
+    ids = np.where(val1 != val2)[0]
+    if len(ids) == 0:
+        return None
+    if ids[0] == 0:
+        return -np.inf
+
+    return times[ids[0]-1]
+
+
+class incrementalRun(object):
+    """
+    Re-simulation of successive pyReefCore configurations from their earliest divergence.
+    """
+
+    def __init__(self, interval=None, folder=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : interval
+            Time interval between saved model states in years. It is rounded to a multiple of
+            the stratigraphic layer time (default is a twentieth of the simulation duration).
+
+        variable : folder
+            Folder where the model states are saved. If None states are kept in memory.
+        """
+
+        self.interval = interval
+        self.folder = folder
+        if folder is not None and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        # Reference simulation
+        self.config = None
+        self.records = None
+        self.snapshots = []
+        self.resumeTime = None
+
+        return
+
+    def _configuration(self, model, seed):
+        """
+        Parameters and forcing functions defining a simulation.
+        """
+
+        params = {'seed': seed}
+        for name in vars(model.input):
+            if name in IGNORED_INPUTS or name == 'tEnd' or name.endswith('file'):
+                continue
+            params[name] = getattr(model.input, name)
+
+        curves = {}
+        for flag, func in FORCING_CURVES:
+            curves[func] = getattr(model.force, func)
+
+        return {'params': params, 'curves': curves}
+
+    def divergence(self, config):
+        """
+        Earliest time at which a configuration differs from the reference simulation. Returns
+        None if both configurations are identical.
+
+        Parameters
+        ----------
+        variable : config
+            Simulation parameters and forcing functions.
+        """
+
+        if self.config is None:
+            return -np.inf
+
+        params1 = self.config['params']
+        params2 = config['params']
+        if sorted(params1) != sorted(params2):
+            return -np.inf
+        for name in params1:
+            if not _sameValue(params1[name], params2[name]):
+                return -np.inf
+
+        tDiv = None
+        for flag, func in FORCING_CURVES:
+            if not params2[flag]:
+                continue
+            t = curveDivergence(self.config['curves'][func], config['curves'][func])
+            if t is not None and (tDiv is None or t < tDiv):
+                tDiv = t
+
+        return tDiv
+
+    def _save(self, name, data):
+        """
+        Store a snapshot or records either in memory or in the snapshot folder.
+        """
+
+        if self.folder is None:
+            return data
+
+        fname = os.path.join(self.folder, name)
+        with open(fname, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+
+        return fname
+
+    def _load(self, entry):
+        """
+        Load a stored snapshot or records.
+        """
+
+        if self.folder is None:
+            return entry
+
+        with open(entry, 'rb') as f:
+            data = pickle.load(f)
+
+        return data
+
+    def run(self, filename, tEnd, seed=0, showtime=10):
+        """
+        Load an XML configuration file and run the simulation to a specified point in time
+        (tEnd), resuming from the latest saved state of the reference simulation preceding the
+        earliest difference between both configurations.
+
+        Parameters
+        ----------
+        variable : filename
+            XmL input file name.
+
+        variable : tEnd
+            Requested simulation end time.
+
+        variable : seed
+            Random number generator seed.
+
+        variable : showtime
+            Display interval of the simulation time.
+        """
+
+        model = Model()
+        model.load_xml(filename, seed=seed)
+        tEnd = min(tEnd, model.input.tEnd)
+        config = self._configuration(model, seed)
+
+        # Find the latest valid snapshot of the reference simulation
+        tDiv = self.divergence(config)
+        valid = []
+        for tSnap, entry in self.snapshots:
+            if tSnap < tEnd and (tDiv is None or tSnap <= tDiv):
+                valid.append((tSnap, entry))
+        if len(valid) > 0:
+            model.set_state(self._load(valid[-1][1]), self._load(self.records))
+        self.snapshots = valid
+        self.resumeTime = model.tNow
+
+        interval = self.interval
+        if interval is None:
+            interval = (model.input.tEnd-model.input.tStart)/20.
+        laynb = max(int(round(interval/model.input.laytime)), 1)
+        interval = laynb*model.input.laytime
+
+        # Run the simulation and save its state at regular intervals
+        while True:
+            tNext = min(model.tNow+interval, tEnd)
+            model.run_to_time(tNext-0.5*model.input.tCarb, showtime=showtime)
+            if model.tNow >= tEnd-0.5*model.input.tCarb:
+                break
+            self.snapshots.append((model.tNow, self._save('state%d.pkl'%len(self.snapshots),
+                                                          model.get_state())))
+
+        records = {}
+        for name in CORAL_RECORDS:
+            records[name] = np.copy(getattr(model.coral, name))
+        self.records = self._save('records.pkl', records)
+        self.config = config
+
+        return model
@@ -13,7 +13,9 @@ import time
 import numpy as np
 #import mpi4py.MPI as mpi
 
-from pyReefCore import (preProc, xmlParser, enviForce, coralGLV, coreData, modelPlot)
+from collections import namedtuple
+from pyReefCore import (preProc, xmlParser, enviForce, coralGLV, coreData, modelPlot, outputH5)
+from pyReefCore.runMetrics import runMetrics
 
 # profiling support
 import cProfile
@@ -22,6 +24,21 @@ import pstats
 import StringIO
 
 
+# Lightweight record yielded after each simulation time step. The population is a view on
+# the coral population records.
+stepRecord = namedtuple('stepRecord', ['time', 'iter', 'layID', 'depth', 'sealevel', 'population'])
+
+# Simulation events available to subscribers
+EVENTS = ('step', 'layer', 'drown', 'karst')
+
+# Simulation state variables required to resume a simulation
+MODEL_STATE = ('tNow', 'tCoral', 'tLayer', 'timetec', 'iter', 'layID', 'drowned',
+               'drowningTime')
+FORCE_STATE = ('sealevel', 'tecrate', 'sedlevel', 'flowlevel', 'templevel', 'pHlevel', 'nulevel')
+CORE_STATE = ('topH', 'thickness', 'coralH', 'karstero', 'sealevel', 'sedinput', 'tecrate',
+              'waterflow', 'nutrient', 'temperature', 'pH')
+
+
 class Model(object):
     """State object for the pyReef model."""
 
@@ -38,6 +55,10 @@ class Model(object):
         self.outputStep = 0
         self.applyDisp = False
         self.simStarted = False
+        self.stopReason = None
+
+        # Subscribers to simulation events
+        self._hooks = {}
 
         self.dispRate = None
 
@@ -48,9 +69,11 @@ class Model(object):
         # Initialise pre-processing functions
         self.enviforcing = preProc.preProc()
 
-    def load_xml(self, filename, verbose=False):
+    def load_xml(self, filename, verbose=False, seed=None):
         """
         Load an XML configuration file.
+
+        If seed is None, the random number generator is seeded randomly.
         """
         
         # Only the first node should create a unique output dir
@@ -59,14 +82,16 @@ class Model(object):
         self.tNow = self.input.tStart
         self.tCoral = self.tNow
         self.tLayer = self.tNow + self.input.laytime
+        self.timetec = self.input.tStart
 
         # Seed the random number generator consistently on all nodes
-        seed = None
         #if self._rank == 0:
             # limit to max uint32
-        seed = np.random.mtrand.RandomState().tomaxint() % 0xFFFFFFFF
+        if seed is None:
+            seed = np.random.mtrand.RandomState().tomaxint() % 0xFFFFFFFF
         #seed = self._comm.bcast(seed, root=0)
         np.random.seed(seed)
+        self.seed = seed
         self.iter = 0
         self.layID = 0
 
@@ -90,13 +115,73 @@ class Model(object):
         # Initialise plotting functions
         self.plot = modelPlot.modelPlot(input=self.input)
 
+        # Deepest water depth sustaining coral growth
+        self.drownDepth = None
+        if self.input.enviDepth is not None:
+            self.drownDepth = np.max(self.input.enviDepth[:,3])
+        self.drowned = False
+        # First time the core top is deeper than the deepest species habitat
+        self.drowningTime = None
+
+        # Streaming run metrics, attached to the run in metrics storage mode
+        self.metrics = None
+
+        return
+
+    def subscribe(self, event, callback):
+        """
+        Register a function called when a simulation event occurs. The function receives the
+        model, the event name and an event value: the step record for 'step', the index of the
+        completed layer for 'layer', the simulation time for 'drown' and the eroded thickness
+        for 'karst'. Model arrays are passed as views and should not be modified.
+
+        Parameters
+        ----------
+        variable : event
+            One of the simulation events: 'step', 'layer', 'drown' or 'karst'.
+
+        variable : callback
+            Function called as callback(model, event, value).
+        """
+
+        if event not in EVENTS:
+            raise ValueError('Unknown simulation event: %s' %event)
+        self._hooks.setdefault(event, []).append(callback)
+
+        return
+
+    def unsubscribe(self, event, callback):
+        """
+        Remove a function registered for a simulation event.
+        """
+
+        if callback in self._hooks.get(event, []):
+            self._hooks[event].remove(callback)
+            if len(self._hooks[event]) == 0:
+                del self._hooks[event]
+
+        return
+
+    def _notify(self, event, value):
+        """
+        Call the subscribers of a simulation event.
+        """
+
+        for callback in self._hooks.get(event, ()):
+            callback(self, event, value)
+
         return
 
-    def run_to_time(self, tEnd, showtime=10, profile=False, verbose=False):
+    def run_to_time(self, tEnd, showtime=10, profile=False, verbose=False, stop=None):
         """
         Run the simulation to a specified point in time (tEnd).
 
         If profile is True, dump cProfile output to /tmp.
+
+        Parameters
+        ----------
+        variable : stop
+            List of stop criteria ending the simulation before tEnd (optional).
         """
 
         timeVerbose = self.tNow+showtime
@@ -108,155 +193,237 @@ class Model(object):
 
         #if self._rank == 0:
         print 'tNow = %s [yr]' %self.tNow
-        timetec = self.input.tStart
 
-        if tEnd > self.input.tEnd:
+        for step in self.steps(tEnd, stop, verbose):
+            #if self._rank == 0 and self.tNow>=timeVerbose:
+            if self.tNow>=timeVerbose:
+                timeVerbose = self.tNow+showtime
+                print 'tNow = %s [yr]' %self.tNow
+
+        if self.stopReason is not None:
+            print 'Simulation stopped at %s [yr]: %s' %(self.tNow, self.stopReason)
+
+        return
+
+    def steps(self, tEnd=None, stop=None, verbose=False):
+        """
+        Generator advancing the simulation one carbonate time step at a time until tEnd or
+        until one of the stop criteria is met. A step record is yielded after each time step.
+
+        Parameters
+        ----------
+        variable : tEnd
+            Simulation end time (default is the end time defined in the XmL input file).
+
+        variable : stop
+            List of stop criteria (see the stopCriteria module).
+        """
+
+        if tEnd is None or tEnd > self.input.tEnd:
+            if tEnd is not None:
+                print 'Requested end time is longer than the one defined in your XmL input file'
+                print 'Your simulation will run for %s years.'%(self.input.tEnd)
             tEnd = self.input.tEnd
-            print 'Requested end time is longer than the one defined in your XmL input file'
-            print 'Your simulation will run for %s years.'%(tEnd)
+        self.tTarget = tEnd
 
         if self.tNow == self.input.tStart:
             # Initialise Generalized Lotka-Volterra equation
             self.coral = coralGLV.coralGLV(input=self.input)
 
-        # Perform main simulation loop
+        if self.input.storage == 'metrics' and self.metrics is None:
+            self.metrics = runMetrics()
+            self.metrics.attach(self)
+
+        if stop is None:
+            stop = []
+        for criterion in stop:
+            criterion.reset(self)
+        self.stopReason = None
+
+        try:
+            while self.tNow < tEnd:
+                self._step(verbose)
+                record = stepRecord(self.tNow, self.iter, self.layID, self.core.topH,
+                                    self.force.sealevel, self.coral.popNow)
+                if self._hooks:
+                    self._notify('step', record)
+                yield record
+                for criterion in stop:
+                    if criterion(self):
+                        self.stopReason = criterion.reason
+                        return
+        finally:
+            # Update plotting parameters
+            self._update_plot()
+            self.core.flush()
+
+    def _step(self, verbose=False):
+        """
+        Advance the simulation over one carbonate time step.
+        """
+
         # NOTE: number of iteration for the ODE during a given time step, could be user defined...
         N = 100
 
         # Define environmental factors
         dfac = np.ones(self.input.speciesNb,dtype=float)
-        sfac = np.ones(self.input.speciesNb,dtype=float)
-        ffac = np.ones(self.input.speciesNb,dtype=float)
-        tfac = np.ones(self.input.speciesNb,dtype=float)
-        nfac = np.ones(self.input.speciesNb,dtype=float)
-        pfac = np.ones(self.input.speciesNb,dtype=float)
-        while self.tNow < tEnd:
-
-            # Initial coral population
+        sfac = dfac
+        ffac = dfac
+        tfac = dfac
+        nfac = dfac
+        pfac = dfac
+
+        # Initial coral population
+        if self.tNow == self.input.tStart:
+            self.coral.storePopulation(np.copy(self.input.speciesPopulation), self.iter, self.layID)
+
+        # Get tectonic
+        if self.input.tecOn:
+            tmp = self.core.topH
+            self.core.topH, dfac = self.force.getTec(self.tNow, self.timetec, tmp)
+            self.timetec = self.tNow
             if self.tNow == self.input.tStart:
-                self.coral.population[:,self.iter] = self.input.speciesPopulation
-
-            # Get tectonic
-            if self.input.tecOn:
-                tmp = self.core.topH
-                self.core.topH, dfac = self.force.getTec(self.tNow, timetec, tmp)
-                timetec = self.tNow
-                if self.tNow == self.input.tStart:
-                    self.core.tecrate[self.layID] = self.force.tecrate
-                else:
-                    self.core.tecrate[self.layID+1] = self.force.tecrate
+                self.core.tecrate[self.layID] = self.force.tecrate
             else:
-                self.force.tecrate = 0.
-                self.core.tecrate[self.layID+1] = 0.
-
-            # Get sea-level
-            if self.input.seaOn:
-                tmp = self.core.topH
-                self.core.topH, dfac = self.force.getSea(self.tNow, tmp)
-                if self.tNow == self.input.tStart:
-                    self.core.sealevel[self.layID] = self.force.sealevel
-                else:
-                    self.core.sealevel[self.layID+1] = self.force.sealevel
+                self.core.tecrate[self.layID+1] = self.force.tecrate
+        else:
+            self.force.tecrate = 0.
+            self.core.tecrate[self.layID+1] = 0.
+
+        # Get sea-level
+        if self.input.seaOn:
+            tmp = self.core.topH
+            self.core.topH, dfac = self.force.getSea(self.tNow, tmp)
+            if self.tNow == self.input.tStart:
+                self.core.sealevel[self.layID] = self.force.sealevel
             else:
-                self.force.sealevel = 0.
-                if self.tNow == self.input.tStart:
-                    self.core.sealevel[self.layID] = self.force.sealevel
-                else:
-                    self.core.sealevel[self.layID+1] = self.force.sealevel
-
-            self.coral.mbsl[self.iter] = self.force.sealevel
-
-            # Store accommodation space through time
-            self.coral.accspace[self.iter] = self.core.topH #max(self.core.topH,0.)
-
-            # Get sediment input
-            if self.input.sedOn:
-                sedh, sfac = self.force.getSed(self.tNow, self.core.topH)
-                self.core.sedinput[self.layID] = self.force.sedlevel
+                self.core.sealevel[self.layID+1] = self.force.sealevel
+        else:
+            self.force.sealevel = 0.
+            if self.tNow == self.input.tStart:
+                self.core.sealevel[self.layID] = self.force.sealevel
             else:
-                sedh = 0.
-
-            # Get flow velocity
-            if self.input.flowOn:
-                ffac = self.force.getFlow(self.tNow, self.core.topH)
-                self.core.waterflow[self.layID] = self.force.flowlevel
-
-            # Get temperature control
-            if self.input.tempOn:
-                tfac = self.force.getTemp(self.tNow)
-                self.core.temperature[self.layID] = self.force.templevel
-
-            # Get pH control
-            if self.input.pHOn:
-                pfac = self.force.getPh(self.tNow)
-                self.core.pH[self.layID] = self.force.pHlevel
-
-            # Get nutrients control
-            if self.input.nutrientOn:
-                nfac = self.force.getNu(self.tNow)
-                self.core.nutrient[self.layID] = self.force.nulevel
-
-            # Limit species activity from environmental forces
-            tmp = np.minimum(dfac, sfac)
-            tmp2 = np.minimum(tfac, tmp)
-            tmp3 = np.minimum(pfac, tmp2)
-            tmp4 = np.minimum(nfac, tmp3)
-            fac = np.minimum(ffac, tmp4)
-            self.coral.epsilon = self.input.malthusParam * fac
-
-            # Initialise RKF conditions
-            self.odeRKF = self.coral.solverGLV()
-            self.odeRKF.set_initial_condition(self.coral.population[:,self.iter])
-
-            # Define coral evolution time interval and time stepping
-            self.tCoral += self.input.tCarb
-            tODE = np.linspace(self.tNow, self.tCoral, N+1)
-            self.dt = tODE[1]-tODE[0]
-
+                self.core.sealevel[self.layID+1] = self.force.sealevel
+
+        # Store accommodation space and sea-level through time
+        self.coral.storeSea(self.core.topH, self.force.sealevel, self.iter, self.layID)
+
+        # Get sediment input
+        if self.input.sedOn:
+            sedh, sfac = self.force.getSed(self.tNow, self.core.topH)
+            self.core.sedinput[self.layID] = self.force.sedlevel
+        else:
+            sedh = 0.
+
+        # Get flow velocity
+        if self.input.flowOn:
+            ffac = self.force.getFlow(self.tNow, self.core.topH)
+            self.core.waterflow[self.layID] = self.force.flowlevel
+
+        # Get temperature control
+        if self.input.tempOn:
+            tfac = self.force.getTemp(self.tNow)
+            self.core.temperature[self.layID] = self.force.templevel
+
+        # Get pH control
+        if self.input.pHOn:
+            pfac = self.force.getpH(self.tNow)
+            self.core.pH[self.layID] = self.force.pHlevel
+
+        # Get nutrients control
+        if self.input.nutrientOn:
+            nfac = self.force.getNu(self.tNow)
+            self.core.nutrient[self.layID] = self.force.nulevel
+
+        # Limit species activity from environmental forces
+        tmp = np.minimum(dfac, sfac)
+        tmp2 = np.minimum(tfac, tmp)
+        tmp3 = np.minimum(pfac, tmp2)
+        tmp4 = np.minimum(nfac, tmp3)
+        fac = np.minimum(ffac, tmp4)
+        self.coral.epsilon = self.input.malthusParam * fac
+
+        # Define coral evolution time interval and time stepping
+        self.tCoral += self.input.tCarb
+        tODE = np.linspace(self.tNow, self.tCoral, N+1)
+        self.dt = tODE[1]-tODE[0]
+
+        # Skip the ODE integration when communities sit at the GLV fixed point
+        located = False
+        if self.coral.atEquilibrium(self.coral.popNow, fac):
+            population = np.copy(self.coral.popNow).reshape(-1,1)
+        # Locate turn-on, extinction and maximum population events within the time step
+        elif self.input.events:
+            population = self.coral.solveEvents(self.coral.popNow, tODE,
+                                                fac, self.input.facOpt).reshape(-1,1)
+            located = True
+        else:
             # Solve the Generalized Lotka-Volterra equation
-            coral,t = self.odeRKF.solve(tODE)
-            population = coral.T
-            tmppop = np.copy(population[:,-1])
-            tmppop[tmppop>self.input.maxpop] = self.input.maxpop
-            population[:,-1] = tmppop
-
-            # Update coral population
-            self.iter += 1
+            population = self.coral.solveGLV(self.coral.popNow, tODE)
+        tmppop = np.copy(population[:,-1])
+        tmppop[tmppop>self.input.maxpop] = self.input.maxpop
+        population[:,-1] = tmppop
+
+        # Update coral population, environmental extinction and turn-on are already applied
+        # at the beginning of the time step when events are located
+        self.iter += 1
+        if not located:
             ids = np.where(self.coral.epsilon==0.)[0]
+            if self.input.events:
+                for s in ids[population[ids,-1]>0.]:
+                    self.coral.events.append((self.tNow,s,coralGLV.EVENT_EXTINCT))
             population[ids,-1] = 0.
             ids = np.where(np.logical_and(fac>=self.input.facOpt,population[:,-1]==0.))[0]
             population[ids,-1] = 1.
+            if self.input.events:
+                for s in ids:
+                    self.coral.events.append((self.tNow,s,coralGLV.EVENT_TURNON))
+
+        # In case there is no accommodation space
+        if self.core.topH <= 0.:
+            population[:,-1] = 0.
+            ero = -self.input.karstRate*self.input.tCarb
+            if self.core.topH > ero:
+                ero = self.core.topH
+            if self._hooks and ero < 0.:
+                self._notify('karst', -ero)
+        else:
+            ero = 0.
+        self.coral.storePopulation(population[:,-1], self.iter, self.layID)
+
+        # Compute carbonate production and update coral core characteristics
+        self.core.coralProduction(self.layID, self.coral.popNow,
+                                  self.coral.epsilon, sedh, ero, verbose)
+        # Update time step
+        self.tNow = self.tCoral
+
+        # Update stratigraphic layer ID
+        if self.tLayer <= self.tNow :
+            self.tLayer += self.input.laytime
+            self.layID += 1
+            if self._hooks:
+                self._notify('layer', self.layID-1)
+
+        # Check if the core top has drowned below the deepest species habitat, the state is
+        # kept up to date so subscribers attached later only get new drowning events
+        if self.drownDepth is not None:
+            drowned = self.core.topH > self.drownDepth
+            if drowned and not self.drowned:
+                if self.drowningTime is None:
+                    self.drowningTime = self.tNow
+                if self._hooks:
+                    self._notify('drown', self.tNow)
+            self.drowned = drowned
 
-            self.coral.population[:self.input.speciesNb,self.iter] = population[:,-1]
-
-            # In case there is no accommodation space
-            if self.core.topH <= 0.:
-                population[ids,-1] = 0.
-                self.coral.population[:self.input.speciesNb,self.iter] = 0.
-                ero = -self.input.karstRate*self.input.tCarb
-                if self.core.topH > ero:
-                    ero = self.core.topH
-            else:
-                ero = 0.
-
-            # Compute carbonate production and update coral core characteristics
-            self.core.coralProduction(self.layID, self.coral.population[:,self.iter],
-                                      self.coral.epsilon, sedh, ero, verbose)
-            # Update time step
-            self.tNow = self.tCoral
-
-            # Update stratigraphic layer ID
-            if self.tLayer <= self.tNow :
-                self.tLayer += self.input.laytime
-                self.layID += 1
+        return
 
-            #if self._rank == 0 and self.tNow>=timeVerbose:
-            if self.tNow>=timeVerbose:
-                timeVerbose = self.tNow+showtime
-                print 'tNow = %s [yr]' %self.tNow
+    def _update_plot(self):
+        """
+        Update plotting parameters from the simulation records.
+        """
 
-        # Update plotting parameters
         self.plot.pop = self.coral.population
+        self.plot.step = self.coral.layStep
         self.plot.timeCarb = self.coral.iterationTime
         self.plot.mbsl = self.coral.mbsl
         self.plot.depth = self.core.thickness
@@ -272,6 +439,112 @@ class Model(object):
         self.plot.temperature = self.core.temperature
         self.plot.nutrient = self.core.nutrient
         self.plot.accspace = self.coral.accspace
+        self.plot.index = None
+        self.plot.runs = None
+
+        return
+
+    def get_state(self):
+        """
+        Return a copy of the simulation state required to resume the simulation from the
+        current time, including the state of the attached run metrics. Carbonate time step
+        records are not included as completed records are never modified.
+        """
+
+        state = {}
+        for name in MODEL_STATE:
+            state[name] = getattr(self, name)
+        for name in FORCE_STATE:
+            state['force_'+name] = getattr(self.force, name)
+        for name in CORE_STATE:
+            state['core_'+name] = np.copy(getattr(self.core, name))
+        state['coral_lastFac'] = None
+        state['coral_events'] = []
+        state['coral_popNow'] = np.copy(self.input.speciesPopulation)
+        state['coral_popCount'] = None
+        state['coral_accCount'] = None
+        if hasattr(self, 'coral'):
+            state['coral_lastFac'] = self.coral.lastFac
+            state['coral_events'] = list(self.coral.events)
+            state['coral_popNow'] = np.copy(self.coral.popNow)
+            state['coral_popCount'] = np.copy(self.coral.popCount)
+            state['coral_accCount'] = np.copy(self.coral.accCount)
+        if self.metrics is not None:
+            for name, value in self.metrics.get_state().items():
+                state['metrics_'+name] = value
+
+        return state
+
+    def set_state(self, state, records=None):
+        """
+        Restore a simulation state obtained from get_state.
+
+        Parameters
+        ----------
+        variable : state
+            Simulation state.
+
+        variable : records
+            Dictionary of the carbonate time step records (population, accspace and mbsl) of a
+            simulation sharing the same history up to the state time (optional).
+        """
+
+        for name in MODEL_STATE:
+            setattr(self, name, state[name])
+        for name in FORCE_STATE:
+            setattr(self.force, name, state['force_'+name])
+        for name in CORE_STATE:
+            value = state['core_'+name]
+            if np.ndim(value) == 0:
+                setattr(self.core, name, float(value))
+            else:
+                # Layer records might have a different length if the end time changed
+                nb = min(value.shape[-1], getattr(self.core, name).shape[-1])
+                getattr(self.core, name)[...,:nb] = value[...,:nb]
+
+        self.coral = coralGLV.coralGLV(input=self.input)
+        self.coral.lastFac = state['coral_lastFac']
+        self.coral.events.extend(state['coral_events'])
+        self.coral.popNow = np.copy(state['coral_popNow'])
+        if records is not None:
+            nb = min(self.coral.recordNb(self.iter, self.layID), records['population'].shape[1],
+                     self.coral.population.shape[1])
+            if state['coral_popCount'] is not None:
+                self.coral.popCount[:nb] = state['coral_popCount'][:nb]
+                self.coral.accCount[:nb] = state['coral_accCount'][:nb]
+            self.coral.population[:,:nb] = records['population'][:,:nb]
+            self.coral.accspace[:nb] = records['accspace'][:nb]
+            self.coral.mbsl[:nb] = records['mbsl'][:nb]
+
+        metrics = {}
+        for name in state:
+            if name.startswith('metrics_'):
+                metrics[name[8:]] = state[name]
+        if len(metrics) > 0:
+            if self.metrics is None:
+                self.metrics = runMetrics()
+                self.metrics.attach(self)
+            self.metrics.set_state(metrics)
+
+        return
+
+    def save_h5(self, filename, complevel=4):
+        """
+        Save the simulation histories in a chunked and compressed HDF5 file located in the
+        output folder.
+
+        Parameters
+        ----------
+        variable : filename
+            Name of the HDF5 file.
+
+        variable : complevel
+            Gzip compression level.
+        """
+
+        name = self.input.outDir+'/'+filename
+        outputH5.writeH5(name, self.coral, self.core, complevel)
+        print 'Model histories have been saved in',name
 
         return
 
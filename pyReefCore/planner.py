@@ -0,0 +1,214 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore simulation planner.
+
+   The planner validates an XmL configuration without integrating the Lotka-Volterra
+   equations: the input file is parsed, the forcing curves are loaded and each forcing
+   function used by the simulation is evaluated at the start and end times. It also estimates
+   the number of time steps, the cost of the ODE integration and the memory of the arrays
+   preallocated by the model, so that jobs can be scheduled before being run. Example:
+
+       report = pyReefCore.plan('input.xml')
+       if not report['valid']:
+           print report['errors']
+"""
+import os
+import numpy
+
+from pyReefCore import (xmlParser, enviForce)
+from pyReefCore.simulation.gridData import gridData
+
+# Forcing activation flag, curve time attribute and function called by the simulation
+FORCING_PATHS = (('tecOn', 'tectime', 'getTec'), ('seaOn', 'seatime', 'getSea'),
+                 ('sedOn', 'sedtime', 'getSed'), ('flowOn', 'flowtime', 'getFlow'),
+                 ('tempOn', 'temptime', 'getTemp'), ('pHOn', 'pHtime', 'getpH'),
+                 ('nutrientOn', 'nutime', 'getNu'))
+
+# Number of ODE output times per carbonate time step and Fehlberg evaluations per step
+ODE_TIMES = 100
+ODE_STAGES = 6
+
+# Environment shape matrices defined for each community
+SHAPES = (('enviDepth', 'depthshape'), ('enviFlow', 'flowshape'), ('enviSed', 'sedshape'))
+
+
+def _memory(input, force, cellNb=None):
+    """
+    Size in bytes of the arrays preallocated by the model for a given configuration.
+    """
+
+    S = input.speciesNb
+    itemsize = numpy.dtype(input.storageType).itemsize
+    if input.storage == 'layer':
+        recNb = len(numpy.arange(input.tStart, input.tEnd+input.laytime, input.laytime))
+    elif input.storage == 'metrics':
+        recNb = 0
+    else:
+        recNb = len(numpy.arange(input.tStart, input.tEnd+input.tCarb, input.tCarb))
+        if input.storage == 'stride':
+            recNb = len(range(0, recNb, input.storageStride))
+    layNb = int((input.tEnd - input.tStart)/input.laytime)+1
+
+    memory = {}
+    memory['coral records'] = (S+2)*recNb*itemsize + 2*recNb*numpy.dtype(int).itemsize
+    memory['community matrix'] = S*S*8
+    memory['core layer records'] = 0
+    if not input.memmap:
+        memory['core layer records'] = (S+11)*layNb*8
+    memory['environment tables'] = 0
+    for trap in (force.dtrap, force.ftrap, force.strap):
+        memory['environment tables'] += sum(t.nbytes for t in trap)
+    for table in (force.sedTable, force.flowTable):
+        if table is not None:
+            memory['environment tables'] += table.values.nbytes+table.slopes.nbytes
+    memory['forcing curves'] = 0
+    for flag, time, getter in FORCING_PATHS:
+        curve = getattr(force, time)
+        if curve is not None and not isinstance(curve, numpy.memmap):
+            memory['forcing curves'] += 2*curve.nbytes
+    memory['ODE integration'] = (2*(ODE_TIMES+1)+ODE_STAGES)*S*8
+    if cellNb is not None:
+        shapes = gridData.arrayShapes(input, cellNb)
+        memory['platform grid'] = sum(int(numpy.prod(shape)) for shape in shapes.values())*8
+        memory['ODE integration'] *= cellNb
+
+    return memory
+
+
+def plan(xml, bathymetry=None, strict=False):
+    """
+    Validate a pyReefCore XmL configuration and estimate its simulation cost without running
+    it. The returned report is a dictionary of JSON serialisable values:
+        + valid: True if no error has been found
+        + errors, warnings: lists of messages
+        + steps, layers, species, cells, storage: simulation dimensions
+        + rhsEvaluations, flops: nominal cost of the Lotka-Volterra integration assuming one
+          RKF step per ODE output time (equilibrium skipping and adaptive refinement are
+          not accounted for)
+        + memory: bytes per group of preallocated arrays, and peakMemory their sum
+        + disk: bytes of the memory-mapped layer records written in the output folder
+
+    Parameters
+    ----------
+    variable : xml
+        XmL input file name.
+
+    variable : bathymetry
+        Initial platform grid bathymetry or bathymetry file name for platform runs (optional,
+        the bathymetry file of the XmL platform structure is used if defined).
+
+    variable : strict
+        Raise a ValueError listing the errors if the configuration is not valid.
+    """
+
+    report = {'xml': xml, 'valid': False, 'errors': [], 'warnings': []}
+    errors = report['errors']
+    warnings = report['warnings']
+
+    try:
+        input = xmlParser.xmlParser(xml, makeUniqueOutputDir=False)
+    except Exception as err:
+        # Malformed elements (for instance empty numeric values) raise various error types
+        errors.append('XmL input file: %s: %s' %(type(err).__name__, err))
+        return _finish(report, strict)
+
+    # Community structure
+    S = input.speciesNb
+    if input.communityMatrix.shape != (S,S):
+        errors.append('The community matrix shape %s does not match %d communities.'
+                      %(input.communityMatrix.shape, S))
+    for name, tag in SHAPES:
+        shape = getattr(input, name)
+        if shape is None:
+            continue
+        if shape.shape != (S,4):
+            errors.append('The %s matrix has %d rows for %d communities.' %(tag, len(shape), S))
+        elif numpy.any(numpy.diff(shape, axis=1) < 0.):
+            errors.append('The %s trapezoid points need to be ordered as A <= B <= C <= D.' %tag)
+    for flag, name, tag in (('seaOn', 'enviDepth', 'depthshape'), ('flowOn', 'enviFlow', 'flowshape'),
+                            ('sedOn', 'enviSed', 'sedshape')):
+        if getattr(input, flag) and getattr(input, name) is None:
+            warnings.append('No %s is defined: the %s forcing is not applied.' %(tag, flag[:-2]))
+
+    # Forcing curves and functions
+    try:
+        force = enviForce.enviForce(input=input)
+    except Exception as err:
+        errors.append('Forcing conditions: %s: %s' %(type(err).__name__, err))
+        return _finish(report, strict)
+
+    for flag, time, getter in FORCING_PATHS:
+        if not getattr(input, flag):
+            continue
+        curve = getattr(force, time)
+        if curve is not None and (curve[0] > input.tStart or curve[-1] < input.tEnd):
+            errors.append('The %s curve covers [%s, %s] instead of the simulation time [%s, %s].'
+                          %(flag[:-2], curve[0], curve[-1], input.tStart, input.tEnd))
+        if not hasattr(force, getter):
+            errors.append('Forcing function %s is not defined.' %getter)
+            continue
+        try:
+            for t in (input.tStart, input.tEnd):
+                if getter == 'getTec':
+                    force.getTec(t, input.tStart, input.depth0)
+                elif getter in ('getSea', 'getSed', 'getFlow'):
+                    getattr(force, getter)(t, input.depth0)
+                else:
+                    getattr(force, getter)(t)
+        except Exception as err:
+            errors.append('Forcing function %s failed: %s' %(getter, err))
+
+    # Output folder
+    parent = os.path.dirname(os.path.abspath(input.outDir))
+    if not os.access(parent, os.W_OK):
+        errors.append('The output folder %s cannot be created.' %input.outDir)
+
+    # Platform grid
+    cellNb = None
+    if bathymetry is None:
+        bathymetry = input.bathyfile
+    if bathymetry is not None:
+        try:
+            if isinstance(bathymetry, basestring):
+                bathymetry = numpy.loadtxt(bathymetry, ndmin=2)
+            cellNb = numpy.size(bathymetry)
+        except (ValueError, IOError) as err:
+            errors.append('Platform bathymetry: %s' %err)
+
+    # Simulation cost
+    steps = int(round((input.tEnd-input.tStart)/input.tCarb))
+    nnz = numpy.count_nonzero(input.communityMatrix)
+    report['species'] = S
+    report['steps'] = steps
+    report['layers'] = int((input.tEnd-input.tStart)/input.laytime)+1
+    report['cells'] = cellNb if cellNb is not None else 1
+    report['rhsEvaluations'] = steps*ODE_TIMES*ODE_STAGES
+    report['flops'] = report['rhsEvaluations']*(2*nnz+3*S)*report['cells']
+    memory = _memory(input, force, cellNb)
+    report['storage'] = input.storage
+    report['memory'] = memory
+    report['peakMemory'] = sum(memory.values())
+    report['disk'] = 0
+    if input.memmap:
+        report['disk'] = (S+11)*report['layers']*8
+
+    return _finish(report, strict)
+
+
+def _finish(report, strict):
+    """
+    Set the report validity and raise the errors in strict mode.
+    """
+
+    report['valid'] = len(report['errors']) == 0
+    if strict and not report['valid']:
+        raise ValueError('Invalid configuration %s:\n  %s' %(report['xml'], '\n  '.join(report['errors'])))
+
+    return report
@@ -0,0 +1,138 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore structured progress log.
+
+   The progress log subscribes to the model simulation events and writes one JSON record per
+   line with the simulation throughput (simulated years per wall-clock second) and estimated
+   time to completion. Records of concurrent simulations can be told apart by their tag and
+   process identifier. Example:
+
+       log = progressLog('progress.jsonl', tag='run12')
+       log.attach(model)
+       model.run_to_time(tEnd)
+"""
+import os
+import sys
+import json
+import time
+
+
+class progressLog(object):
+    """
+    Model subscriber writing simulation progress as JSON lines.
+    """
+
+    def __init__(self, output=None, interval=5., tag=None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : output
+            Log file name or opened file object (default is the standard error).
+
+        variable : interval
+            Minimum wall-clock time between two progress records in seconds.
+
+        variable : tag
+            Identifier added to each record.
+        """
+
+        self.output = output
+        self.interval = interval
+        self.tag = tag
+        self.stream = None
+
+        return
+
+    def attach(self, model):
+        """
+        Subscribe to the simulation events of a model.
+        """
+
+        if self.output is None:
+            self.stream = sys.stderr
+        elif isinstance(self.output, basestring):
+            self.stream = open(self.output, 'a')
+        else:
+            self.stream = self.output
+
+        self.wall0 = time.time()
+        self.time0 = model.tNow
+        self.nextWall = self.wall0+self.interval
+        self.karst = False
+        model.subscribe('step', self.step)
+        model.subscribe('drown', self.event)
+        model.subscribe('karst', self.event)
+
+        return
+
+    def detach(self, model):
+        """
+        Unsubscribe from the simulation events of a model and write a final record.
+        """
+
+        self._write(model, 'end')
+        model.unsubscribe('step', self.step)
+        model.unsubscribe('drown', self.event)
+        model.unsubscribe('karst', self.event)
+        if isinstance(self.output, basestring):
+            self.stream.close()
+        self.stream = None
+
+        return
+
+    def _write(self, model, event):
+        """
+        Write a progress record.
+        """
+
+        wall = time.time()-self.wall0
+        done = model.tNow-self.time0
+        rate = done/wall if wall > 0. else 0.
+        tEnd = getattr(model, 'tTarget', model.input.tEnd)
+        eta = (tEnd-model.tNow)/rate if rate > 0. else None
+        record = {'event': event,
+                  'pid': os.getpid(),
+                  'time': float(model.tNow),
+                  'progress': done/(tEnd-self.time0) if tEnd > self.time0 else 1.,
+                  'wall': wall,
+                  'rate': rate,
+                  'eta': eta}
+        if self.tag is not None:
+            record['tag'] = self.tag
+        self.stream.write(json.dumps(record)+'\n')
+        self.stream.flush()
+
+        return
+
+    def step(self, model, event, record):
+        """
+        Write a progress record if the logging interval has elapsed.
+        """
+
+        if time.time() >= self.nextWall:
+            self._write(model, 'progress')
+            self.nextWall = time.time()+self.interval
+
+        return
+
+    def event(self, model, event, value):
+        """
+        Write a record for drowning and the first karst erosion of the simulation.
+        """
+
+        if event == 'karst':
+            if self.karst:
+                return
+            self.karst = True
+        self._write(model, event)
+
+        return
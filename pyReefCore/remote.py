@@ -1,76 +1,179 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore simulation service client.
+
+   The RemoteModel class runs simulations on a local simulation service (see the service
+   module) instead of the current process. Example:
+
+       reef = RemoteModel('/tmp/pyreefcore.sock')
+       reef.load_xml('input.xml', seed=0)
+       summary = reef.run_to_time(-2000., progress=lambda record: sys.stdout.write(str(record)))
+       thickness = reef.records['thickness']
+"""
 import os
+import json
+import base64
+import socket
+import numpy as np
 
-from ipyparallel import Client
-
-
-def relog():
-    ''' For debugging, redirect the individual node stdout/stderr to a file '''
-    import os
-    pid = os.getpid()
-    logfile = open('/tmp/model-%s.txt' % pid, 'w')
-    logfile.write('--- I am PID %s\n' % pid)
-
-    import sys
-    sys.stdout = logfile
-    sys.stderr = logfile
+from pyReefCore.simulation.faciesRuns import faciesRuns
 
 
 class RemoteModel(object):
     """
-    Wrapper to allow Model to run on an MPI cluster while hiding most of the
-    MPI details.
+    Client of a local pyReefCore simulation service. The load_xml and run_to_time methods
+    mirror the ones of Model, and the simulation summary, core layer records and run-length
+    encoded dominant facies of the last run are available as the summary, records and facies
+    attributes.
+    """
 
-    The public interface is identical to Model, so you should be able to
-    substitute one for the other as desired..
+    def __init__(self, address):
+        """
+        Constructor.
 
-    We use MPI in a master-slave architecture. This object runs on the master
-    and handles all communication with the slaves. The slaves run the native
-    Model object. In this way, the calling code does not need to be aware of the
-    underlying parallelisation details.
-    """
+        Parameters
+        ----------
+        variable : address
+            Unix socket file name or (host, port) localhost TCP address of the service.
+        """
 
-    # These attributes are exposed on the RemoteModel object; any other
-    # accesses are forwarded to the Model objects running on the remote nodes.
-    REMOTEMODEL_ATTRIBUTES = ('_client', '_view')
-
-    def __init__(self, profile='mpi'):
-        self._client = Client(profile=profile)
-        self._view = self._client[:]
-        self._view.block = True
-
-        self._view.execute('from pyReef.Model.model import Model')
-        self._view.execute('model = Model()')
-
-        # Uncomment this to enable node debug logging to /tmp
-        # self._view.apply(relog)
-
-    def load_xml(self, filename, verbose=False):
-        try:
-            cwd = os.getcwd()
-            self._view.execute('import os')
-            self._view.execute('os.chdir("%s")' % cwd)
-            self._view.execute('model.load_xml(filename="%s", verbose=%s)' % (filename, verbose))
-        except Exception, e:
-            import pdb; pdb.set_trace()
-
-    def run_to_time(self, tEnd):
-        try:
-            self._view.execute('model.run_to_time(%s)' % tEnd)
-        except Exception, e:
-            import pdb; pdb.set_trace()
-
-    def ncpus(self):
-        """Return the number of CPUs used to generate the results."""
-        return len(self._view)
-
-    def __getattr__(self, name):
-        """If we don't define an attribute locally, read its value from node 0"""
-        return self._client[0]['model.%s' % name]
-
-    def __setattr__(self, name, value):
-        """If we don't define an attribute locally, write its value to all nodes"""
-
-        if name in RemoteModel.REMOTEMODEL_ATTRIBUTES:
-            self.__dict__[name] = value
+        if isinstance(address, basestring):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         else:
-            self._view['model.%s' % name] = value
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = tuple(address)
+        self._socket.connect(address)
+        self._file = self._socket.makefile('rb')
+        self._count = 0
+
+        self.filename = None
+        self.seed = None
+        self.summary = None
+        self.records = None
+        self.facies = None
+
+        return
+
+    def _send(self, request):
+        """
+        Send a request and return its id.
+        """
+
+        self._count += 1
+        request['id'] = self._count
+        self._socket.sendall(json.dumps(request)+'\n')
+
+        return self._count
+
+    def _receive(self, id):
+        """
+        Read the service messages of a request until one which is not a progress record.
+        """
+
+        while True:
+            line = self._file.readline()
+            if not line:
+                raise RuntimeError('The simulation service closed the connection.')
+            message = json.loads(line)
+            if message.get('id') == id:
+                return message
+
+    def ping(self):
+        """
+        Check the service and return its process id.
+        """
+
+        return self._receive(self._send({'cmd': 'ping'}))['pid']
+
+    def stats(self):
+        """
+        Number of workers and of submitted, completed, timed out and running requests of the
+        service.
+        """
+
+        return self._receive(self._send({'cmd': 'stats'}))
+
+    def load_xml(self, filename, verbose=False, seed=None):
+        """
+        Define the XmL configuration file of the following runs.
+
+        Parameters
+        ----------
+        variable : filename
+            XmL input file name. Relative paths are resolved in the client working directory.
+
+        variable : seed
+            Random number generator seed.
+        """
+
+        if not os.path.isfile(filename):
+            raise RuntimeError('The XmL input file name cannot be found in your path.')
+        self.filename = os.path.abspath(filename)
+        self.seed = seed
+
+        return
+
+    def run_to_time(self, tEnd=None, showtime=None, progress=None, interval=1.):
+        """
+        Run the simulation to a specified point in time (tEnd) on the service and return its
+        summary. The core layer records are stored as arrays in the records attribute.
+
+        Parameters
+        ----------
+        variable : tEnd
+            Simulation end time (default is the end time of the XmL input file).
+
+        variable : progress
+            Function called with each progress record of the simulation (optional).
+
+        variable : interval
+            Minimum wall-clock time between two progress records in seconds.
+        """
+
+        if self.filename is None:
+            raise RuntimeError('An XmL input file needs to be loaded first.')
+
+        request = {'xml': self.filename, 'tEnd': tEnd, 'seed': self.seed, 'records': True,
+                   'cwd': os.getcwd()}
+        if progress is not None:
+            request['progress'] = interval
+        id = self._send(request)
+
+        while True:
+            message = self._receive(id)
+            event = message.get('event')
+            if event == 'result':
+                break
+            if event == 'error':
+                raise RuntimeError(message['error'])
+            if event != 'accepted' and progress is not None:
+                progress(message)
+
+        summary = message['summary']
+        if summary['status'] != 'ok':
+            raise RuntimeError('Simulation %s failed: %s' %(self.filename, summary.get('error')))
+        self.records = {}
+        for name, values in summary.pop('records', {}).items():
+            self.records[name] = np.array(values)
+        if 'facies' in summary:
+            self.facies = faciesRuns.decode(base64.b64decode(summary['facies']))
+        self.summary = summary
+
+        return summary
+
+    def close(self):
+        """
+        Close the connection to the service.
+        """
+
+        self._file.close()
+        self._socket.close()
+
+        return
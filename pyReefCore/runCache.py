@@ -0,0 +1,254 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore whole-run result cache.
+
+   Simulation results are stored on disk under a key computed from the parsed XmL input,
+   the contents of the forcing files, the requested end time and the random seed. The cache
+   is bounded in size and evicts the least recently used results first.
+"""
+import os
+import glob
+import zipfile
+import hashlib
+import numpy as np
+
+from pyReefCore import coralGLV
+from pyReefCore.model import Model
+from pyReefCore.runMetrics import runMetrics
+
+# Parsed input attributes which do not influence the simulation results
+IGNORED_INPUTS = ('inputfile', 'outDir', 'makeUniqueOutputDir')
+
+# Simulation records stored in the cache
+CORAL_RECORDS = ('population', 'accspace', 'mbsl')
+CORE_RECORDS = ('thickness', 'coralH', 'karstero', 'sealevel', 'sedinput', 'tecrate',
+                'waterflow', 'nutrient', 'temperature', 'pH')
+
+
+def inputHash(input, tEnd, seed):
+    """
+    Canonical hash of a simulation configuration.
+
+    Parameters
+    ----------
+    class: input
+        Input parameter class.
+
+    variable : tEnd
+        Requested simulation end time.
+
+    variable : seed
+        Random number generator seed.
+    """
+
+    sha = hashlib.sha1()
+    for name in sorted(vars(input)):
+        if name in IGNORED_INPUTS:
+            continue
+        value = getattr(input, name)
+        sha.update(name.encode('utf-8'))
+        if isinstance(value, np.ndarray):
+            sha.update(str(value.dtype)+str(value.shape))
+            sha.update(np.ascontiguousarray(value).tobytes())
+        else:
+            sha.update(repr(value))
+        # Forcing files are identified by their contents
+        if name.endswith('file') and value is not None and os.path.isfile(value):
+            with open(value, 'rb') as f:
+                for block in iter(lambda: f.read(1<<20), b''):
+                    sha.update(block)
+    sha.update(repr(float(tEnd)))
+    sha.update(repr(seed))
+
+    return sha.hexdigest()
+
+
+class runCache(object):
+    """
+    Size-bounded on-disk cache of pyReefCore simulation results.
+    """
+
+    def __init__(self, folder, maxsize=1<<30):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : folder
+            Folder containing the cached results.
+
+        variable : maxsize
+            Maximum size of the cache in bytes.
+        """
+
+        self.folder = folder
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        return
+
+    def _filename(self, key):
+
+        return os.path.join(self.folder, key+'.npz')
+
+    def stats(self):
+        """
+        Cache hit and miss statistics.
+        """
+
+        files = glob.glob(os.path.join(self.folder, '*.npz'))
+        total = self.hits+self.misses
+
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': float(self.hits)/total if total > 0 else 0.,
+                'entries': len(files),
+                'size': sum(os.path.getsize(f) for f in files)}
+
+    def _store(self, key, model):
+        """
+        Store simulation records and evict least recently used entries.
+        """
+
+        data = {'tNow': model.tNow, 'iter': model.iter, 'layID': model.layID,
+                'topH': model.core.topH, 'coral_popNow': model.coral.popNow,
+                'drowned': model.drowned,
+                'drowningTime': np.nan if model.drowningTime is None else model.drowningTime}
+        if model.metrics is not None:
+            for name, value in model.metrics.get_state().items():
+                data['metrics_'+name] = value
+        for name in CORAL_RECORDS:
+            data['coral_'+name] = getattr(model.coral, name)
+        for name in CORE_RECORDS:
+            data['core_'+name] = getattr(model.core, name)
+
+        # Write to a temporary file first so concurrent readers never see partial entries, its
+        # suffix keeps it out of the entries considered for eviction
+        fname = self._filename(key)
+        tmpname = fname+'.%d.tmp' %os.getpid()
+        with open(tmpname, 'wb') as f:
+            np.savez(f, **data)
+        os.rename(tmpname, fname)
+
+        self._evict()
+
+        return
+
+    def _evict(self):
+        """
+        Remove least recently used entries until the cache fits its maximum size.
+        """
+
+        files = []
+        for f in glob.glob(os.path.join(self.folder, '*.npz')):
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, f))
+        files.sort()
+        size = sum(f[1] for f in files)
+        for mtime, fsize, fname in files:
+            if size <= self.maxsize:
+                break
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
+            size -= fsize
+
+        return
+
+    def _restore(self, key, model):
+        """
+        Restore cached simulation records in a loaded model.
+        """
+
+        fname = self._filename(key)
+        # Missing, evicted, truncated or stale entries are cache misses
+        try:
+            # Mark the entry as most recently used
+            os.utime(fname, None)
+            with np.load(fname) as entry:
+                data = {}
+                for name in entry.files:
+                    data[name] = entry[name]
+        except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile):
+            return False
+        required = ['tNow', 'iter', 'layID', 'topH', 'coral_popNow', 'drowned', 'drowningTime'] + \
+            ['coral_'+name for name in CORAL_RECORDS] + ['core_'+name for name in CORE_RECORDS]
+        if any(name not in data for name in required):
+            return False
+
+        model.coral = coralGLV.coralGLV(input=model.input)
+        model.coral.popNow = data['coral_popNow']
+        # Records are copied in place to keep memory-mapped core records on disk
+        for name in CORAL_RECORDS:
+            getattr(model.coral, name)[...] = data['coral_'+name]
+        for name in CORE_RECORDS:
+            getattr(model.core, name)[...] = data['core_'+name]
+        model.core.flush()
+        model.core.topH = float(data['topH'])
+        model.tNow = float(data['tNow'])
+        model.tCoral = model.tNow
+        model.iter = int(data['iter'])
+        model.layID = int(data['layID'])
+        model.drowned = bool(data['drowned'])
+        model.drowningTime = None
+        if not np.isnan(data['drowningTime']):
+            model.drowningTime = float(data['drowningTime'])
+        metrics = {}
+        for name in data:
+            if name.startswith('metrics_'):
+                metrics[name[8:]] = data[name]
+        if len(metrics) > 0:
+            model.metrics = runMetrics()
+            model.metrics.attach(model)
+            model.metrics.set_state(metrics)
+        model._update_plot()
+
+        return True
+
+    def run(self, filename, tEnd, seed=0, showtime=10):
+        """
+        Load an XML configuration file and run the simulation to a specified point in time
+        (tEnd), or return the cached results of an identical configuration.
+
+        Parameters
+        ----------
+        variable : filename
+            XmL input file name.
+
+        variable : tEnd
+            Requested simulation end time.
+
+        variable : seed
+            Random number generator seed.
+
+        variable : showtime
+            Display interval of the simulation time.
+        """
+
+        model = Model()
+        model.load_xml(filename, seed=seed)
+        key = inputHash(model.input, tEnd, seed)
+
+        if self._restore(key, model):
+            self.hits += 1
+            return model
+
+        self.misses += 1
+        model.run_to_time(tEnd, showtime=showtime)
+        self._store(key, model)
+
+        return model
@@ -0,0 +1,197 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore streaming run metrics.
+
+   The run metrics subscribe to the model simulation events and update summary values at each
+   carbonate time step with a cost independent of the simulation length: drowning time,
+   aggradation, mean accretion rate of each community, number of facies transitions, turn-on
+   time of each community and karst-eroded thickness. The run-length encoded dominant facies
+   of the core are built at the same time (metrics.facies). With the metrics storage mode of
+   the XmL input file the model attaches them automatically (model.metrics) and does not
+   store the carbonate time step histories. Example:
+
+       metrics = runMetrics()
+       metrics.attach(model)
+       model.run_to_time(tEnd)
+       print metrics.summary(model)
+"""
+import numpy
+
+from pyReefCore.simulation.faciesRuns import faciesRuns
+
+# Attributes of the facies runs saved in the metrics state
+FACIES_STATE = ('facies', 'first', 'last', 'start', 'end', 'amounts')
+
+
+class runMetrics(object):
+    """
+    Model subscriber computing streaming summary metrics of a simulation.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+
+        self.model = None
+
+        return
+
+    def attach(self, model):
+        """
+        Subscribe to the simulation events of a model. Metrics are accumulated from the
+        current simulation time.
+        """
+
+        S = model.input.speciesNb
+        self.time0 = float(model.tNow)
+        self.time = self.time0
+        self.steps = 0
+        self.drownDepth = model.drownDepth
+        self.drowningTime = None
+        self.deposited = numpy.zeros(S+1)
+        self.karstEroded = 0.
+        self.turnOn = numpy.full(S, numpy.nan)
+        # Dominant facies runs of the completed layers
+        self.facies = faciesRuns(S+1)
+        self.model = model
+        model.subscribe('step', self.step)
+        model.subscribe('layer', self.layer)
+
+        return
+
+    def detach(self, model):
+        """
+        Unsubscribe from the simulation events of a model.
+        """
+
+        model.unsubscribe('step', self.step)
+        model.unsubscribe('layer', self.layer)
+        self.model = None
+
+        return
+
+    def get_state(self):
+        """
+        Return a copy of the metrics state as a dictionary of numpy arrays, used to resume
+        the metrics of a simulation (see Model.get_state).
+        """
+
+        state = {'time0': self.time0, 'time': self.time, 'steps': self.steps,
+                 'drowningTime': numpy.nan if self.drowningTime is None else self.drowningTime,
+                 'deposited': numpy.copy(self.deposited), 'karstEroded': self.karstEroded,
+                 'turnOn': numpy.copy(self.turnOn)}
+        for name in FACIES_STATE:
+            state['facies_'+name] = numpy.array(getattr(self.facies, name))
+
+        return state
+
+    def set_state(self, state):
+        """
+        Restore a metrics state obtained from get_state.
+
+        Parameters
+        ----------
+        variable : state
+            Metrics state.
+        """
+
+        self.time0 = float(state['time0'])
+        self.time = float(state['time'])
+        self.steps = int(state['steps'])
+        self.drowningTime = None
+        if not numpy.isnan(state['drowningTime']):
+            self.drowningTime = float(state['drowningTime'])
+        self.deposited = numpy.copy(state['deposited'])
+        self.karstEroded = float(state['karstEroded'])
+        self.turnOn = numpy.copy(state['turnOn'])
+        self.facies = faciesRuns(len(self.deposited))
+        for name in FACIES_STATE[:-1]:
+            setattr(self.facies, name, numpy.asarray(state['facies_'+name]).tolist())
+        amounts = numpy.reshape(state['facies_amounts'], (-1, len(self.deposited)))
+        self.facies.amounts = list(numpy.array(amounts, dtype=float))
+
+        return
+
+    def step(self, model, event, record):
+        """
+        Update the metrics after a carbonate time step.
+        """
+
+        self.time = float(record.time)
+        self.steps += 1
+        self.deposited += model.core.stepH
+        self.karstEroded += model.core.stepEro
+        if model.core.stepEro > 0.:
+            self.facies.erode(model.core)
+        if self.drowningTime is None and self.drownDepth is not None and \
+                model.core.topH > self.drownDepth:
+            self.drowningTime = self.time
+        on = numpy.isnan(self.turnOn)
+        if on.any():
+            on &= record.population > 0.
+            self.turnOn[on] = self.time
+
+        return
+
+    def layer(self, model, event, layID):
+        """
+        Update the dominant facies runs when a layer is completed.
+        """
+
+        self.facies.close(model.core, layID)
+
+        return
+
+    def summary(self, model=None):
+        """
+        Return the metrics as a dictionary of JSON serialisable values:
+            + time, steps: simulation time and number of carbonate time steps
+            + drowningTime: first time the core top is deeper than the deepest species habitat
+            + deposited, karstEroded, aggradation: deposited thickness, thickness removed by
+              karstification and their difference [m]
+            + communityThickness, sediment: thickness deposited by each community and by
+              siliciclastic sediment [m]
+            + accretionRate: mean accretion rate of each community [m/y]
+            + faciesTransitions: number of changes of the dominant facies between consecutive
+              non-empty layers of the core
+            + turnOn, firstTurnOn: first time each community has a positive population and the
+              earliest of these times
+
+        Parameters
+        ----------
+        variable : model
+            Model whose current (incomplete) layer is included in the facies transitions
+            (default is the attached model).
+        """
+
+        if model is None:
+            model = self.model
+        runs = self.facies
+        if model is not None:
+            runs = self.facies.snapshot(model.core, model.layID)
+
+        S = len(self.turnOn)
+        span = self.time-self.time0
+        turnOn = [None if numpy.isnan(t) else float(t) for t in self.turnOn]
+        times = [t for t in turnOn if t is not None]
+
+        return {'time': self.time,
+                'steps': self.steps,
+                'drowningTime': self.drowningTime,
+                'deposited': float(self.deposited.sum()),
+                'karstEroded': float(self.karstEroded),
+                'aggradation': float(self.deposited.sum()-self.karstEroded),
+                'communityThickness': self.deposited[:S].tolist(),
+                'sediment': float(self.deposited[S]),
+                'accretionRate': (self.deposited[:S]/span if span > 0. else 0.*self.deposited[:S]).tolist(),
+                'faciesTransitions': runs.transitions(),
+                'turnOn': turnOn,
+                'firstTurnOn': min(times) if len(times) > 0 else None}
@@ -0,0 +1,493 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore global sensitivity analysis.
+
+   Parameters are named by their XmL path (see forcing.xmlParser.xmlVariant) and varied
+   uniformly between bounds. Saltelli designs give the first-order and total Sobol indices
+   of each output and Morris designs the mean absolute elementary effects. Samples are added
+   until the indices stabilise. Any function mapping an (n, d) array of parameter values to an
+   (n, m) array of outputs can be analysed, and xmlRunner evaluates the model itself on a
+   pool of processes. Example:
+
+       parameters = [('habitats/depth', 10., 30.), ('habitats/facOpt', 0.1, 0.6),
+                     ('habitats/community[1]/malthus', 0.002, 0.006),
+                     ('envishape/depthshape/dvalue[@row="0"][@col="2"]', 4., 8.)]
+       runner = xmlRunner('input.xml', parameters, outputs=('thickness', 'composition'),
+                          workers=8)
+       result = sobolAnalysis(runner, parameters, N=64, maxN=2048, tol=0.02)
+       print formatIndices(result)
+"""
+import os
+import shutil
+import tempfile
+import warnings
+import numpy as np
+import xml.etree.ElementTree as ET
+
+from pyReefCore.forcing.xmlParser import xmlVariant
+
+
+def _bounds(parameters):
+    """
+    Lower and upper bounds of the parameters given as (path, low, high) tuples.
+    """
+
+    bounds = np.array([[p[1], p[2]] for p in parameters], dtype=float)
+    if np.any(bounds[:,1] < bounds[:,0]):
+        raise ValueError('Parameter upper bounds need to be greater than lower bounds.')
+
+    return bounds
+
+
+def _sampleOutputs(summary, outputs):
+    """
+    Labels and values of the requested outputs of a simulation summary with layer records.
+    """
+
+    if summary['status'] != 'ok':
+        raise RuntimeError('Simulation %s failed: %s' %(summary['xml'], summary.get('error')))
+
+    records = summary['records']
+    labels = []
+    values = []
+    for name in outputs:
+        if name == 'composition':
+            coralH = np.array(records['coralH']).sum(axis=1)
+            total = coralH.sum()
+            labels += ['composition[%d]' %k for k in range(len(coralH))]
+            values += list(coralH/total if total > 0. else np.zeros(len(coralH)))
+        elif name in records:
+            record = np.array(records[name])
+            if record.ndim == 2:
+                labels += ['%s[%d]' %(name, k) for k in range(len(record))]
+                values += list(record.sum(axis=1))
+            else:
+                labels.append(name)
+                values.append(record.sum())
+        elif name in summary:
+            labels.append(name)
+            values.append(np.nan if summary[name] is None else float(summary[name]))
+        else:
+            raise ValueError('Unknown sensitivity output %s.' %name)
+
+    return labels, values
+
+
+def _runSample(job):
+    """
+    Pool worker running the simulation of one parameter sample in a temporary folder.
+    """
+
+    from pyReefCore.cli import runSummary
+
+    template, paths, sample, outputs, tEnd, seed, outfolder = job
+    folder = tempfile.mkdtemp(prefix='pyreefcore-')
+    cwd = os.getcwd()
+    try:
+        xml = os.path.join(folder, 'sample.xml')
+        values = dict(zip(paths, [float(x) for x in sample]))
+        if outfolder:
+            values['outfolder'] = os.path.join(folder, 'out')
+        xmlVariant(template, values, xml)
+        os.chdir(folder)
+        summary = runSummary(xml, tEnd, seed, quiet=True, records=True)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return _sampleOutputs(summary, outputs)
+
+
+class xmlRunner(object):
+    """
+    Evaluate pyReefCore outputs for arrays of parameter samples. Each sample is a variant of
+    an XmL input file run in a temporary folder.
+    """
+
+    def __init__(self, template, parameters, outputs=('thickness', 'composition'), tEnd=None,
+                 seed=0, workers=1):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : template
+            XmL input file name.
+
+        variable : parameters
+            List of (path, low, high) parameter definitions.
+
+        variable : outputs
+            Names of the outputs: 'composition' (proportion of the core thickness of each
+            community), a core layer record name (summed over the layers, per community for
+            coralH) or a run summary field (e.g. 'thickness' or 'drowningTime').
+
+        variable : tEnd
+            Simulation end time (default is the end time of the XmL input file).
+
+        variable : seed
+            Random number generator seed of the simulations.
+
+        variable : workers
+            Number of simulations run in parallel.
+        """
+
+        self.template = os.path.abspath(template)
+        self.paths = [p[0] for p in parameters]
+        self.outputs = tuple(outputs)
+        self.tEnd = tEnd
+        self.seed = seed
+        self.workers = workers
+        self.labels = None
+        self.runs = 0
+
+        # Output folders of the samples are created in their temporary folder
+        self.outfolder = ET.parse(template).getroot().find('outfolder') is not None
+
+        return
+
+    def __call__(self, X):
+        """
+        Run the simulations of an (n, d) array of parameter samples and return the (n, m)
+        array of outputs.
+        """
+
+        jobs = [(self.template, self.paths, sample, self.outputs, self.tEnd, self.seed,
+                 self.outfolder) for sample in np.atleast_2d(X)]
+        if self.workers > 1 and len(jobs) > 1:
+            import multiprocessing as mp
+            pool = mp.Pool(min(self.workers, len(jobs)))
+            try:
+                results = pool.map(_runSample, jobs, chunksize=max(1, len(jobs)//(4*self.workers)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_runSample(job) for job in jobs]
+
+        self.labels = results[0][0]
+        self.runs += len(jobs)
+
+        return np.array([values for labels, values in results], dtype=float)
+
+
+def saltelliDesign(parameters, N, seed=None):
+    """
+    Saltelli design of N base samples: returns the A and B sample matrices (N, d) and the
+    (d, N, d) AB matrices where column i of A is taken from B.
+
+    Parameters
+    ----------
+    variable : parameters
+        List of (path, low, high) parameter definitions.
+
+    variable : N
+        Number of base samples.
+
+    variable : seed
+        Random number generator seed or RandomState.
+    """
+
+    bounds = _bounds(parameters)
+    rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+    d = len(bounds)
+    A = bounds[:,0] + rng.rand(N, d)*(bounds[:,1]-bounds[:,0])
+    B = bounds[:,0] + rng.rand(N, d)*(bounds[:,1]-bounds[:,0])
+    AB = np.repeat(A[np.newaxis], d, axis=0)
+    for i in range(d):
+        AB[i,:,i] = B[:,i]
+
+    return A, B, AB
+
+
+def sobolIndices(fA, fB, fAB, bootstrap=100, seed=None):
+    """
+    First-order (Saltelli 2010) and total (Jansen) Sobol indices with bootstrap 95% confidence
+    half-widths. Returns S1, ST, S1conf and STconf arrays of shape (d, m).
+
+    Parameters
+    ----------
+    variable : fA, fB
+        Outputs (N, m) of the A and B sample matrices.
+
+    variable : fAB
+        Outputs (d, N, m) of the AB sample matrices.
+
+    variable : bootstrap
+        Number of bootstrap resamples of the confidence intervals.
+
+    variable : seed
+        Random number generator seed or RandomState.
+    """
+
+    def estimate(idx):
+        A = fA[idx]
+        B = fB[idx]
+        AB = fAB[:,idx]
+        var = np.var(np.concatenate((A, B)), axis=0)
+        var[var == 0.] = np.nan
+        S1 = np.mean(B*(AB-A), axis=1)/var
+        ST = 0.5*np.mean((A-AB)**2, axis=1)/var
+        return S1, ST
+
+    N = len(fA)
+    S1, ST = estimate(np.arange(N))
+    S1conf = np.zeros(S1.shape)
+    STconf = np.zeros(ST.shape)
+    if bootstrap > 0:
+        rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+        samples = [estimate(rng.randint(N, size=N)) for k in range(bootstrap)]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            S1conf = 1.96*np.nanstd([s[0] for s in samples], axis=0)
+            STconf = 1.96*np.nanstd([s[1] for s in samples], axis=0)
+
+    return S1, ST, S1conf, STconf
+
+
+def sobolAnalysis(func, parameters, N=64, maxN=4096, tol=0.02, bootstrap=100, seed=0):
+    """
+    Sobol sensitivity analysis. Saltelli samples are added until the first-order and total
+    indices change by less than tol between two iterations, the number of base samples being
+    doubled at each iteration. The model is run N*(d+2) times per N base samples.
+
+    Parameters
+    ----------
+    variable : func
+        Function mapping an (n, d) array of parameter values to an (n, m) array of outputs
+        (for instance an xmlRunner).
+
+    variable : parameters
+        List of (path, low, high) parameter definitions.
+
+    variable : N
+        Initial number of base samples.
+
+    variable : maxN
+        Maximum number of base samples.
+
+    variable : tol
+        Convergence tolerance on the indices.
+
+    variable : bootstrap
+        Number of bootstrap resamples of the confidence intervals.
+
+    variable : seed
+        Random number generator seed.
+    """
+
+    rng = np.random.RandomState(seed)
+    d = len(parameters)
+    fA = fB = fAB = None
+    history = []
+    n = N
+    while True:
+        A, B, AB = saltelliDesign(parameters, n, rng)
+        Y = np.asarray(func(np.concatenate([A, B]+list(AB))), dtype=float)
+        Y = Y.reshape(n*(d+2), -1)
+        yA, yB, yAB = Y[:n], Y[n:2*n], Y[2*n:].reshape(d, n, -1)
+        if fA is None:
+            fA, fB, fAB = yA, yB, yAB
+        else:
+            fA = np.concatenate((fA, yA))
+            fB = np.concatenate((fB, yB))
+            fAB = np.concatenate((fAB, yAB), axis=1)
+
+        S1, ST, S1conf, STconf = sobolIndices(fA, fB, fAB, bootstrap, rng)
+        change = None
+        if len(history) > 0:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                change = float(np.nanmax(np.abs(np.concatenate((S1-history[-1]['S1'],
+                                                                ST-history[-1]['ST'])))))
+        history.append({'N': len(fA), 'S1': S1, 'ST': ST, 'change': change})
+        converged = change is not None and change < tol
+        if converged or 2*len(fA) > maxN:
+            break
+        n = len(fA)
+
+    return {'method': 'sobol', 'parameters': [p[0] for p in parameters],
+            'outputs': _labels(func, fA.shape[1]), 'S1': S1, 'ST': ST, 'S1conf': S1conf,
+            'STconf': STconf, 'N': len(fA), 'runs': len(fA)*(d+2), 'converged': converged,
+            'history': history}
+
+
+def morrisDesign(parameters, r, levels=4, seed=None):
+    """
+    Morris design of r one-at-a-time trajectories on a grid of levels: returns an
+    (r*(d+1), d) array of parameter values.
+
+    Parameters
+    ----------
+    variable : parameters
+        List of (path, low, high) parameter definitions.
+
+    variable : r
+        Number of trajectories.
+
+    variable : levels
+        Number of grid levels (even).
+
+    variable : seed
+        Random number generator seed or RandomState.
+    """
+
+    bounds = _bounds(parameters)
+    rng = seed if isinstance(seed, np.random.RandomState) else np.random.RandomState(seed)
+    d = len(bounds)
+    delta = levels/(2.*(levels-1))
+    X = np.zeros((r, d+1, d))
+    for t in range(r):
+        x = rng.randint(levels, size=d)/float(levels-1)
+        step = np.where(x+delta <= 1., delta, -delta)
+        X[t,0] = x
+        for j, i in enumerate(rng.permutation(d)):
+            x = x.copy()
+            x[i] += step[i]
+            X[t,j+1] = x
+
+    return (bounds[:,0] + X*(bounds[:,1]-bounds[:,0])).reshape(r*(d+1), d)
+
+
+def morrisIndices(parameters, X, Y):
+    """
+    Morris elementary effects statistics: returns the mean (mu), mean absolute (muStar) and
+    standard deviation (sigma) of the elementary effects as arrays of shape (d, m). Effects
+    are computed on the parameter ranges scaled to [0, 1].
+
+    Parameters
+    ----------
+    variable : parameters
+        List of (path, low, high) parameter definitions.
+
+    variable : X
+        Morris design (r*(d+1), d).
+
+    variable : Y
+        Outputs (r*(d+1), m) of the design.
+    """
+
+    bounds = _bounds(parameters)
+    d = len(bounds)
+    scale = np.where(bounds[:,1] > bounds[:,0], bounds[:,1]-bounds[:,0], 1.)
+    U = ((X-bounds[:,0])/scale).reshape(-1, d+1, d)
+    Y = np.asarray(Y, dtype=float).reshape(len(U), d+1, -1)
+    dU = np.diff(U, axis=1)
+    dY = np.diff(Y, axis=1)
+    i = np.argmax(np.abs(dU), axis=2)
+    t = np.arange(len(U))[:,np.newaxis]
+    EE = np.zeros((len(U), d, Y.shape[2]))
+    EE[t, i] = dY/dU[t, np.arange(d)[np.newaxis], i][:,:,np.newaxis]
+
+    return EE.mean(axis=0), np.abs(EE).mean(axis=0), EE.std(axis=0)
+
+
+def morrisAnalysis(func, parameters, r=10, maxR=200, levels=4, tol=0.05, seed=0):
+    """
+    Morris screening. Batches of r trajectories are added until the mean absolute elementary
+    effects, normalised by their largest value per output, change by less than tol. The model
+    is run r*(d+1) times per batch.
+
+    Parameters
+    ----------
+    variable : func
+        Function mapping an (n, d) array of parameter values to an (n, m) array of outputs
+        (for instance an xmlRunner).
+
+    variable : parameters
+        List of (path, low, high) parameter definitions.
+
+    variable : r
+        Number of trajectories per batch.
+
+    variable : maxR
+        Maximum number of trajectories.
+
+    variable : levels
+        Number of grid levels (even).
+
+    variable : tol
+        Convergence tolerance on the normalised mean absolute effects.
+
+    variable : seed
+        Random number generator seed.
+    """
+
+    rng = np.random.RandomState(seed)
+    d = len(parameters)
+    X = np.zeros((0, d))
+    Y = None
+    history = []
+    while True:
+        Xb = morrisDesign(parameters, r, levels, rng)
+        Yb = np.asarray(func(Xb), dtype=float).reshape(len(Xb), -1)
+        X = np.concatenate((X, Xb))
+        Y = Yb if Y is None else np.concatenate((Y, Yb))
+
+        mu, muStar, sigma = morrisIndices(parameters, X, Y)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            top = np.nanmax(muStar, axis=0)
+            norm = muStar/np.where(top > 0., top, 1.)
+            change = None
+            if len(history) > 0:
+                change = float(np.nanmax(np.abs(norm-history[-1]['norm'])))
+        history.append({'r': len(X)//(d+1), 'muStar': muStar, 'norm': norm, 'change': change})
+        converged = change is not None and change < tol
+        if converged or len(X)//(d+1)+r > maxR:
+            break
+
+    return {'method': 'morris', 'parameters': [p[0] for p in parameters],
+            'outputs': _labels(func, Y.shape[1]), 'mu': mu, 'muStar': muStar, 'sigma': sigma,
+            'r': len(X)//(d+1), 'runs': len(X), 'converged': converged, 'history': history}
+
+
+def _labels(func, m):
+    """
+    Output labels of an evaluation function.
+    """
+
+    labels = getattr(func, 'labels', None)
+    if labels is None or len(labels) != m:
+        labels = ['y%d' %k for k in range(m)]
+
+    return list(labels)
+
+
+def formatIndices(result, output=None):
+    """
+    Format the indices of a Sobol or Morris analysis as a text table, parameters being ranked
+    by decreasing total index (or mean absolute effect) of each output.
+
+    Parameters
+    ----------
+    variable : result
+        Dictionary returned by sobolAnalysis or morrisAnalysis.
+
+    variable : output
+        Output label (default is all outputs).
+    """
+
+    sobol = result['method'] == 'sobol'
+    columns = ('S1', 'S1conf', 'ST', 'STconf') if sobol else ('mu', 'muStar', 'sigma')
+    width = max(len(p) for p in result['parameters'])
+    lines = ['%s analysis: %d runs, converged: %s' %(result['method'], result['runs'],
+                                                    result['converged'])]
+    for k, label in enumerate(result['outputs']):
+        if output is not None and label != output:
+            continue
+        lines.append('')
+        lines.append('%-*s' %(width, label)+''.join('%11s' %c for c in columns))
+        rank = result['ST' if sobol else 'muStar'][:,k]
+        for i in np.argsort(-np.nan_to_num(rank)):
+            lines.append('%-*s' %(width, result['parameters'][i]) +
+                         ''.join('%11.4f' %result[c][i,k] for c in columns))
+
+    return '\n'.join(lines)
@@ -0,0 +1,409 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore local simulation service.
+
+   The service keeps a pool of worker processes which have already imported the model and
+   which keep the forcing curves they have read in memory. Simulation requests are accepted
+   on a Unix socket or a localhost TCP port and queued on the pool. The protocol is made of
+   JSON lines: each request is a JSON object on one line and the service answers with JSON
+   lines tagged with the request id:
+
+       {"id": 1, "xml": "input.xml", "tEnd": -2000., "seed": 0, "progress": 1.}
+       {"id": 1, "event": "accepted"}
+       {"id": 1, "event": "progress", "time": -7900.0, "progress": 0.091, "eta": 3.2, ...}
+       {"id": 1, "event": "end", "time": -2000.0, "progress": 1.0, ...}
+       {"id": 1, "event": "result", "summary": {"status": "ok", "thickness": 9.27, ...}}
+
+   Progress records are the ones of the progressLog class and are only sent if the request
+   defines a progress interval in seconds. The result is always the last message of a request.
+
+   Request ids are strings or integers. Requests not completed within their "timeout" in
+   seconds (default is the service timeout) get an error message instead of their result,
+   for instance when a pool worker died. Requests with "cmd": "ping" or "cmd": "stats" query
+   the service. Example:
+
+       python -m pyReefCore.service --socket /tmp/pyreefcore.sock --workers 4
+"""
+import os
+import sys
+import json
+import time
+import Queue
+import socket
+import argparse
+import threading
+import SocketServer
+import multiprocessing as mp
+
+# Messages sent by the pool workers to the service
+_messages = None
+
+# Default maximum duration of a simulation request in seconds
+REQUEST_TIMEOUT = 3600.
+
+# Interval between two checks of the timed out requests in seconds
+EXPIRE_INTERVAL = 1.
+
+
+class _queueStream(object):
+    """
+    File-like object sending the progress records of a request to the service.
+    """
+
+    def __init__(self, id):
+
+        self.id = id
+
+        return
+
+    def write(self, line):
+
+        _messages.put((self.id, 'progress', json.loads(line)))
+
+        return
+
+    def flush(self):
+
+        return
+
+
+def _warmWorker(messages):
+    """
+    Pool worker initialisation: import the model and the text curve reader and cache the
+    forcing curves.
+    """
+
+    global _messages
+    _messages = messages
+
+    import pandas
+    from pyReefCore.model import Model
+    from pyReefCore.forcing import enviForce
+    enviForce.cacheCurves(True)
+
+    return
+
+
+def _runRequest(request):
+    """
+    Run a simulation request in a pool worker.
+    """
+
+    from pyReefCore.cli import runSummary
+    from pyReefCore.progressLog import progressLog
+
+    log = None
+    if request.get('progress') is not None:
+        log = progressLog(_queueStream(request.get('id')), interval=float(request['progress']))
+
+    cwd = os.getcwd()
+    try:
+        if request.get('cwd') is not None:
+            os.chdir(request['cwd'])
+        summary = runSummary(request['xml'], request.get('tEnd'), request.get('seed'),
+                             quiet=True, log=log, records=request.get('records', False))
+    except Exception as err:
+        summary = {'xml': request['xml'], 'status': 'error',
+                   'error': '%s: %s' %(type(err).__name__, err)}
+    finally:
+        os.chdir(cwd)
+
+    # The result follows the progress records of the request in the message queue
+    _messages.put((request['id'], 'result', summary))
+
+    return
+
+
+class _requestHandler(SocketServer.StreamRequestHandler):
+    """
+    Connection handler reading JSON line requests.
+    """
+
+    def handle(self):
+
+        self.lock = threading.Lock()
+        pending = []
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                self.send({'event': 'error', 'error': 'Invalid JSON request.'})
+                continue
+            if not isinstance(request, dict):
+                self.send({'event': 'error', 'error': 'Requests need to be JSON objects.'})
+                continue
+            id = request.get('id')
+            if id is not None and (isinstance(id, bool) or not isinstance(id, (basestring, int, long))):
+                self.send({'event': 'error', 'error': 'Request ids need to be strings or integers.'})
+                continue
+            cmd = request.get('cmd', 'run')
+            if cmd == 'ping':
+                self.send({'id': request.get('id'), 'event': 'pong', 'pid': os.getpid()})
+            elif cmd == 'stats':
+                self.send(dict(self.server.service.stats(), id=request.get('id'), event='stats'))
+            elif cmd == 'run' and request.get('xml') is not None:
+                timeout = request.get('timeout', self.server.service.timeout)
+                if isinstance(timeout, bool) or not isinstance(timeout, (int, long, float)) or timeout <= 0:
+                    self.send({'id': id, 'event': 'error',
+                               'error': 'Request timeout needs to be a positive number of seconds.'})
+                    continue
+                self.send({'id': id, 'event': 'accepted'})
+                pending.append((self.server.service.submit(request, self, timeout), timeout))
+            else:
+                self.send({'id': request.get('id'), 'event': 'error',
+                           'error': 'Unknown request: %s' %cmd})
+
+        # Wait for the requests of the connection before closing it, timed out requests are
+        # answered by the service
+        for done, timeout in pending:
+            done.wait(timeout+2.*EXPIRE_INTERVAL)
+
+        return
+
+    def send(self, message):
+        """
+        Write a JSON line message to the client.
+        """
+
+        self.sendLine(json.dumps(message))
+
+        return
+
+    def sendLine(self, line):
+        """
+        Write a line to the client, ignoring closed connections.
+        """
+
+        with self.lock:
+            try:
+                self.wfile.write(line.rstrip('\n')+'\n')
+                self.wfile.flush()
+            except (socket.error, ValueError):
+                pass
+
+        return
+
+
+class _unixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+
+class _tcpServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class simulationService(object):
+    """
+    Local service running pyReefCore simulations on a pool of warm worker processes.
+    """
+
+    def __init__(self, address, workers=None, timeout=REQUEST_TIMEOUT):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : address
+            Unix socket file name or (host, port) localhost TCP address.
+
+        variable : workers
+            Number of worker processes (default is the number of CPUs).
+
+        variable : timeout
+            Default maximum duration of a simulation request in seconds.
+        """
+
+        if not isinstance(address, basestring) and address[0] not in ('localhost', '127.0.0.1', '::1'):
+            raise ValueError('The simulation service only listens on localhost.')
+        if workers is None:
+            workers = mp.cpu_count()
+        self.address = address
+        self.workers = workers
+        self.timeout = timeout
+        self.submitted = 0
+        self.completed = 0
+        self.timedOut = 0
+        self.clients = {}
+        self.lock = threading.Lock()
+
+        # The pool is created before any thread is started
+        self.messages = mp.Queue()
+        self.pool = mp.Pool(workers, initializer=_warmWorker, initargs=(self.messages,))
+
+        if isinstance(address, basestring):
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = _unixServer(address, _requestHandler)
+        else:
+            self.server = _tcpServer(tuple(address), _requestHandler)
+            self.address = self.server.server_address
+        self.server.service = self
+
+        self.relay = threading.Thread(target=self._relay)
+        self.relay.daemon = True
+        self.relay.start()
+        self.thread = None
+
+        return
+
+    def _relay(self):
+        """
+        Forward the progress records and results of the workers to their clients.
+        """
+
+        while True:
+            try:
+                message = self.messages.get(timeout=EXPIRE_INTERVAL)
+            except Queue.Empty:
+                self._expire()
+                continue
+            if message is None:
+                return
+            self._expire()
+            key, kind, payload = message
+            with self.lock:
+                # Messages of timed out requests are dropped
+                if key not in self.clients:
+                    continue
+                client, done, deadline = self.clients[key]
+                if kind == 'result':
+                    del self.clients[key]
+                    self.completed += 1
+            if kind == 'result':
+                client.send({'id': key[1], 'event': 'result', 'summary': payload})
+                done.set()
+            else:
+                client.send(dict(payload, id=key[1]))
+
+    def _expire(self):
+        """
+        Answer the requests which are not completed within their timeout with an error.
+        """
+
+        now = time.time()
+        expired = []
+        with self.lock:
+            for key, (client, done, deadline) in self.clients.items():
+                if deadline < now:
+                    expired.append((key, client, done))
+                    del self.clients[key]
+                    self.timedOut += 1
+        for key, client, done in expired:
+            client.send({'id': key[1], 'event': 'error',
+                         'error': 'Simulation request timed out or its worker stopped.'})
+            done.set()
+
+        return
+
+    def submit(self, request, client, timeout=None):
+        """
+        Queue a simulation request on the worker pool. Returns an event set once the result,
+        or an error if the request times out, has been sent to the client.
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+        done = threading.Event()
+        with self.lock:
+            self.submitted += 1
+            key = (self.submitted, request.get('id'))
+            self.clients[key] = (client, done, time.time()+timeout)
+        job = dict(request)
+        job['id'] = key
+        self.pool.apply_async(_runRequest, (job,))
+
+        return done
+
+    def stats(self):
+        """
+        Number of workers and of submitted, completed, timed out and running requests.
+        """
+
+        with self.lock:
+            return {'workers': self.workers, 'submitted': self.submitted,
+                    'completed': self.completed, 'timedOut': self.timedOut,
+                    'running': self.submitted-self.completed-self.timedOut}
+
+    def serve_forever(self):
+        """
+        Accept requests until the service is shut down.
+        """
+
+        self.server.serve_forever()
+
+        return
+
+    def start(self):
+        """
+        Accept requests in a background thread.
+        """
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        return
+
+    def shutdown(self):
+        """
+        Stop accepting requests, terminate the workers and remove the Unix socket.
+        """
+
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread.join()
+        self.server.server_close()
+        self.pool.terminate()
+        self.pool.join()
+        self.messages.put(None)
+        if isinstance(self.address, basestring) and os.path.exists(self.address):
+            os.remove(self.address)
+
+        return
+
+
+def main(args=None):
+    """
+    Command line entry point.
+    """
+
+    parser = argparse.ArgumentParser(description='Run a local pyReefCore simulation service.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--socket', default=None, help='Unix socket file name')
+    group.add_argument('--port', type=int, default=None, help='localhost TCP port')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes (default is the number of CPUs)')
+    parser.add_argument('--timeout', type=float, default=REQUEST_TIMEOUT,
+                        help='default maximum duration of a request in seconds (default: %(default)s)')
+    opts = parser.parse_args(args)
+
+    address = opts.socket
+    if address is None:
+        address = ('127.0.0.1', opts.port)
+    service = simulationService(address, opts.workers, opts.timeout)
+    print >> sys.stderr, 'pyReefCore service listening on %s with %d workers' %(service.address,
+                                                                              service.workers)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
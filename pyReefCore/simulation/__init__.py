@@ -12,4 +12,8 @@
 
 import coralGLV
 import coreData
+import coreIndex
+import faciesRuns
+import gridData
 import modelPlot
+import outputH5
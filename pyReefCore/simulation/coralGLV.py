@@ -14,7 +14,47 @@ and its interaction with the other species.
 """
 import os
 import numpy
+from collections import deque, OrderedDict
 import odespy
+from scipy import sparse
+from scipy.optimize import brentq
+from scipy.sparse.csgraph import connected_components
+
+# Event types recorded during the GLV integration
+EVENT_TURNON = 0
+EVENT_EXTINCT = 1
+EVENT_MAXPOP = 2
+
+# Maximum number of events kept in the events log, older events are dropped first
+EVENT_LOG_SIZE = 100000
+
+# Maximum number of GLV fixed points cached, the least recently used are dropped first
+FIXED_POINT_CACHE = 64
+
+# Community matrices are stored in compressed sparse row format above this number of species
+# when the fraction of non-zero interactions is below the given density
+SPARSE_MIN_SPECIES = 32
+SPARSE_MAX_DENSITY = 0.1
+
+def communityProduct(alpha):
+    """
+    This function returns the community matrix in compressed sparse row format, the product
+    of the community matrix with a population array, and whether the product is sparse. Sparse
+    matrix-vector products are used for large communities with few interactions.
+
+    Parameters
+    ----------
+
+    variable : alpha
+        Community matrix representing the interactions between species.
+    """
+
+    alphaCSR = sparse.csr_matrix(alpha)
+    density = alphaCSR.nnz/float(max(alpha.size,1))
+    if len(alpha) >= SPARSE_MIN_SPECIES and density <= SPARSE_MAX_DENSITY:
+        return alphaCSR, alphaCSR.dot, True
+
+    return alphaCSR, alpha.dot, False
 
 class coralGLV:
     """
@@ -37,11 +77,157 @@ class coralGLV:
         self.epsilon = input.malthusParam
         # Community matrix representing the interactions between species
         self.alpha = input.communityMatrix
+        self._build_community()
+        # Maximum population number for each species
+        self.maxpop = input.maxpop
+        # Fixed points of the GLV system cached for the latest intrinsic rate vectors
+        self.fixedPoints = OrderedDict()
+        # Environmental factors used during the previous carbonate time step
+        self.lastFac = None
+        # Number of carbonate time steps for which the ODE integration was skipped
+        self.skipNb = 0
+        # Population threshold below which a species is considered extinct during events detection
+        self.minpop = input.minpop
+        # Species for which the population evolution is frozen during the integration
+        self.frozen = None
+        # Events log recorded as (time, species, event type), bounded to the latest events
+        self.events = deque(maxlen=EVENT_LOG_SIZE)
+        # Current coral population
+        self.popNow = numpy.copy(input.speciesPopulation)
         # Coral population record through time
-        self.iterationTime = numpy.arange(input.tStart, input.tEnd+input.tCarb, input.tCarb)
-        self.population = numpy.zeros((input.speciesNb,len(self.iterationTime)),dtype=float)
-        self.accspace = numpy.zeros(len(self.iterationTime),dtype=float)
-        self.mbsl = numpy.zeros(len(self.iterationTime),dtype=float)
+        self.storage = input.storage
+        self.stride = 1
+        if self.storage == 'stride':
+            self.stride = input.storageStride
+        if self.storage == 'layer':
+            self.iterationTime = numpy.arange(input.tStart, input.tEnd+input.laytime, input.laytime)
+        elif self.storage == 'metrics':
+            # Only the streaming run metrics are kept (see the runMetrics module)
+            self.iterationTime = numpy.zeros(0)
+        else:
+            self.iterationTime = numpy.arange(input.tStart, input.tEnd+input.tCarb, input.tCarb)
+            if self.storage == 'stride':
+                self.iterationTime = self.iterationTime[::self.stride]
+        self.population = numpy.zeros((input.speciesNb,len(self.iterationTime)),dtype=input.storageType)
+        self.accspace = numpy.zeros(len(self.iterationTime),dtype=input.storageType)
+        self.mbsl = numpy.zeros(len(self.iterationTime),dtype=input.storageType)
+        # Number of carbonate time steps averaged in each layer record
+        self.popCount = numpy.zeros(len(self.iterationTime),dtype=int)
+        self.accCount = numpy.zeros(len(self.iterationTime),dtype=int)
+        # Number of records per stratigraphic layer
+        self.layStep = 1
+        if self.storage != 'layer':
+            self.layStep = max(int(round(input.laytime/input.tCarb))//self.stride,1)
+
+        return
+
+    def _recordIndex(self, iter, layID):
+        """
+        This function returns the record index of a carbonate time step, or None if the time
+        step is not recorded.
+        """
+
+        if self.storage == 'layer':
+            return layID
+        if self.storage == 'metrics' or iter%self.stride != 0:
+            return None
+
+        return iter//self.stride
+
+    def recordNb(self, iter, layID):
+        """
+        This function returns the number of records written up to a carbonate time step.
+        """
+
+        if self.storage == 'layer':
+            return layID+1
+        if self.storage == 'metrics':
+            return 0
+
+        return iter//self.stride+1
+
+    def storePopulation(self, X, iter, layID):
+        """
+        This function updates the current population and stores it in the population records.
+
+        Parameters
+        ----------
+
+        variable : X
+            Species population distribution at the end of the carbonate time step.
+
+        variable : iter
+            Carbonate time step index.
+
+        variable : layID
+            Stratigraphic layer index.
+        """
+
+        self.popNow = X
+        k = self._recordIndex(iter, layID)
+        if k is None:
+            return
+        if self.storage == 'layer':
+            self.popCount[k] += 1
+            self.population[:,k] += (X-self.population[:,k])/self.popCount[k]
+        else:
+            self.population[:,k] = X
+
+        return
+
+    def storeSea(self, accspace, mbsl, iter, layID):
+        """
+        This function stores the accommodation space and sea-level position records.
+
+        Parameters
+        ----------
+
+        variable : accspace
+            Accommodation space at the start of the carbonate time step.
+
+        variable : mbsl
+            Sea-level position at the start of the carbonate time step.
+
+        variable : iter
+            Carbonate time step index.
+
+        variable : layID
+            Stratigraphic layer index.
+        """
+
+        k = self._recordIndex(iter, layID)
+        if k is None:
+            return
+        if self.storage == 'layer':
+            self.accCount[k] += 1
+            self.accspace[k] += (accspace-self.accspace[k])/self.accCount[k]
+            self.mbsl[k] += (mbsl-self.mbsl[k])/self.accCount[k]
+        else:
+            self.accspace[k] = accspace
+            self.mbsl[k] = mbsl
+
+        return
+
+    def _build_community(self):
+        """
+        This function defines the community matrix storage and finds the groups of species
+        which do not interact with each other. Each group corresponds to a diagonal block of the
+        community matrix and is integrated as an independent GLV system.
+        """
+
+        alphaCSR, self.alphaDot, self.sparse = communityProduct(self.alpha)
+
+        # Independent groups of species are the connected components of the interaction graph
+        blockNb, labels = connected_components(alphaCSR, directed=True, connection='weak')
+        self.blocks = []
+        if blockNb > 1:
+            for b in range(blockNb):
+                ids = numpy.where(labels==b)[0]
+                if self.sparse:
+                    block = alphaCSR[ids,:][:,ids]
+                else:
+                    block = self.alpha[numpy.ix_(ids,ids)]
+                self.blocks.append((ids, block))
 
         return
 
@@ -59,10 +245,263 @@ class coralGLV:
             Time step on which to solve the ODEs for.
         """
 
-        function = numpy.zeros(len(self.epsilon))
+        function = (self.epsilon+self.alphaDot(X))*X
+
+        if self.frozen is not None:
+            function[self.frozen] = 0.
+
+        return function
+
+    def _hermite(self, t, t0, t1, X0, X1, F0, F1):
+        """
+        Cubic Hermite interpolation of the population between two integration time steps.
+        """
+
+        h = t1-t0
+        s = (t-t0)/h
+        h00 = (1.+2.*s)*(1.-s)**2
+        h10 = s*(1.-s)**2
+        h01 = s**2*(3.-2.*s)
+        h11 = s**2*(s-1.)
+
+        return h00*X0+h10*h*F0+h01*X1+h11*h*F1
+
+    def solveEvents(self, X, tODE, fac, facOpt):
+        """
+        This function solves the Generalized Lotka-Volterra equation over a carbonate time step
+        and locates the exact times at which species turn on, go extinct or reach the maximum
+        population. Turn-on and extinction due to environmental factors occur at the beginning
+        of the time step. Crossings of the maximum and minimum population thresholds are found
+        by root-finding on the cubic Hermite interpolant of the solution, the integration is then
+        restarted from the event time with the species population frozen.
+
+        Parameters
+        ----------
+
+        variable : X
+            Species population distribution at current time step.
+
+        variable : tODE
+            Time steps on which to solve the ODEs for.
+
+        variable : fac
+            Environmental factors limiting species activity at current time step.
+
+        variable : facOpt
+            Turn-on criterion for species population growth.
+        """
+
+        X = numpy.copy(X)
+        tNow = tODE[0]
+
+        # Environmental factors prevent any activity
+        ids = numpy.where(numpy.logical_and(self.epsilon==0.,X>0.))[0]
+        X[ids] = 0.
+        for s in ids:
+            self.events.append((tNow,s,EVENT_EXTINCT))
+
+        # Optimal conditions are met for inactive species
+        ids = numpy.where(numpy.logical_and(fac>=facOpt,X==0.))[0]
+        X[ids] = 1.
+        for s in ids:
+            self.events.append((tNow,s,EVENT_TURNON))
+
+        while tNow < tODE[-1]:
+
+            # Extinct species and species at maximum population remain unchanged
+            rate = self.epsilon+self.alphaDot(X)
+            self.frozen = numpy.logical_or(X==0., numpy.logical_and(X>=self.maxpop,rate>=0.))
+            if self.frozen.all():
+                break
+
+            tsteps = numpy.append(tNow, tODE[tODE>tNow])
+            odeRKF = self.solverGLV()
+            odeRKF.set_initial_condition(X)
+            coral,t = odeRKF.solve(tsteps)
+
+            # Find first integration step where a threshold is crossed
+            active = ~self.frozen
+            upper = numpy.logical_and(coral >= self.maxpop, active)
+            lower = numpy.logical_and(coral < self.minpop, active)
+            crossed = numpy.where(numpy.logical_or(upper[1:],lower[1:]).any(axis=1))[0]
+            if len(crossed) == 0:
+                X = coral[-1,:]
+                break
+
+            k = crossed[0]+1
+            t0 = tsteps[k-1]
+            t1 = tsteps[k]
+            X0 = coral[k-1,:]
+            X1 = coral[k,:]
+            F0 = self._functionGLV(X0,t0)
+            F1 = self._functionGLV(X1,t1)
+
+            # Locate earliest crossing time
+            tEvent = t1
+            sEvent = None
+            for s in numpy.where(upper[k,:])[0]:
+                g = lambda tt: self._hermite(tt,t0,t1,X0[s],X1[s],F0[s],F1[s])-self.maxpop
+                tt = brentq(g,t0,t1) if g(t0) < 0. else t0
+                if tt <= tEvent:
+                    tEvent, sEvent, eEvent = tt, s, EVENT_MAXPOP
+            for s in numpy.where(lower[k,:])[0]:
+                g = lambda tt: self._hermite(tt,t0,t1,X0[s],X1[s],F0[s],F1[s])-self.minpop
+                tt = brentq(g,t0,t1) if g(t0) > 0. else t0
+                if tt <= tEvent:
+                    tEvent, sEvent, eEvent = tt, s, EVENT_EXTINCT
+
+            # Update population at event time and apply event
+            X = self._hermite(tEvent,t0,t1,X0,X1,F0,F1)
+            X[X<0.] = 0.
+            if eEvent == EVENT_MAXPOP:
+                X[sEvent] = self.maxpop
+            else:
+                X[sEvent] = 0.
+            self.events.append((tEvent,sEvent,eEvent))
+            tNow = tEvent
+
+        self.frozen = None
+
+        return X
+
+    def eventLog(self):
+        """
+        This function returns the events recorded during the simulation as a structured array
+        with the event time, species index and event type. Only the latest EVENT_LOG_SIZE
+        events are kept.
+        """
+
+        return numpy.array(list(self.events), dtype=[('time',float),('species',numpy.int32),
+                                               ('type',numpy.int8)])
+
+    def _fixedPoint(self, pinned, value):
+        """
+        This function returns the equilibrium of the GLV system for the current intrinsic rate
+        vector and whether it is stable. Species which are extinct or clamped to the maximum
+        population are pinned to their value and the interior fixed point of the remaining
+        species is obtained from X* = -alpha^{-1} (epsilon + alpha_p X_p). The fixed point is
+        stable when all eigenvalues of the Jacobian diag(X*) alpha of the remaining species
+        have negative real parts. The latest FIXED_POINT_CACHE fixed points are cached for
+        each distinct epsilon vector and set of pinned species.
+
+        Parameters
+        ----------
+
+        variable : pinned
+            Boolean array defining the species with a pinned population.
+
+        variable : value
+            Pinned population values.
+        """
+
+        key = self.epsilon.tostring()+pinned.tostring()+value.tostring()
+        if key in self.fixedPoints:
+            # Mark the fixed point as most recently used
+            self.fixedPoints[key] = self.fixedPoints.pop(key)
+            return self.fixedPoints[key]
+
+        xstar = numpy.copy(value)
+        stable = True
+        free = numpy.where(~pinned)[0]
+        if len(free) > 0:
+            rhs = self.epsilon[free]+numpy.dot(self.alpha[numpy.ix_(free,~free)],value[~free])
+            try:
+                xstar[free] = -numpy.linalg.solve(self.alpha[numpy.ix_(free,free)], rhs)
+                jacobian = xstar[free,numpy.newaxis]*self.alpha[numpy.ix_(free,free)]
+                stable = bool((numpy.linalg.eigvals(jacobian).real < 0.).all())
+            except numpy.linalg.LinAlgError:
+                xstar = None
+                stable = False
+        if len(self.fixedPoints) >= FIXED_POINT_CACHE:
+            self.fixedPoints.popitem(last=False)
+        self.fixedPoints[key] = (xstar, stable)
+
+        return self.fixedPoints[key]
+
+    def atEquilibrium(self, X, fac):
+        """
+        This function checks if the species population has converged to a fixed point of the
+        GLV system for unchanged environmental factors. In such case the ODE integration over
+        the carbonate time step can be skipped as the population remains constant.
+
+        Parameters
+        ----------
+
+        variable : X
+            Species population distribution at current time step.
+
+        variable : fac
+            Environmental factors limiting species activity at current time step.
+        """
+
+        if self.lastFac is None or not numpy.array_equal(fac, self.lastFac):
+            self.lastFac = numpy.copy(fac)
+            return False
+
+        # Extinct species remain extinct and species at maximum population stay clamped
+        # as long as their growth rate is positive
+        clamped = X >= self.maxpop
+        if clamped.any():
+            rate = self.epsilon+self.alphaDot(X)
+            if (rate[clamped] < 0.).any():
+                return False
+        pinned = numpy.logical_or(X == 0., clamped)
+        value = numpy.where(clamped, self.maxpop, 0.)
+
+        # Integration is only skipped at stable fixed points
+        xstar, stable = self._fixedPoint(pinned, value)
+        if xstar is None or not stable:
+            return False
+
+        tol = self.rtol*numpy.maximum(numpy.abs(xstar),1.)
+        if (numpy.abs(X-xstar) <= tol).all():
+            self.skipNb += 1
+            return True
+
+        return False
+
+    def solveGLV(self, X, tODE):
+        """
+        This function solves the Generalized Lotka-Volterra equation over a carbonate time step.
+        When the community matrix is block diagonal each group of interacting species is solved
+        as a separate system with its own adaptive time stepping.
+
+        Parameters
+        ----------
+
+        variable : X
+            Species population distribution at current time step.
+
+        variable : tODE
+            Time steps on which to solve the ODEs for.
+        """
+
+        if len(self.blocks) == 0:
+            odeRKF = self.solverGLV()
+            odeRKF.set_initial_condition(X)
+            coral,t = odeRKF.solve(tODE)
+            return coral.T
+
+        population = numpy.zeros((len(X),len(tODE)))
+        for ids, block in self.blocks:
+            # Species without any population remain extinct over the time step
+            if not X[ids].any():
+                continue
+            odeRKF = odespy.Fehlberg(self._blockFunction(self.epsilon[ids], block),
+                                     atol=self.atol, rtol=self.rtol, min_step=self.min_step)
+            odeRKF.set_initial_condition(X[ids])
+            coral,t = odeRKF.solve(tODE)
+            population[ids,:] = coral.T
+
+        return population
+
+    def _blockFunction(self, epsilon, alpha):
+        """
+        This function returns the GLV ODEs of an independent group of species.
+        """
 
-        for eq in range(len(self.epsilon)):
-            function[eq] = (self.epsilon[eq]+numpy.sum(self.alpha[eq,:]*X))*X[eq]
+        def function(X, t):
+            return (epsilon+alpha.dot(X))*X
 
         return function
 
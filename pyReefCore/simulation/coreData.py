@@ -12,13 +12,12 @@ the interactions between the active forcing paramters.
 """
 import os
 import numpy
-import pandas as pd
+from numpy.lib.format import open_memmap
 import skfuzzy as fuzz
 
-import matplotlib
-from matplotlib import gridspec
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mtick
+# Layer records which can be backed by memory-mapped files
+LAYER_RECORDS = ('layTime', 'thickness', 'coralH', 'karstero', 'sealevel', 'sedinput', 'tecrate',
+                 'waterflow', 'nutrient', 'temperature', 'pH')
 
 class coreData:
     """
@@ -39,24 +38,33 @@ class coreData:
         self.prod = input.speciesProduction
         self.names = input.speciesName
 
+        # Layer records are optionally backed by memory-mapped files in the output folder
+        self.memmap = input.memmap
+        self.folder = input.outDir
+
         # Core parameters size based on layer number
         self.layNb = int((input.tEnd - input.tStart)/input.laytime)+1
-        self.thickness = numpy.zeros(self.layNb,dtype=float)
-        self.coralH = numpy.zeros((input.speciesNb+1,self.layNb),dtype=float)
-        self.karstero = numpy.zeros(self.layNb,dtype=float)
+        self.thickness = self._allocate('thickness', self.layNb)
+        self.coralH = self._allocate('coralH', (input.speciesNb+1,self.layNb))
+        self.karstero = self._allocate('karstero', self.layNb)
+
+        # Thickness deposited by each species and sediment, and karst erosion of the last time step
+        self.stepH = numpy.zeros(input.speciesNb+1)
+        self.stepEro = 0.
 
         # Diagonal part of the community matrix (coefficient ii)
         self.communityMatrix = input.communityMatrix
         self.alpha = input.communityMatrix.diagonal()
-        self.layTime = numpy.arange(input.tStart, input.tEnd+input.laytime, input.laytime)
-        self.sealevel = numpy.zeros(len(self.layTime),dtype=float)
-        self.sedinput = numpy.zeros(len(self.layTime),dtype=float)
-        self.tecrate = numpy.zeros(len(self.layTime),dtype=float)
-        self.waterflow = numpy.zeros(len(self.layTime),dtype=float)
-        self.nutrient = numpy.zeros(len(self.layTime),dtype=float)
-        self.temperature = numpy.zeros(len(self.layTime),dtype=float)
-        self.pH = numpy.zeros(len(self.layTime),dtype=float)
-        self.waterflow = numpy.zeros(len(self.layTime),dtype=float)
+        layTime = numpy.arange(input.tStart, input.tEnd+input.laytime, input.laytime)
+        self.layTime = self._allocate('layTime', len(layTime))
+        self.layTime[:] = layTime
+        self.sealevel = self._allocate('sealevel', len(self.layTime))
+        self.sedinput = self._allocate('sedinput', len(self.layTime))
+        self.tecrate = self._allocate('tecrate', len(self.layTime))
+        self.waterflow = self._allocate('waterflow', len(self.layTime))
+        self.nutrient = self._allocate('nutrient', len(self.layTime))
+        self.temperature = self._allocate('temperature', len(self.layTime))
+        self.pH = self._allocate('pH', len(self.layTime))
         self.prodscale = input.prodscale
 
         # Shape functions
@@ -88,9 +96,47 @@ class coreData:
 
         return
 
+    def _allocate(self, name, shape):
+        """
+        Allocate a layer record array, either in memory or as a memory-mapped numpy file
+        (name.npy) in the output folder. Memory-mapped files are the final output records.
+
+        Parameters
+        ----------
+        variable : name
+            Name of the layer record.
+
+        variable : shape
+            Shape of the layer record.
+        """
+
+        if not self.memmap:
+            return numpy.zeros(shape,dtype=float)
+
+        shape = tuple(int(n) for n in numpy.atleast_1d(shape))
+
+        return open_memmap(os.path.join(self.folder,name+'.npy'), mode='w+', dtype=float,
+                           shape=shape)
+
+    def flush(self):
+        """
+        Write memory-mapped layer records to disk.
+        """
+
+        if not self.memmap:
+            return
+
+        for name in LAYER_RECORDS:
+            getattr(self, name).flush()
+
+        return
+
     def _plot_fuzzy_curve(self, xd, xs, xf, dtrap, strap, ftrap, size,
                           dpi, font, colors, width, fname):
 
+        import matplotlib
+        import matplotlib.pyplot as plt
+
         matplotlib.rcParams.update({'font.size': font})
 
         for s in range(len(self.names)):
@@ -146,7 +192,13 @@ class coreData:
             Save filename.
         """
 
+        import matplotlib
+        import pandas as pd
+        from matplotlib import gridspec
+        import matplotlib.pyplot as plt
+        import matplotlib.ticker as mtick
         from matplotlib.cm import terrain
+
         nbcolors = len(self.names)+3
         colors = terrain(numpy.linspace(0, 1, nbcolors))
 
@@ -452,6 +504,9 @@ class coreData:
         if verbose:
             print ' Thick:', toth, '\n Prod:', production, '\n Accom: ', self.topH #, '\n fac: ', envfac
 
+        self.stepH[:] = 0.
+        self.stepEro = 0.
+
         # In case there is no accommodation space
         if self.topH < 0. and ero == 0:
             # Do nothing
@@ -478,12 +533,14 @@ class coreData:
                     self.coralH[:,k] = 0.
                     self.topH += self.thickness[k]
                     self.thickness[k] = 0.
+            self.stepEro = -ero-remero
 
             return
 
         # If there is some accommodation space but it is all filled by sediment
         elif self.topH > 0. and self.topH - sh < 0.:
             # Just add the sediments to the sea-level
+            self.stepH[len(self.prod)] = self.topH
             self.coralH[len(self.prod),layID] += self.topH
             # Update current layer thickness
             self.thickness[layID] += self.topH
@@ -499,6 +556,8 @@ class coreData:
             toth = production.sum() + sh
 
             # Update current layer composition
+            self.stepH[0:len(self.prod)] = production
+            self.stepH[len(self.prod)] = sh
             self.coralH[0:len(self.prod),layID] += production
             # Convert sediment input from m/d to m/a
             self.coralH[len(self.prod),layID] += sh
@@ -510,6 +569,8 @@ class coreData:
         # Otherwise
         elif self.topH > 0.:
             # Update current layer composition
+            self.stepH[0:len(self.prod)] = production
+            self.stepH[len(self.prod)] = sh
             self.coralH[0:len(self.prod),layID] += production
             # Convert sediment input from m/d to m/a
             self.coralH[len(self.prod),layID] += sh
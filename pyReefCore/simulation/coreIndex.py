@@ -0,0 +1,302 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+This module defines a depth index of simulated cores. Depths are measured downward from the
+core top, and the layer composition (thickness deposited by each community and by
+siliciclastic sediment) is assumed uniform within each layer. Point and interval queries use
+binary searches over the layer boundaries, and a whole ensemble of cores is indexed and
+queried at once.
+
+    index = CoreIndex.fromCore(model.core)
+    fractions = index.compositionAt(12.35)
+    proportions, covered = index.resample(0.01)
+"""
+import numpy
+
+
+class CoreIndex(object):
+    """
+    Depth index of one core or of an ensemble of cores.
+    """
+
+    def __init__(self, thickness, coralH, layTime=None, top=0.):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : thickness
+            Layer thickness array (layNb) or ensemble array (memberNb, layNb). Layers are
+            numbered from the core bottom as in coreData.
+
+        variable : coralH
+            Layer composition array (speciesNb+1, layNb) or (memberNb, speciesNb+1, layNb).
+
+        variable : layTime
+            Start time of each layer (layNb) or (memberNb, layNb) (optional, required for the
+            age queries).
+
+        variable : top
+            Water depth of the core top of each core [m] (the core top depth below sea-level
+            is top plus the core depth).
+        """
+
+        thickness = numpy.asarray(thickness, dtype=float)
+        coralH = numpy.asarray(coralH, dtype=float)
+        self.ensemble = thickness.ndim == 2
+        if not self.ensemble:
+            thickness = thickness[numpy.newaxis]
+            coralH = coralH[numpy.newaxis]
+        if coralH.ndim != 3 or coralH.shape[0] != thickness.shape[0] or coralH.shape[2] != thickness.shape[1]:
+            raise ValueError('The core composition shape %s does not match the thickness shape %s.'
+                             %(coralH.shape, thickness.shape))
+
+        self.memberNb, self.layNb = thickness.shape
+        self.componentNb = coralH.shape[1]
+        self.top = numpy.zeros(self.memberNb)+top
+
+        # Depth of the top of each layer and total thickness of each core
+        below = numpy.cumsum(thickness[:,::-1], axis=1)[:,::-1]
+        self.layerTop = below-thickness
+        self.total = numpy.zeros(self.memberNb)
+        if self.layNb > 0:
+            self.total = below[:,0]
+
+        # Non-empty layers ordered from the core top and flattened over the members
+        member, layer = numpy.nonzero(thickness[:,::-1] > 0.)
+        self.member = member
+        self.layer = self.layNb-1-layer
+        self.thickness = thickness[self.member,self.layer]
+        self.depth = self.layerTop[self.member,self.layer]
+        composition = coralH[self.member,:,self.layer].T
+        self.fraction = composition/self.thickness
+        self.cumulative = numpy.zeros((self.componentNb, len(self.member)+1))
+        self.cumulative[:,1:] = numpy.cumsum(composition, axis=1)
+        self.first = numpy.searchsorted(self.member, numpy.arange(self.memberNb))
+
+        # Search keys: members are shifted by more than the thickest core
+        self.offset = 1.
+        if self.memberNb > 0:
+            self.offset += self.total.max()
+        self.keys = self.depth+self.member*self.offset
+
+        # Layer start and end times
+        self.layTime = None
+        if layTime is not None:
+            layTime = numpy.zeros((self.memberNb, self.layNb))+numpy.asarray(layTime, dtype=float)
+            self.layTime = numpy.zeros((self.memberNb, self.layNb+1))
+            self.layTime[:,:-1] = layTime
+            if self.layNb > 1:
+                self.layTime[:,-1] = 2.*layTime[:,-1]-layTime[:,-2]
+
+        return
+
+    @classmethod
+    def fromCore(cls, core):
+        """
+        Index of a simulated core.
+
+        Parameters
+        ----------
+        class : core
+            coreData instance of a model.
+        """
+
+        return cls(core.thickness, core.coralH, core.layTime, core.topH)
+
+    @classmethod
+    def fromRecords(cls, records):
+        """
+        Index of an ensemble of cores given as a list of coreData instances or of dictionaries
+        of layer records (for instance the records of RemoteModel or of the headless runner).
+        Cores with fewer layers are padded with empty layers.
+
+        Parameters
+        ----------
+        variable : records
+            List of core records with thickness, coralH and optionally layTime and topH.
+        """
+
+        def get(record, name):
+            if isinstance(record, dict):
+                return record.get(name)
+            return getattr(record, name, None)
+
+        layNb = max(len(get(r, 'thickness')) for r in records)
+        componentNb = numpy.shape(get(records[0], 'coralH'))[0]
+        thickness = numpy.zeros((len(records), layNb))
+        coralH = numpy.zeros((len(records), componentNb, layNb))
+        layTime = numpy.zeros((len(records), layNb))
+        top = numpy.zeros(len(records))
+        times = True
+        for m, record in enumerate(records):
+            nb = len(get(record, 'thickness'))
+            thickness[m,:nb] = get(record, 'thickness')
+            coralH[m,:,:nb] = get(record, 'coralH')
+            if get(record, 'topH') is not None:
+                top[m] = get(record, 'topH')
+            if get(record, 'layTime') is None or nb < 2:
+                times = False
+                continue
+            layTime[m,:nb] = get(record, 'layTime')
+            layTime[m,nb:] = layTime[m,nb-1]+(layTime[m,nb-1]-layTime[m,nb-2])*numpy.arange(1, layNb-nb+1)
+
+        return cls(thickness, coralH, layTime if times else None, top)
+
+    def _locate(self, depth):
+        """
+        Flat index of the non-empty layers at given depths of each core (-1 outside the
+        cores), and the depths clipped to each core.
+        """
+
+        depth = numpy.asarray(depth, dtype=float)
+        m = numpy.arange(self.memberNb).reshape((self.memberNb,)+(1,)*depth.ndim)
+        clipped = numpy.clip(depth, 0., self.total[m])
+        k = numpy.searchsorted(self.keys, clipped+m*self.offset, side='right')-1
+        found = (k >= 0) & (depth >= 0.) & (depth <= self.total[m])
+        found[found] = self.member[k[found]] == numpy.broadcast_to(m, k.shape)[found]
+        k[~found] = -1
+
+        return k, clipped
+
+    def _shape(self, values):
+        """
+        Remove the member axis of single core results.
+        """
+
+        if self.ensemble:
+            return values
+
+        return values[0]
+
+    def layerAt(self, depth):
+        """
+        Index of the layers at given depths below the core top (-1 outside the core).
+
+        Parameters
+        ----------
+        variable : depth
+            Depth or array of depths [m].
+        """
+
+        k, clipped = self._locate(depth)
+        # Empty cores (not yet deposited, drowned or failed simulations)
+        if len(self.member) == 0:
+            return self._shape(k)
+        layer = numpy.where(k >= 0, self.layer[k], -1)
+
+        return self._shape(layer)
+
+    def compositionAt(self, depth):
+        """
+        Proportion of each community and of siliciclastic sediment at given depths below the
+        core top, as an array (speciesNb+1,)+depth.shape (NaN outside the core).
+
+        Parameters
+        ----------
+        variable : depth
+            Depth or array of depths [m].
+        """
+
+        k, clipped = self._locate(depth)
+        if len(self.member) == 0:
+            return self._shape(numpy.full((self.memberNb, self.componentNb)+k.shape[1:], numpy.nan))
+        fractions = numpy.where(k >= 0, self.fraction[:,k], numpy.nan)
+
+        return self._shape(numpy.rollaxis(fractions, 0, 2))
+
+    def ageAt(self, depth):
+        """
+        Deposition time at given depths below the core top, interpolated linearly within each
+        layer between its end time (layer top) and start time (layer bottom).
+
+        Parameters
+        ----------
+        variable : depth
+            Depth or array of depths [m].
+        """
+
+        if self.layTime is None:
+            raise ValueError('Layer times are required for the age queries.')
+
+        k, clipped = self._locate(depth)
+        if len(self.member) == 0:
+            return self._shape(numpy.full(k.shape, numpy.nan))
+        kk = numpy.maximum(k, 0)
+        m = self.member[kk]
+        frac = (clipped-self.depth[kk])/self.thickness[kk]
+        end = self.layTime[m,self.layer[kk]+1]
+        start = self.layTime[m,self.layer[kk]]
+        age = numpy.where(k >= 0, end+frac*(start-end), numpy.nan)
+
+        return self._shape(age)
+
+    def _accumulated(self, depth):
+        """
+        Thickness of each component between the core top and given depths of each core, as an
+        array (memberNb, speciesNb+1, nb).
+        """
+
+        m = numpy.arange(self.memberNb)[:,numpy.newaxis]
+        if len(self.member) == 0:
+            return numpy.zeros((self.memberNb, self.componentNb, len(depth)))
+        clipped = numpy.clip(numpy.asarray(depth, dtype=float), 0., self.total[m])
+        k = numpy.searchsorted(self.keys, clipped+m*self.offset, side='right')-1
+        kk = numpy.maximum(k, 0)
+        amount = self.cumulative[:,kk]-self.cumulative[:,self.first[m]] + \
+            self.fraction[:,kk]*(clipped-self.depth[kk])
+        amount[:,(k < 0) | (self.member[kk] != m)] = 0.
+
+        return numpy.rollaxis(amount, 0, 2)
+
+    def resample(self, edges):
+        """
+        Resample the cores to depth bins. Returns the thickness-weighted proportion of each
+        community and of siliciclastic sediment in each bin (NaN for bins outside the core)
+        and the core thickness covered by each bin.
+
+        Parameters
+        ----------
+        variable : edges
+            Increasing bin edges [m] below the core top, or a bin size used to cover the
+            thickest core from its top.
+        """
+
+        if numpy.ndim(edges) == 0:
+            step = float(edges)
+            edges = step*numpy.arange(int(numpy.ceil(self.total.max()/step))+1) if self.memberNb > 0 else [0.]
+        edges = numpy.asarray(edges, dtype=float)
+        if edges.ndim != 1 or numpy.any(numpy.diff(edges) < 0.):
+            raise ValueError('Resampling bin edges need to be an increasing array.')
+
+        amount = numpy.diff(self._accumulated(edges), axis=2)
+        covered = numpy.diff(numpy.clip(edges, 0., self.total[:,numpy.newaxis]), axis=1)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            proportions = amount/covered[:,numpy.newaxis]
+        proportions[numpy.broadcast_to(covered[:,numpy.newaxis] <= 0., proportions.shape)] = numpy.nan
+
+        return self._shape(proportions), self._shape(covered)
+
+    def interval(self, top, bottom):
+        """
+        Thickness-weighted proportion of each community and of siliciclastic sediment between
+        two depths below the core top, and core thickness covered by the interval.
+
+        Parameters
+        ----------
+        variable : top
+            Interval top depth [m].
+
+        variable : bottom
+            Interval bottom depth [m].
+        """
+
+        proportions, covered = self.resample([top, bottom])
+
+        return proportions[...,0], covered[...,0]
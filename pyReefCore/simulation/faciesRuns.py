@@ -0,0 +1,286 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+This module defines a run-length encoded representation of a core. Consecutive non-empty
+layers sharing the same dominant facies (community or siliciclastic sediment with the largest
+thickness in the layer) are merged in one run holding its layer range, time span and the
+thickness deposited by each community and by sediment. Runs are built incrementally as
+layers are completed, or from the core layer records, and are exchanged in a small binary
+form (see encode).
+"""
+import struct
+import numpy
+
+# Binary format identifier and version
+MAGIC = 'PRCF'
+VERSION = 1
+HEADER = '<4sBHI'
+
+class faciesRuns(object):
+    """
+    Run-length encoded dominant facies of a core.
+    """
+
+    def __init__(self, componentNb):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : componentNb
+            Number of communities plus one for siliciclastic sediment.
+        """
+
+        self.componentNb = componentNb
+        self.facies = []
+        self.first = []
+        self.last = []
+        self.start = []
+        self.end = []
+        self.amounts = []
+
+        return
+
+    def __len__(self):
+
+        return len(self.facies)
+
+    @staticmethod
+    def _layerEnd(layTime, layID):
+        """
+        End time of a layer.
+        """
+
+        if layID+1 < len(layTime):
+            return float(layTime[layID+1])
+
+        return float(2.*layTime[layID]-layTime[layID-1])
+
+    def _append(self, facies, first, last, start, end, amount):
+        """
+        Extend the last run with a layer of the same facies or start a new run.
+        """
+
+        if len(self.facies) > 0 and self.facies[-1] == facies:
+            self.last[-1] = last
+            self.end[-1] = end
+            self.amounts[-1] = self.amounts[-1]+amount
+        else:
+            self.facies.append(facies)
+            self.first.append(first)
+            self.last.append(last)
+            self.start.append(start)
+            self.end.append(end)
+            self.amounts.append(numpy.array(amount, dtype=float))
+
+        return
+
+    def close(self, core, layID):
+        """
+        Add a completed layer of a core.
+
+        Parameters
+        ----------
+        class : core
+            coreData instance.
+
+        variable : layID
+            Index of the completed layer.
+        """
+
+        if core.thickness[layID] <= 0.:
+            return
+        amount = core.coralH[:,layID]
+        self._append(int(numpy.argmax(amount)), layID, layID, float(core.layTime[layID]),
+                     self._layerEnd(core.layTime, layID), amount)
+
+        return
+
+    def erode(self, core):
+        """
+        Update the runs after karst erosion of the core top: layers entirely removed are
+        dropped and the composition of the top run is read again from the core records.
+
+        Parameters
+        ----------
+        class : core
+            coreData instance.
+        """
+
+        if len(self.facies) == 0:
+            return
+        k = self.last[-1]
+        while k >= 0 and core.thickness[k] <= 0.:
+            k -= 1
+        while len(self.facies) > 0 and self.first[-1] > k:
+            for runs in (self.facies, self.first, self.last, self.start, self.end, self.amounts):
+                runs.pop()
+        if len(self.facies) > 0:
+            self.last[-1] = k
+            self.end[-1] = self._layerEnd(core.layTime, k)
+            self.amounts[-1] = numpy.asarray(core.coralH[:,self.first[-1]:k+1]).sum(axis=1)
+
+        return
+
+    def snapshot(self, core, layID):
+        """
+        Copy of the runs including the current incomplete layer.
+
+        Parameters
+        ----------
+        class : core
+            coreData instance.
+
+        variable : layID
+            Index of the current layer.
+        """
+
+        runs = faciesRuns(self.componentNb)
+        runs.facies = list(self.facies)
+        runs.first = list(self.first)
+        runs.last = list(self.last)
+        runs.start = list(self.start)
+        runs.end = list(self.end)
+        runs.amounts = list(self.amounts)
+        if layID < len(core.thickness):
+            runs.close(core, layID)
+
+        return runs
+
+    @classmethod
+    def fromLayers(cls, thickness, coralH, layTime):
+        """
+        Runs of the layer records of a core.
+
+        Parameters
+        ----------
+        variable : thickness
+            Layer thickness array.
+
+        variable : coralH
+            Layer composition array (speciesNb+1, layNb).
+
+        variable : layTime
+            Start time of each layer.
+        """
+
+        coralH = numpy.asarray(coralH, dtype=float)
+        layTime = numpy.asarray(layTime, dtype=float)
+        runs = cls(len(coralH))
+        ids = numpy.where(numpy.asarray(thickness) > 0.)[0]
+        if len(ids) == 0:
+            return runs
+
+        facies = numpy.argmax(coralH[:,ids], axis=0)
+        starts = numpy.concatenate(([0], numpy.where(numpy.diff(facies) != 0)[0]+1))
+        ends = numpy.concatenate((starts[1:], [len(ids)]))-1
+        runs.facies = facies[starts].tolist()
+        runs.first = ids[starts].tolist()
+        runs.last = ids[ends].tolist()
+        runs.start = layTime[ids[starts]].tolist()
+        runs.end = [cls._layerEnd(layTime, k) for k in runs.last]
+        runs.amounts = list(numpy.add.reduceat(coralH[:,ids], starts, axis=1).T)
+
+        return runs
+
+    @classmethod
+    def fromCore(cls, core):
+        """
+        Runs of a simulated core.
+
+        Parameters
+        ----------
+        class : core
+            coreData instance.
+        """
+
+        return cls.fromLayers(core.thickness, core.coralH, core.layTime)
+
+    def thickness(self):
+        """
+        Thickness of each run.
+        """
+
+        return numpy.array([a.sum() for a in self.amounts])
+
+    def transitions(self):
+        """
+        Number of dominant facies transitions.
+        """
+
+        return max(len(self.facies)-1, 0)
+
+    def transitionCounts(self):
+        """
+        Matrix of the number of transitions from the facies of the row index (below) to the
+        facies of the column index (above).
+        """
+
+        counts = numpy.zeros((self.componentNb, self.componentNb), dtype=int)
+        if len(self.facies) > 1:
+            numpy.add.at(counts, (self.facies[:-1], self.facies[1:]), 1)
+
+        return counts
+
+    def encode(self):
+        """
+        Binary representation: a header (format identifier, version, number of components and
+        of runs) followed by the little-endian arrays of the run facies (uint16), first and
+        last layers (uint32), start and end times (float64) and component thickness (float32).
+        """
+
+        n = len(self.facies)
+        amounts = numpy.zeros((n, self.componentNb))
+        if n > 0:
+            amounts = numpy.array(self.amounts)
+
+        return struct.pack(HEADER, MAGIC, VERSION, self.componentNb, n) + \
+            numpy.asarray(self.facies, dtype='<u2').tobytes() + \
+            numpy.asarray(self.first, dtype='<u4').tobytes() + \
+            numpy.asarray(self.last, dtype='<u4').tobytes() + \
+            numpy.asarray(self.start, dtype='<f8').tobytes() + \
+            numpy.asarray(self.end, dtype='<f8').tobytes() + \
+            amounts.astype('<f4').tobytes()
+
+    @classmethod
+    def decode(cls, data):
+        """
+        Runs of a binary representation produced by encode.
+
+        Parameters
+        ----------
+        string : data
+            Binary representation.
+        """
+
+        size = struct.calcsize(HEADER)
+        if len(data) < size:
+            raise ValueError('Facies runs data is truncated.')
+        magic, version, componentNb, n = struct.unpack(HEADER, data[:size])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Unknown facies runs format.')
+        if len(data) != size+n*(2+4+4+8+8+4*componentNb):
+            raise ValueError('Facies runs data is truncated.')
+
+        runs = cls(componentNb)
+        offset = size
+        arrays = []
+        for dtype, count in (('<u2', n), ('<u4', n), ('<u4', n), ('<f8', n), ('<f8', n),
+                             ('<f4', n*componentNb)):
+            array = numpy.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes
+            arrays.append(array)
+        runs.facies = arrays[0].astype(int).tolist()
+        runs.first = arrays[1].astype(int).tolist()
+        runs.last = arrays[2].astype(int).tolist()
+        runs.start = arrays[3].tolist()
+        runs.end = arrays[4].tolist()
+        runs.amounts = list(arrays[5].astype(float).reshape(n, componentNb))
+
+        return runs
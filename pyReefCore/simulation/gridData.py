@@ -0,0 +1,324 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+This module builds the records of a platform grid made of many reef cores sharing the same
+time dependent forcing conditions. Communities evolution and carbonate production are
+computed for all cores at once.
+"""
+import numpy
+import odespy
+from coralGLV import communityProduct
+
+# Position of the time dependent forcing values shared by all cores in a forcing record
+FRC_TNOW = 0
+FRC_TCORAL = 1
+FRC_TEC = 2
+FRC_SEA = 3
+FRC_TEMP = 4
+FRC_PH = 5
+FRC_NU = 6
+FRC_SIZE = 7
+
+class gridData:
+    """
+    This class defines the platform grid cores parameters.
+    """
+
+    def __init__(self, input = None, depth0 = None, buffers = None):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        class: input
+            Input parameter class.
+
+        variable : depth0
+            Initial depth of each core.
+
+        variable : buffers
+            Dictionary of preallocated arrays holding the cores state (optional).
+        """
+
+        self.dt = input.tCarb
+        self.cellNb = len(depth0)
+        self.speciesNb = input.speciesNb
+        self.layNb = int((input.tEnd - input.tStart)/input.laytime)+1
+
+        # Communities parameters
+        self.prod = input.speciesProduction
+        self.prodscale = input.prodscale
+        self.malthus = input.malthusParam
+        self.alpha = input.communityMatrix
+        self.alphaDot = communityProduct(self.alpha)[1]
+        self.maxpop = input.maxpop
+        self.facOpt = input.facOpt
+        self.karstRate = input.karstRate
+
+        # Active forcing
+        self.tecOn = input.tecOn
+        self.seaOn = input.seaOn
+        self.sedOn = input.sedOn
+        self.flowOn = input.flowOn
+
+        # RKF parameters
+        self.rtol = 1.e-6
+        self.atol = self.rtol
+        self.min_step = 1.e-4
+        self.epsilon = None
+
+        # Cores state
+        if buffers is None:
+            buffers = {}
+            for name, shape in gridData.arrayShapes(input, self.cellNb).items():
+                buffers[name] = numpy.zeros(shape,dtype=float)
+            buffers['topH'][:] = depth0
+            buffers['population'][:] = input.speciesPopulation[:,numpy.newaxis]
+        self.topH = buffers['topH']
+        self.population = buffers['population']
+        self.thickness = buffers['thickness']
+        self.coralH = buffers['coralH']
+        self.karstero = buffers['karstero']
+        self.sedinput = buffers['sedinput']
+        self.waterflow = buffers['waterflow']
+
+        return
+
+    @staticmethod
+    def arrayShapes(input, cellNb):
+        """
+        Shape of the arrays defining the state of a platform grid.
+
+        Parameters
+        ----------
+        class: input
+            Input parameter class.
+
+        variable : cellNb
+            Number of cores in the grid.
+        """
+
+        layNb = int((input.tEnd - input.tStart)/input.laytime)+1
+
+        return {'topH': (cellNb,),
+                'population': (input.speciesNb,cellNb),
+                'thickness': (layNb,cellNb),
+                'coralH': (layNb,input.speciesNb+1,cellNb),
+                'karstero': (layNb,cellNb),
+                'sedinput': (layNb,cellNb),
+                'waterflow': (layNb,cellNb)}
+
+    def _functionGLV(self, X, t):
+        """
+        This function solves the ODEs defining the Generalized Lotka-Volterra equation for
+        a set of cores.
+
+        Parameters
+        ----------
+
+        variable : X
+            Flattened species population distribution of the cores at current time step.
+
+        variable : t
+            Time step on which to solve the ODEs for.
+        """
+
+        pop = X.reshape(self.speciesNb,-1)
+
+        return ((self.epsilon+self.alphaDot(pop))*pop).ravel()
+
+    def solverGLV(self):
+        """
+        This function build the RKF solver used for the Generalized Lotka-Volterra equation.
+        """
+
+        # RKF initialisation
+        odeRKF = odespy.Fehlberg(self._functionGLV, atol=self.atol,
+                                   rtol=self.rtol, min_step=self.min_step)
+
+        return odeRKF
+
+    def step(self, force, frc, layID, N=100):
+        """
+        This function advances all cores of the grid over one carbonate time step.
+
+        Parameters
+        ----------
+
+        class : force
+            Environmental forcing class.
+
+        variable : frc
+            Time dependent forcing values shared by all cores.
+
+        variable : layID
+            Index of current stratigraphic layer.
+
+        variable : N
+            Number of iterations for the ODE during the time step.
+        """
+
+        fac = numpy.ones((self.speciesNb,self.cellNb),dtype=float)
+
+        # Get tectonic and sea-level
+        if self.tecOn:
+            self.topH += frc[FRC_TEC]
+            fac = force.depthFactors(self.topH)
+        if self.seaOn:
+            self.topH += frc[FRC_SEA]
+            fac = force.depthFactors(self.topH)
+
+        # Get sediment input
+        sedh = numpy.zeros(self.cellNb,dtype=float)
+        if self.sedOn:
+            sedh = force.getSedLevel(frc[FRC_TNOW], self.topH)
+            fac = numpy.minimum(fac, force.sedFactors(sedh))
+            self.sedinput[layID] = sedh
+
+        # Get flow velocity
+        if self.flowOn:
+            flowh = force.getFlowLevel(frc[FRC_TNOW], self.topH)
+            fac = numpy.minimum(fac, force.flowFactors(flowh))
+            self.waterflow[layID] = flowh
+
+        # Limit species activity from environmental forces
+        fac = numpy.minimum(fac, frc[[FRC_TEMP,FRC_PH,FRC_NU]].min())
+        self.epsilon = self.malthus[:,numpy.newaxis]*fac
+
+        # Solve the Generalized Lotka-Volterra equation for active cores
+        active = numpy.where(numpy.logical_and(self.topH>0.,
+                                               self.population.any(axis=0)))[0]
+        if len(active) > 0:
+            allepsilon = self.epsilon
+            self.epsilon = allepsilon[:,active]
+            odeRKF = self.solverGLV()
+            odeRKF.set_initial_condition(self.population[:,active].ravel())
+            tODE = numpy.linspace(frc[FRC_TNOW], frc[FRC_TCORAL], N+1)
+            coral,t = odeRKF.solve(tODE)
+            self.population[:,active] = coral[-1].reshape(self.speciesNb,-1)
+            self.epsilon = allepsilon
+
+        # Update coral population
+        population = self.population
+        population[population>self.maxpop] = self.maxpop
+        population[self.epsilon==0.] = 0.
+        population[numpy.logical_and(fac>=self.facOpt,population==0.)] = 1.
+
+        # In case there is no accommodation space
+        ero = numpy.zeros(self.cellNb,dtype=float)
+        dry = numpy.where(self.topH<=0.)[0]
+        if len(dry) > 0:
+            population[:,dry] = 0.
+            ero[dry] = numpy.maximum(-self.karstRate*self.dt, self.topH[dry])
+
+        # Compute carbonate production and update cores characteristics
+        self.coralProduction(layID, sedh, ero)
+
+        return
+
+    def coralProduction(self, layID, sedh, ero):
+        """
+        This function estimates the coral growth based on newly computed population for all cores.
+
+        Parameters
+        ----------
+
+        variable : layID
+            Index of current stratigraphic layer.
+
+        variable : sedh
+            Silicilastic sediment input m/d for each core
+
+        variable : ero
+            Amount of erosion due to karstification for each core
+        """
+
+        # Compute production for the given time step [m]
+        production = numpy.zeros((self.population.shape))
+        ids = self.epsilon>0.
+        prod = self.prod[:,numpy.newaxis]*numpy.ones(self.cellNb)
+        production[ids] = prod[ids]*self.population[ids]*self.dt/self.prodscale
+        production = numpy.minimum(production, self.prod[:,numpy.newaxis]*self.dt)
+
+        # Total thickness deposited
+        sh = sedh*self.dt
+        prodh = production.sum(axis=0)
+        toth = prodh+sh
+        top = self.topH
+
+        # Cores with some accommodation space
+        wet = top>0.
+        karst = numpy.logical_and(top<0.,ero<0.)
+
+        # In case there is no accommodation space and karstification is activated
+        if karst.any():
+            self._karstErosion(layID, numpy.where(karst,-ero,0.))
+
+        # If there is some accommodation space but it is all filled by sediment
+        filled = numpy.logical_and(wet,top-sh<0.)
+        ids = numpy.where(filled)[0]
+        self.coralH[layID,-1,ids] += top[ids]
+        self.thickness[layID,ids] += top[ids]
+        top[ids] = 0.
+
+        # If there is some accommodation space that will disappear due to a
+        # combination of carbonate growth and sediment input
+        wet[filled] = False
+        limited = numpy.logical_and(wet,top-toth<0.)
+        ids = numpy.where(limited)[0]
+        production[:,ids] *= (top[ids]-sh[ids])/prodh[ids]
+        toth[ids] = production[:,ids].sum(axis=0)+sh[ids]
+
+        # Update cores with accommodation space
+        ids = numpy.where(wet)[0]
+        self.coralH[layID,:-1,ids] += production[:,ids].T
+        self.coralH[layID,-1,ids] += sh[ids]
+        self.thickness[layID,ids] += toth[ids]
+        top[ids] -= toth[ids]
+
+        return
+
+    def _karstErosion(self, layID, remero):
+        """
+        This function erodes the cores stratigraphic layers due to karstification.
+
+        Parameters
+        ----------
+
+        variable : layID
+            Index of current stratigraphic layer.
+
+        variable : remero
+            Thickness to erode for each core.
+        """
+
+        for k in range(layID,-1,-1):
+            ero = remero>0.
+            if not ero.any():
+                break
+            th = self.thickness[k]
+
+            # Layers partly eroded
+            ids = numpy.where(numpy.logical_and(ero,th>remero))[0]
+            perc = remero[ids]/th[ids]
+            th[ids] -= remero[ids]
+            self.karstero[k,ids] += remero[ids]
+            self.topH[ids] += remero[ids]
+            self.coralH[k,:,ids] -= perc[:,numpy.newaxis]*self.coralH[k,:,ids]
+            remero[ids] = 0.
+
+            # Layers fully eroded
+            ids = numpy.where(numpy.logical_and(ero,remero>0.))[0]
+            remero[ids] -= th[ids]
+            self.karstero[k,ids] += th[ids]
+            self.coralH[k,:,ids] = 0.
+            self.topH[ids] += th[ids]
+            th[ids] = 0.
+
+        return
@@ -10,14 +10,9 @@
 Here we set plotting functions used to visualise pyReef dataset.
 """
 
-import matplotlib
 import numpy as np
-import pandas as pd
-from matplotlib import gridspec
-import matplotlib.pyplot as plt
-
-from scipy.ndimage.filters import gaussian_filter
-from matplotlib.ticker import FormatStrFormatter
+from coreIndex import CoreIndex
+from faciesRuns import faciesRuns
 
 import warnings
 warnings.simplefilter(action = "ignore", category = FutureWarning)
@@ -52,10 +47,34 @@ class modelPlot():
         self.pH = None
         self.temperature = None
         self.nutrient = None
+        self.index = None
+        self.runs = None
         self.folder = input.outDir
 
         return
 
+    def coreIndex(self):
+        """
+        Depth index of the plotted core layers, built once per simulation update (the last layer
+        record is not plotted).
+        """
+
+        if self.index is None:
+            self.index = CoreIndex(self.depth[:-1], self.sedH[:,:-1], self.timeLay[:-1], self.surf)
+
+        return self.index
+
+    def coreRuns(self):
+        """
+        Run-length encoded dominant facies of the plotted core layers, built once per simulation
+        update.
+        """
+
+        if self.runs is None:
+            self.runs = faciesRuns.fromLayers(self.depth[:-1], self.sedH[:,:-1], self.timeLay[:-1])
+
+        return self.runs
+
     def two_scales(self, ax1, time, data0, data1, c1, c2, font):
         """
 
@@ -172,6 +191,9 @@ class modelPlot():
             Save PNG filename.
         """
 
+        import matplotlib
+        import matplotlib.pyplot as plt
+
         matplotlib.rcParams.update({'font.size': font})
 
         if colors is not None:
@@ -271,6 +293,9 @@ class modelPlot():
             Save PNG filename.
         """
 
+        import matplotlib
+        import matplotlib.pyplot as plt
+
         matplotlib.rcParams.update({'font.size': font})
 
         # Define figure size
@@ -324,6 +349,9 @@ class modelPlot():
             Save PNG filename.
         """
 
+        import matplotlib
+        import matplotlib.pyplot as plt
+
         matplotlib.rcParams.update({'font.size': font})
 
         # Define figure size
@@ -333,8 +361,11 @@ class modelPlot():
         # Plotting curves
         bottom = self.surf + self.depth.sum()
         d = bottom - np.cumsum(self.depth)
+        # Population records sampled at each stratigraphic layer
+        pop = self.pop[:,::self.step]
+        nb = min(len(d),pop.shape[1])
         for s in range(len(self.pop)):
-            ax.plot(d, self.pop[s,::self.step], label=self.names[s],linewidth=3,c=colors[s])
+            ax.plot(d[:nb], pop[s,:nb], label=self.names[s],linewidth=3,c=colors[s])
 
         # Legend, title and labels
         plt.grid()
@@ -404,6 +435,10 @@ class modelPlot():
             Separator used in the CSV file.
         """
 
+        import pandas as pd
+        from matplotlib import gridspec
+        import matplotlib.pyplot as plt
+
         p1 = self.sedH[:,:-1]
         ids = np.where(self.depth[:-1]>0)[0]
         p2 = np.zeros((self.sedH.shape))
@@ -411,9 +446,10 @@ class modelPlot():
         p6 = self.karstero[:-1]
         p2[:,ids] = self.sedH[:,ids]/self.depth[ids]
         p3[:,ids] = np.cumsum(self.sedH[:,ids]/self.depth[ids],axis=0)
-        bottom = self.surf + self.depth[:-1].sum()
-        d = bottom - np.cumsum(self.depth[:-1])
-        facies = np.argmax(p1, axis=0)
+        index = self.coreIndex()
+        bottom = self.surf + index.total[0]
+        d = self.surf + index.layerTop[0]
+        runs = self.coreRuns()
 
         if thext == None:
             thext = [0.,p1.max()]
@@ -464,6 +500,10 @@ class modelPlot():
         ax42.yaxis.tick_right()
         ax52.plot(tmpx, d, zorder=1)
         ax52.yaxis.tick_right()
+        for r in range(len(runs)):
+            y[0] = d[runs.first[r]] + self.depth[runs.first[r]]
+            y[1] = d[runs.last[r]]
+            ax5.fill_between(x, [y[0],y[0]], [y[1],y[1]], color=colsed[runs.facies[r]], zorder=10)
         ticks = []
         ttime = []
         p = 0
@@ -471,7 +511,6 @@ class modelPlot():
             y[0] = d[s]
             y[1] = d[s]
             ax4.fill_between(x, old, y, color=coltime[s], zorder=10)
-            ax5.fill_between(x, old, y, color=colsed[facies[s]], zorder=10)
             old[0] = y[0]
             old[1] = y[1]
             p += 1
@@ -0,0 +1,175 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+This module writes and reads pyReefCore simulation histories in a chunked and compressed
+HDF5 file. Records at the carbonate time step resolution are stored in the carbonate group
+and records at the stratigraphic layer resolution in the layer group. Each dataset is attached
+to its time dimension scale so a single variable or time window can be read back directly.
+"""
+import numpy
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# Number of time records stored in each HDF5 chunk
+CHUNK_SIZE = 4096
+
+# Variables recorded at the carbonate time step resolution
+CARB_VARIABLES = ('population', 'accspace', 'mbsl')
+
+# Variables recorded at the stratigraphic layer resolution
+LAYER_VARIABLES = ('thickness', 'coralH', 'karstero', 'sealevel', 'sedinput', 'tecrate',
+                   'waterflow', 'nutrient', 'temperature', 'pH')
+
+def _check_h5py():
+    """
+    Ensure the optional h5py library is available.
+    """
+
+    if h5py is None:
+        raise ImportError('The h5py library is required to read and write pyReefCore HDF5 outputs.')
+
+    return
+
+def _write_group(group, timename, time, data, complevel):
+    """
+    Write the records sharing the same time dimension in a HDF5 group.
+
+    Parameters
+    ----------
+
+    variable : group
+        HDF5 group to write in.
+
+    variable : timename
+        Name of the time dimension.
+
+    variable : time
+        Time coordinate of the records.
+
+    variable : data
+        Dictionary of arrays with time as last dimension.
+
+    variable : complevel
+        Gzip compression level.
+    """
+
+    tds = group.create_dataset(timename, data=time)
+    tds.attrs['units'] = 'years'
+    tds.make_scale(timename)
+
+    for name in data:
+        values = numpy.asarray(data[name])
+        if values.size == 0:
+            # Empty records (for instance with the metrics storage mode) cannot be chunked
+            ds = group.create_dataset(name, data=values)
+        else:
+            chunks = values.shape[:-1]+(min(CHUNK_SIZE,values.shape[-1]),)
+            ds = group.create_dataset(name, data=values, chunks=chunks, shuffle=True,
+                                      compression='gzip', compression_opts=complevel)
+        ds.dims[values.ndim-1].attach_scale(tds)
+        ds.dims[values.ndim-1].label = timename
+        if values.ndim > 1:
+            ds.dims[0].label = 'community'
+
+    return
+
+def writeH5(filename, coral, core, complevel=4):
+    """
+    Write the simulation histories to a HDF5 file.
+
+    Parameters
+    ----------
+
+    variable : filename
+        HDF5 file name.
+
+    class : coral
+        Generalized Lotka-Volterra class holding the carbonate time step records.
+
+    class : core
+        Core data class holding the stratigraphic layer records.
+
+    variable : complevel
+        Gzip compression level.
+    """
+
+    _check_h5py()
+
+    with h5py.File(filename, 'w') as f:
+        f.attrs['names'] = numpy.array(core.names, dtype='S14')
+        f.attrs['surface'] = core.topH
+
+        data = {}
+        for name in CARB_VARIABLES:
+            data[name] = getattr(coral, name)
+        _write_group(f.create_group('carbonate'), 'time', coral.iterationTime, data, complevel)
+
+        data = {}
+        for name in LAYER_VARIABLES:
+            data[name] = getattr(core, name)
+        _write_group(f.create_group('layer'), 'time', core.layTime, data, complevel)
+
+    return
+
+def readH5(filename, name, tStart=None, tEnd=None):
+    """
+    Read a single variable from a HDF5 output file for a given time window. Only the
+    requested slice of the dataset is read from the file. Empty arrays are returned for
+    histories that were not stored.
+
+    Parameters
+    ----------
+
+    variable : filename
+        HDF5 file name.
+
+    variable : name
+        Name of the variable to read.
+
+    variable : tStart
+        Start of the time window (default is the simulation start time).
+
+    variable : tEnd
+        End of the time window (default is the simulation end time).
+    """
+
+    _check_h5py()
+
+    if name in CARB_VARIABLES:
+        group = 'carbonate'
+    elif name in LAYER_VARIABLES:
+        group = 'layer'
+    else:
+        raise ValueError('Unknown pyReefCore output variable: %s' %name)
+
+    with h5py.File(filename, 'r') as f:
+        # Histories not stored by the simulation
+        if group not in f or name not in f[group]:
+            return numpy.zeros(0), numpy.zeros(0)
+        if f[group]['time'].shape[0] == 0:
+            return f[group]['time'][...], f[group][name][...]
+
+        # Records are regularly spaced in time
+        tds = f[group]['time']
+        nb = tds.shape[0]
+        t0, t1 = tds[0:2] if nb > 1 else (tds[0], tds[0]+1.)
+        dt = t1-t0
+        start = 0
+        end = nb
+        if tStart is not None:
+            start = min(max(int(numpy.ceil((tStart-t0)/dt-1.e-9)),0),nb)
+        if tEnd is not None:
+            end = min(max(int(numpy.floor((tEnd-t0)/dt+1.e-9))+1,start),nb)
+        time = tds[start:end]
+        values = f[group][name][...,start:end]
+
+    return time, values
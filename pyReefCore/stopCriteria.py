@@ -0,0 +1,165 @@
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+##                                                                                   ##
+##  This file forms part of the pyReefCore synthetic coral reef core model app.      ##
+##                                                                                   ##
+##  For full license and copyright information, please refer to the LICENSE.md file  ##
+##  located at the project root, or contact the authors.                             ##
+##                                                                                   ##
+##~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~#~##
+"""
+   pyReefCore simulation stop criteria.
+
+   Stop criteria are passed to Model.steps or Model.run_to_time to end a simulation before its
+   end time. Each criterion is evaluated after every carbonate time step and returns True when
+   the simulation should stop. Example:
+
+       model.run_to_time(tEnd, stop=[drowning(layers=5), extinction(layers=10)])
+"""
+
+
+class stopCriterion(object):
+    """
+    Base class of the simulation stop criteria.
+    """
+
+    reason = 'stop criterion'
+
+    def reset(self, model):
+        """
+        Initialise the criterion state at the start of a simulation run.
+        """
+
+        self.layID = model.layID
+
+        return
+
+    def _layerClosed(self, model):
+        """
+        Check if a stratigraphic layer has been completed during the last time step.
+        """
+
+        if model.layID == self.layID:
+            return False
+        self.layID = model.layID
+
+        return True
+
+    def __call__(self, model):
+
+        return False
+
+
+class drowning(stopCriterion):
+    """
+    Stop the simulation when the core top remains deeper than the deepest water depth
+    trapezoid of all species for a given number of consecutive layers.
+    """
+
+    reason = 'reef drowned'
+
+    def __init__(self, layers=1):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : layers
+            Number of consecutive drowned layers.
+        """
+
+        self.layers = layers
+
+        return
+
+    def reset(self, model):
+
+        stopCriterion.reset(self, model)
+        self.count = 0
+        self.depth = model.drownDepth
+
+        return
+
+    def __call__(self, model):
+
+        if self.depth is None or not self._layerClosed(model):
+            return False
+
+        if model.core.topH > self.depth:
+            self.count += 1
+        else:
+            self.count = 0
+
+        return self.count >= self.layers
+
+
+class extinction(stopCriterion):
+    """
+    Stop the simulation when the total coral population remains null over a given number of
+    consecutive layers.
+    """
+
+    reason = 'no coral population'
+
+    def __init__(self, layers=1):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : layers
+            Number of consecutive layers without coral population.
+        """
+
+        self.layers = layers
+
+        return
+
+    def reset(self, model):
+
+        stopCriterion.reset(self, model)
+        self.count = 0
+        self.alive = False
+
+        return
+
+    def __call__(self, model):
+
+        if model.coral.popNow.sum() > 0.:
+            self.alive = True
+
+        if not self._layerClosed(model):
+            return False
+
+        if self.alive:
+            self.count = 0
+        else:
+            self.count += 1
+        self.alive = False
+
+        return self.count >= self.layers
+
+
+class thicknessTarget(stopCriterion):
+    """
+    Stop the simulation when the core reaches a given thickness.
+    """
+
+    reason = 'thickness target reached'
+
+    def __init__(self, thickness):
+        """
+        Constructor.
+
+        Parameters
+        ----------
+        variable : thickness
+            Target core thickness [m].
+        """
+
+        self.thickness = thickness
+
+        return
+
+    def __call__(self, model):
+
+        return model.core.thickness.sum() >= self.thickness
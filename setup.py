@@ -3,6 +3,8 @@
 """
 setup.py for pyReefCore
 """
+# setuptools is imported first so that numpy.distutils supports entry points
+import setuptools
 from numpy.distutils.core import setup, Extension
 
 ext_modules = []
@@ -17,8 +19,11 @@ setup(
     classifiers=[
         "Development Status :: 1 - Alpha",
     ],
-    packages=['pyReefCore'],
+    packages=['pyReefCore', 'pyReefCore.forcing', 'pyReefCore.simulation'],
     ext_package='pyReefCore',
     ext_modules=ext_modules,
     scripts=[],
+    entry_points={
+        'console_scripts': ['pyreefcore = pyReefCore.cli:main'],
+    },
 )